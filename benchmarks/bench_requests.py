@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""End-to-end benchmarks of the request pipeline through the flask test client
+
+Every scenario is run against a database filled with synthetic data at one or several scales. For each scenario the
+throughput, the p50 / p99 latencies and the peak memory allocated while serving the request are reported. Results can
+be saved as a machine-readable baseline and later runs compared against it to catch regressions in compute_schema,
+QueryStringManager or SqlalchemyDataLayer.
+
+The package must be importable (pip install -e .). Usage::
+
+    python benchmarks/bench_requests.py --rows 1000 100000 --output baseline.json
+    python benchmarks/bench_requests.py --rows 1000 100000 --compare baseline.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import flask
+import marshmallow
+import sqlalchemy
+
+from models import create_app, create_database
+
+CONTENT_TYPE = 'application/vnd.api+json'
+
+
+def scenarios(rows):
+    """Return the benchmark scenarios for a given scale
+
+    A scenario is a dict with a name, an http method, an url, an optional payload and the expected status code.
+
+    :param int rows: the number of rows in the database
+    :return list: the scenarios
+    """
+    middle = max(rows // 2, 1)
+    filter_ = json.dumps([{'name': 'name', 'op': 'eq', 'val': 'person-{}'.format(middle)}])
+
+    def patch_payload():
+        return {'data': {'type': 'person', 'id': str(middle), 'attributes': {'email': 'patched@example.com'}}}
+
+    def post_payload():
+        return {'data': {'type': 'computer',
+                         'attributes': {'serial': 'bench'},
+                         'relationships': {'owner': {'data': {'type': 'person', 'id': str(middle)}}}}}
+
+    def relationship_payload():
+        return {'data': [{'type': 'computer', 'id': str(middle)}]}
+
+    return [
+        {'name': 'list', 'method': 'get', 'url': '/persons'},
+        {'name': 'list_include', 'method': 'get', 'url': '/persons?include=computers'},
+        {'name': 'list_fields', 'method': 'get', 'url': '/persons?fields[person]=name'},
+        {'name': 'list_filter', 'method': 'get', 'url': '/persons?filter=' + filter_},
+        {'name': 'list_simple_filter', 'method': 'get', 'url': '/persons?filter[name]=person-{}'.format(middle)},
+        {'name': 'list_sort', 'method': 'get', 'url': '/persons?sort=-name'},
+        {'name': 'list_deep_page', 'method': 'get', 'url': '/persons?page[number]={}'.format(max(rows // 30, 1))},
+        {'name': 'list_combined',
+         'method': 'get',
+         'url': '/persons?include=computers&fields[person]=name,computers&sort=-name&filter[email]=x'},
+        {'name': 'detail', 'method': 'get', 'url': '/persons/{}'.format(middle)},
+        {'name': 'detail_include', 'method': 'get', 'url': '/persons/{}?include=computers'.format(middle)},
+        {'name': 'post', 'method': 'post', 'url': '/computers', 'payload': post_payload, 'status': 201},
+        {'name': 'patch', 'method': 'patch', 'url': '/persons/{}'.format(middle), 'payload': patch_payload},
+        {'name': 'relationship_get', 'method': 'get', 'url': '/persons/{}/relationships/computers'.format(middle)},
+        {'name': 'relationship_post',
+         'method': 'post',
+         'url': '/persons/{}/relationships/computers'.format(middle),
+         'payload': relationship_payload,
+         'status': 204},
+        {'name': 'error_not_found',
+         'method': 'get',
+         'url': '/persons/{}/relationships/computers'.format(rows + 1),
+         'status': 404},
+        {'name': 'error_invalid_filter', 'method': 'get', 'url': '/persons?filter=[{"name":"foo"}]', 'status': 400},
+        {'name': 'error_invalid_include', 'method': 'get', 'url': '/persons?include=foo', 'status': 400},
+    ]
+
+
+def call(client, scenario):
+    """Send the request of a scenario and check its status code
+
+    :param FlaskClient client: a flask test client
+    :param dict scenario: the scenario
+    """
+    kwargs = {'content_type': CONTENT_TYPE}
+    if scenario.get('payload') is not None:
+        kwargs['data'] = json.dumps(scenario['payload']())
+
+    response = getattr(client, scenario['method'])(scenario['url'], **kwargs)
+
+    expected_status = scenario.get('status', 200)
+    if response.status_code != expected_status:
+        raise Exception("{} returned {} instead of {}: {}".format(scenario['name'],
+                                                                  response.status_code,
+                                                                  expected_status,
+                                                                  response.get_data(as_text=True)))
+
+
+def percentile(timings, percent):
+    """Compute a percentile with the nearest-rank method
+
+    :param list timings: sorted timings
+    :param int percent: the percentile to compute
+    :return float: the percentile
+    """
+    index = max(int(round(percent / 100.0 * len(timings))) - 1, 0)
+    return timings[index]
+
+
+def run_scenario(client, scenario, iterations, warmup):
+    """Measure a scenario
+
+    Latencies are measured without tracing, then the scenario is run again a few times under tracemalloc to measure
+    the peak memory allocated by a single request.
+
+    :param FlaskClient client: a flask test client
+    :param dict scenario: the scenario
+    :param int iterations: the number of measured requests
+    :param int warmup: the number of requests sent before measurement
+    :return dict: the measures of the scenario
+    """
+    for _ in range(warmup):
+        call(client, scenario)
+
+    timings = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        request_start = time.perf_counter()
+        call(client, scenario)
+        timings.append(time.perf_counter() - request_start)
+    total = time.perf_counter() - start
+
+    # tracing is restarted for each request to reset the peak, tracemalloc.reset_peak needs python 3.9
+    peak = 0
+    for _ in range(min(iterations, 5)):
+        tracemalloc.start()
+        call(client, scenario)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    timings.sort()
+
+    return {'iterations': iterations,
+            'throughput': iterations / total,
+            'p50_ms': percentile(timings, 50) * 1000,
+            'p99_ms': percentile(timings, 99) * 1000,
+            'peak_memory_bytes': peak}
+
+
+def run(rows_list, iterations, warmup, database_uri=None, only=None):
+    """Run all the scenarios at each scale
+
+    :param list rows_list: the scales to run the scenarios at
+    :param int iterations: the number of measured requests per scenario
+    :param int warmup: the number of requests sent before measurement
+    :param str database_uri: an sqlalchemy database uri, an in-memory sqlite database is used by default
+    :param list only: names of the scenarios to run, all scenarios are run by default
+    :return dict: the results
+    """
+    results = {'meta': {'python': platform.python_version(),
+                        'flask': flask.__version__,
+                        'marshmallow': marshmallow.__version__,
+                        'sqlalchemy': sqlalchemy.__version__,
+                        'iterations': iterations},
+               'results': {}}
+
+    for rows in rows_list:
+        create_database(rows, database_uri)
+        app = create_app()
+        client = app.test_client()
+
+        scale_results = results['results'][str(rows)] = {}
+        for scenario in scenarios(rows):
+            if only and scenario['name'] not in only:
+                continue
+            scale_results[scenario['name']] = run_scenario(client, scenario, iterations, warmup)
+            print_result(rows, scenario['name'], scale_results[scenario['name']])
+
+    return results
+
+
+def print_result(rows, name, result):
+    """Print the measures of a scenario
+
+    :param int rows: the scale of the scenario
+    :param str name: the name of the scenario
+    :param dict result: the measures of the scenario
+    """
+    print("{:>8} {:<22} {:>10.1f} req/s  p50 {:>8.2f} ms  p99 {:>8.2f} ms  peak {:>8.1f} KiB"
+          .format(rows, name, result['throughput'], result['p50_ms'], result['p99_ms'],
+                  result['peak_memory_bytes'] / 1024.0))
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline
+
+    :param dict results: the results of the current run
+    :param dict baseline: the results of a previous run
+    :param float tolerance: the relative slowdown tolerated before reporting a regression
+    :return list: the regressions
+    """
+    regressions = []
+    for rows, scale_results in results['results'].items():
+        for name, result in scale_results.items():
+            reference = baseline['results'].get(rows, {}).get(name)
+            if reference is None:
+                continue
+            for measure in ('p50_ms', 'p99_ms', 'peak_memory_bytes'):
+                if result[measure] > reference[measure] * (1 + tolerance):
+                    regressions.append("{} {} {}: {:.2f} > {:.2f}".format(rows,
+                                                                           name,
+                                                                           measure,
+                                                                           result[measure],
+                                                                           reference[measure]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000, 1000000],
+                        help='the scales to run the scenarios at')
+    parser.add_argument('--iterations', type=int, default=50, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=5, help='requests sent before measurement')
+    parser.add_argument('--database', default=None,
+                        help='sqlalchemy database uri, for example sqlite:////tmp/bench.db (default: in-memory)')
+    parser.add_argument('--scenario', action='append', help='run only this scenario (repeatable)')
+    parser.add_argument('--output', help='save results as a json baseline')
+    parser.add_argument('--compare', help='compare results with a json baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown tolerated before reporting a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.iterations, args.warmup, database_uri=args.database, only=args.scenario)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
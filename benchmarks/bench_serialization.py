@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""Micro-benchmarks and allocation reports of the serialization path
+
+Each step of the serialization of a page of resources is measured on its own: compute_schema, schema.dump (with and
+without include), add_pagination_links and json.dumps with the JSONEncoder of the package. Objects are plain python
+objects so that no database work is measured.
+
+For every step the mean duration, the peak memory traced while it runs and the memory still retained by its result
+are reported, both in total and per resource.
+
+The package must be importable (pip install -e .). Usage::
+
+    python benchmarks/bench_serialization.py --sizes 30 1000 10000 --output serialization.json
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from flask import url_for
+
+from flask_rest_jsonapi.querystring import QueryStringManager as QSManager
+from flask_rest_jsonapi.pagination import add_pagination_links
+from flask_rest_jsonapi.schema import compute_schema
+from flask_rest_jsonapi.utils import JSONEncoder
+
+from models import PersonSchema, create_app
+
+
+class Object(object):
+    """A plain object exposing attributes like a model instance"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_persons(count):
+    """Create persons owning one computer each
+
+    :param int count: the number of persons
+    :return list: the persons
+    """
+    persons = []
+    birth_date = datetime.datetime(1980, 1, 1)
+    for i in range(1, count + 1):
+        person = Object(id=i, name='person-{}'.format(i), email='person-{}@example.com'.format(i),
+                        birth_date=birth_date, computers=[])
+        person.computers.append(Object(id=i, serial='serial-{}'.format(i), person=person))
+        persons.append(person)
+    return persons
+
+
+def measure(func, count, repeat):
+    """Measure the duration and the memory allocated by a callable
+
+    :param callable func: the callable to measure
+    :param int count: the number of resources handled by the callable
+    :param int repeat: the number of timed calls
+    :return dict: the measures
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    duration = (time.perf_counter() - start) / repeat
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    retained_blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    retained_bytes = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    del result
+
+    return {'mean_ms': duration * 1000,
+            'peak_bytes': peak,
+            'peak_bytes_per_resource': peak / count,
+            'retained_bytes': retained_bytes,
+            'retained_bytes_per_resource': retained_bytes / count,
+            'retained_blocks_per_resource': retained_blocks / count}
+
+
+def run(sizes, repeat):
+    """Run the serialization benchmarks for each page size
+
+    :param list sizes: the numbers of resources to serialize
+    :param int repeat: the number of timed calls per step
+    :return dict: the results
+    """
+    app = create_app()
+    results = {}
+
+    for count in sizes:
+        persons = make_persons(count)
+        for include in ([], ['computers']):
+            querystring = {'page[size]': str(count)}
+            if include:
+                querystring['include'] = ','.join(include)
+            name = '{}{}'.format(count, '_include' if include else '')
+
+            with app.test_request_context('/persons'):
+                qs = QSManager(querystring, PersonSchema)
+                schema = compute_schema(PersonSchema, {'many': True}, qs, include)
+                data = schema.dump(persons)
+
+                steps = {
+                    'compute_schema': lambda: compute_schema(PersonSchema, {'many': True}, qs, include),
+                    'dump': lambda: schema.dump(persons),
+                    'add_pagination_links': lambda: add_pagination_links(dict(data),
+                                                                         count * 10,
+                                                                         qs,
+                                                                         url_for('person_list', _external=True)),
+                    'json_dumps': lambda: json.dumps(data, cls=JSONEncoder),
+                }
+
+                results[name] = {}
+                for step, func in steps.items():
+                    results[name][step] = measure(func, count, repeat)
+                    print_result(name, step, results[name][step])
+
+    return results
+
+
+def print_result(name, step, result):
+    """Print the measures of a step
+
+    :param str name: the name of the scenario
+    :param str step: the name of the step
+    :param dict result: the measures
+    """
+    print("{:<14} {:<22} {:>10.3f} ms  peak/res {:>9.1f} B  retained/res {:>9.1f} B  {:>6.1f} blocks/res"
+          .format(name, step, result['mean_ms'], result['peak_bytes_per_resource'],
+                  result['retained_bytes_per_resource'], result['retained_blocks_per_resource']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[30, 1000, 10000],
+                        help='the numbers of resources to serialize')
+    parser.add_argument('--repeat', type=int, default=5, help='timed calls per step')
+    parser.add_argument('--output', help='save results as json')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
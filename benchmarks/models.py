@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""Synthetic application shared by the benchmark scripts: models, schemas, resource managers and data generation"""
+
+import datetime
+
+from flask import Flask
+from sqlalchemy import create_engine, Column, Integer, DateTime, String, ForeignKey
+from sqlalchemy.orm import sessionmaker, scoped_session, relationship
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import StaticPool
+from marshmallow_jsonapi.flask import Schema, Relationship
+from marshmallow_jsonapi import fields
+
+from flask_rest_jsonapi import Api, ResourceList, ResourceDetail, ResourceRelationship
+
+Base = declarative_base()
+Session = scoped_session(sessionmaker())
+
+
+class Person(Base):
+    __tablename__ = 'person'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, index=True)
+    email = Column(String)
+    birth_date = Column(DateTime)
+    computers = relationship('Computer', backref='person')
+
+
+class Computer(Base):
+    __tablename__ = 'computer'
+
+    id = Column(Integer, primary_key=True)
+    serial = Column(String, nullable=False, index=True)
+    person_id = Column(Integer, ForeignKey('person.id'), index=True)
+
+
+class PersonSchema(Schema):
+    class Meta:
+        type_ = 'person'
+        self_view = 'person_detail'
+        self_view_kwargs = {'id': '<id>'}
+        self_view_many = 'person_list'
+
+    id = fields.Integer(as_string=True)
+    name = fields.Str(required=True)
+    email = fields.Str()
+    birth_date = fields.DateTime()
+    computers = Relationship(self_view='person_computers',
+                             self_view_kwargs={'id': '<id>'},
+                             related_view='computer_list',
+                             related_view_kwargs={'id': '<id>'},
+                             many=True,
+                             schema='ComputerSchema',
+                             type_='computer')
+
+
+class ComputerSchema(Schema):
+    class Meta:
+        type_ = 'computer'
+        self_view = 'computer_detail'
+        self_view_kwargs = {'id': '<id>'}
+
+    id = fields.Integer(as_string=True)
+    serial = fields.Str(required=True)
+    owner = Relationship(attribute='person',
+                         related_view='person_detail',
+                         related_view_kwargs={'id': '<person.id>'},
+                         schema='PersonSchema',
+                         type_='person')
+
+
+class PersonList(ResourceList):
+    schema = PersonSchema
+    data_layer = {'session': Session,
+                  'model': Person}
+
+
+class PersonDetail(ResourceDetail):
+    schema = PersonSchema
+    data_layer = {'session': Session,
+                  'model': Person}
+
+
+class PersonRelationship(ResourceRelationship):
+    schema = PersonSchema
+    data_layer = {'session': Session,
+                  'model': Person}
+
+
+class ComputerList(ResourceList):
+    schema = ComputerSchema
+    data_layer = {'session': Session,
+                  'model': Computer}
+
+
+class ComputerDetail(ResourceDetail):
+    schema = ComputerSchema
+    data_layer = {'session': Session,
+                  'model': Computer}
+
+
+def create_database(rows, database_uri=None, chunk_size=10000):
+    """Create a database filled with synthetic data and bind the shared session to it
+
+    Each person owns one computer so that include, relationship and filter scenarios have related data to work on.
+
+    :param int rows: the number of persons (and computers) to create
+    :param str database_uri: an sqlalchemy database uri, an in-memory sqlite database is used by default
+    :param int chunk_size: the number of rows inserted per statement
+    :return Engine: the engine of the database
+    """
+    if database_uri is None:
+        engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    else:
+        engine = create_engine(database_uri)
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    birth_date = datetime.datetime(1980, 1, 1)
+    with engine.begin() as connection:
+        for start in range(1, rows + 1, chunk_size):
+            stop = min(start + chunk_size, rows + 1)
+            connection.execute(Person.__table__.insert(),
+                               [{'id': i,
+                                 'name': 'person-{}'.format(i),
+                                 'email': 'person-{}@example.com'.format(i),
+                                 'birth_date': birth_date} for i in range(start, stop)])
+            connection.execute(Computer.__table__.insert(),
+                               [{'id': i,
+                                 'serial': 'serial-{}'.format(i),
+                                 'person_id': i} for i in range(start, stop)])
+
+    Session.remove()
+    Session.configure(bind=engine)
+
+    return engine
+
+
+def create_app():
+    """Create a flask application exposing the synthetic resources
+
+    :return Flask: the flask application
+    """
+    app = Flask(__name__)
+
+    api = Api(app)
+    api.route(PersonList, 'person_list', '/persons')
+    api.route(PersonDetail, 'person_detail', '/persons/<int:id>')
+    api.route(PersonRelationship, 'person_computers', '/persons/<int:id>/relationships/computers')
+    api.route(ComputerList, 'computer_list', '/computers', '/persons/<int:id>/computers')
+    api.route(ComputerDetail, 'computer_detail', '/computers/<int:id>')
+
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        Session.remove()
+
+    return app
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from flask_rest_jsonapi.api import Api
-from flask_rest_jsonapi.resource import ResourceList, ResourceDetail, ResourceRelationship
+from flask_rest_jsonapi.resource import ResourceList, ResourceDetail, ResourceRelationship, AsyncResourceList,\
+    AsyncResourceDetail, AsyncResourceRelationship
 from flask_rest_jsonapi.exceptions import JsonApiException
 
 __all__ = [
@@ -9,5 +10,8 @@ __all__ = [
     'ResourceList',
     'ResourceDetail',
     'ResourceRelationship',
+    'AsyncResourceList',
+    'AsyncResourceDetail',
+    'AsyncResourceRelationship',
     'JsonApiException'
 ]
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""Admission control of resources: concurrency limits and token bucket rate limits enforced before a resource handles
+a request, so that expensive resources can't use all the workers of a process.
+
+The state of the limits is kept by an admission backend. LocalAdmissionBackend keeps it in the process, inherit from
+AdmissionBackend to share it between processes (in redis for example).
+"""
+
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from flask_rest_jsonapi.exceptions import TooManyRequests, ServiceUnavailable
+
+
+class AdmissionBackend(object):
+    """Base class of the state of admission control"""
+
+    def acquire(self, key, limit):
+        """Take a concurrency slot
+
+        :param str key: the key of the limit
+        :param int limit: the maximum number of concurrent requests
+        :return bool: True if a slot is taken, False if the limit is reached
+        """
+        raise NotImplementedError
+
+    def release(self, key):
+        """Give back a concurrency slot
+
+        :param str key: the key of the limit
+        """
+        raise NotImplementedError
+
+    def consume(self, key, rate, burst):
+        """Take a token from a token bucket
+
+        :param str key: the key of the bucket
+        :param float rate: the number of tokens added to the bucket by second
+        :param int burst: the capacity of the bucket
+        :return float: 0 if a token is taken, else the number of seconds before a token is available
+        """
+        raise NotImplementedError
+
+
+class LocalAdmissionBackend(AdmissionBackend):
+    """Admission control state of the current process"""
+
+    def __init__(self):
+        """Initialize the state"""
+        self.lock = Lock()
+        self.concurrency = {}
+        self.buckets = {}
+
+    def acquire(self, key, limit):
+        with self.lock:
+            if self.concurrency.get(key, 0) >= limit:
+                return False
+            self.concurrency[key] = self.concurrency.get(key, 0) + 1
+            return True
+
+    def release(self, key):
+        with self.lock:
+            self.concurrency[key] -= 1
+
+    def consume(self, key, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+
+default_backend = LocalAdmissionBackend()
+
+
+@contextmanager
+def admission_control(resource):
+    """Enforce the rate_limit and concurrency_limit attributes of a resource around the handling of a request
+
+    :param Resource resource: the resource handling the request
+    """
+    rate_limit = getattr(resource, 'rate_limit', None)
+    concurrency_limit = getattr(resource, 'concurrency_limit', None)
+    if rate_limit is None and concurrency_limit is None:
+        yield
+        return
+
+    backend = getattr(resource, 'admission_backend', None) or default_backend
+    key = '.'.join([resource.__class__.__module__, resource.__class__.__name__])
+
+    # take the concurrency slot first so that requests shed with 503 don't consume the tokens of the rate limit
+    if concurrency_limit is not None and not backend.acquire(key, concurrency_limit):
+        raise ServiceUnavailable("Too many concurrent requests to {}".format(resource.__class__.__name__),
+                                 retry_after=getattr(resource, 'retry_after', 1))
+    try:
+        if rate_limit is not None:
+            retry_after = backend.consume(key, rate_limit['rate'], rate_limit.get('burst', rate_limit['rate']))
+            if retry_after > 0:
+                raise TooManyRequests("Rate limit of {} exceeded".format(resource.__class__.__name__),
+                                      retry_after=retry_after)
+        yield
+    finally:
+        if concurrency_limit is not None:
+            backend.release(key)
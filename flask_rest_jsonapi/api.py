@@ -5,12 +5,18 @@ methods, speficy which blueprint to use, define the Api routes and plug addition
 """
 
 import inspect
+import hashlib
+from datetime import datetime
 from functools import wraps
+from types import SimpleNamespace
 
 from flask import request, abort
 
 from flask_rest_jsonapi.resource import ResourceList, ResourceRelationship
+from flask_rest_jsonapi.data_layers.base import remove_read_sessions
 from flask_rest_jsonapi.decorators import jsonapi_exception_formatter
+from flask_rest_jsonapi.schema import warmup_schema
+from flask_rest_jsonapi.utils import LRUCache
 
 
 class Api(object):
@@ -28,6 +34,10 @@ class Api(object):
         self.resources = []
         self.resource_registry = []
         self.decorators = decorators or tuple()
+        self.permission_filter_func = None
+        self.oauth_enabled = False
+        self.oauth_scopes = {}
+        self.oauth_token_cache = None
 
         if app is not None:
             self.init_app(app, blueprint)
@@ -57,6 +67,10 @@ class Api(object):
                 self.app.register_blueprint(blueprint)
 
         self.app.config.setdefault('PAGE_SIZE', 30)
+        self.app.teardown_appcontext(remove_read_sessions)
+
+        if self.app.config.get('WARMUP_RESOURCES') is True:
+            self.warmup()
 
     def route(self, resource, view, *urls, **kwargs):
         """Create an api view.
@@ -68,6 +82,8 @@ class Api(object):
         """
         resource.view = view
         url_rule_options = kwargs.get('url_rule_options') or dict()
+        if kwargs.get('parent_filter') is not None:
+            resource.parent_filter = kwargs['parent_filter']
 
         # Allow the customization of the resource class instance
         resource_args = kwargs.get('resource_args', [])
@@ -75,6 +91,12 @@ class Api(object):
 
         view_func = resource.as_view(view, *resource_args, **resource_kwargs)
 
+        rules = list(urls)
+        blueprint = kwargs.get('blueprint', self.blueprint)
+        if blueprint is not None and blueprint.url_prefix:
+            rules += [blueprint.url_prefix.rstrip('/') + '/' + url.lstrip('/') for url in urls]
+        resource.bind_url_rules(rules)
+
         if 'blueprint' in kwargs:
             resource.view = '.'.join([kwargs['blueprint'].name, resource.view])
             for url in urls:
@@ -94,11 +116,43 @@ class Api(object):
 
         self.resource_registry.append(resource)
 
+        if self.oauth_enabled is True:
+            self.compute_scopes(resource)
+
+        if self.permission_filter_func is not None:
+            self.bind_permission_filter(resource)
+
+        if self.app is not None and self.app.config.get('WARMUP_RESOURCES') is True:
+            self.warmup([resource])
+
+    def warmup(self, resources=None):
+        """Validate schemas, relationships and data layers of resources so that misconfigurations raise at startup,
+        and let data layers fill their caches so that the first request of each resource doesn't build them
+
+        :param list resources: the resources to warm up, all registered resources by default
+        """
+        for resource in resources or self.resource_registry:
+            if getattr(resource, 'schema', None) is not None:
+                warmup_schema(resource.schema)
+
+            if hasattr(resource, '_data_layer'):
+                resource._data_layer.resource = resource
+                resource._data_layer.warmup()
+
     def oauth_manager(self, oauth_manager):
         """Use the oauth manager to enable oauth for API
 
         :param oauth_manager: the oauth manager
         """
+        self.oauth_enabled = True
+        for resource in self.resource_registry:
+            self.compute_scopes(resource)
+
+        if self.app.config.get('OAUTH_TOKEN_CACHE_TTL'):
+            self.oauth_token_cache = LRUCache(max_size=self.app.config.get('OAUTH_TOKEN_CACHE_SIZE', 1024),
+                                              ttl=self.app.config['OAUTH_TOKEN_CACHE_TTL'],
+                                              sizeof=None)
+
         @self.app.before_request
         @jsonapi_exception_formatter
         def before_request():
@@ -111,14 +165,11 @@ class Api(object):
                 scopes = request.args.get('scopes')
 
                 if getattr(resource, 'schema'):
-                    scopes = [self.build_scope(resource, request.method)]
+                    scopes = self.get_scopes(resource, request.method)
                 elif scopes:
                     scopes = scopes.split(',')
 
-                    if scopes:
-                        scopes = scopes.split(',')
-
-                valid, req = oauth_manager.verify_request(scopes)
+                valid, req = self.verify_request(oauth_manager, scopes)
 
                 for func in oauth_manager._after_request_funcs:
                     valid, req = func(valid, req)
@@ -130,6 +181,95 @@ class Api(object):
 
                 request.oauth = req
 
+    def verify_request(self, oauth_manager, scopes):
+        """Verify the token of the current request with the oauth manager. If the OAUTH_TOKEN_CACHE_TTL configuration
+        key is set, the identities of valid tokens are cached by hash and scopes until they expire so that repeated
+        requests of a client skip the verification
+
+        :param oauth_manager: the oauth manager
+        :param list scopes: the scopes required by the request
+        :return tuple: the validity of the token and the oauth request
+        """
+        token = request.headers.get('Authorization') or request.args.get('access_token')
+        if self.oauth_token_cache is None or not token:
+            return oauth_manager.verify_request(scopes)
+
+        key = (hashlib.sha256(token.encode('utf-8')).hexdigest(), tuple(scopes or ()))
+        identity = self.oauth_token_cache.get(key)
+        if identity is not None:
+            return True, self.build_oauth_request(identity)
+
+        valid, req = oauth_manager.verify_request(scopes)
+        if valid:
+            ttl = None
+            expires = getattr(getattr(req, 'access_token', None), 'expires', None)
+            if isinstance(expires, datetime):
+                now = datetime.now(expires.tzinfo) if expires.tzinfo is not None else datetime.utcnow()
+                ttl = (expires - now).total_seconds()
+            if ttl is None or ttl > 0:
+                identity = {'user': getattr(req, 'user', None),
+                            'client': getattr(req, 'client', None),
+                            'scopes': list(getattr(req, 'scopes', None) or ()),
+                            'expires': expires}
+                self.oauth_token_cache.set(key, identity, ttl=ttl)
+
+        return valid, req
+
+    @staticmethod
+    def build_oauth_request(identity):
+        """Build the oauth request of the current request from the cached identity of its token, so that requests
+        never share an oauth request object
+
+        :param dict identity: the user, client, scopes and expiry of the token
+        :return: an oauthlib request, or an object with the same attributes if oauthlib is not installed
+        """
+        try:
+            from oauthlib.common import Request as OAuthRequest
+        except ImportError:
+            req = SimpleNamespace(uri=request.url, http_method=request.method, headers=dict(request.headers))
+        else:
+            req = OAuthRequest(request.url, request.method, request.get_data(), dict(request.headers))
+
+        req.user = identity['user']
+        req.client = identity['client']
+        req.scopes = list(identity['scopes'])
+        req.expires = identity['expires']
+        return req
+
+    def scope_setter(self, build_scope):
+        """Use a custom function to compute the name of the scope of a resource method for oauth
+
+        :param callable build_scope: a function taking the resource and the http method and returning a scope
+        """
+        self.build_scope = build_scope
+        self.oauth_scopes.clear()
+        for resource in self.resource_registry:
+            self.compute_scopes(resource)
+
+    def compute_scopes(self, resource):
+        """Compute the scopes of the methods of a resource once, at registration
+
+        :param Resource resource: a resource class
+        """
+        if getattr(resource, 'schema', None) is None or getattr(resource, 'disable_oauth', None):
+            return
+
+        for method in getattr(resource, 'methods', None) or ():
+            if method in ('GET', 'POST', 'PATCH', 'DELETE'):
+                self.oauth_scopes[(resource, method)] = [self.build_scope(resource, method)]
+
+    def get_scopes(self, resource, method):
+        """Get the scopes required by a resource method
+
+        :param Resource resource: a resource class
+        :param str method: an http method
+        :return list: the scopes
+        """
+        scopes = self.oauth_scopes.get((resource, method))
+        if scopes is None:
+            scopes = self.oauth_scopes[(resource, method)] = [self.build_scope(resource, method)]
+        return scopes
+
     @staticmethod
     def build_scope(resource, method):
         """Compute the name of the scope for oauth
@@ -167,6 +307,81 @@ class Api(object):
                                 method.lower(),
                                 self.has_permission()(getattr(resource, method.lower())))
 
+    def permission_filter(self, permission_filter, identity=None, ttl=None, max_size=1024):
+        """Use a permission filter to restrict the objects each request can access. The filters are applied by data
+        layers to the queries of get_collection and get_object, before counting and pagination, and to the related
+        objects of relationships, with the filters of the resource routed with the schema of the related objects
+
+        :param callable permission_filter: a function taking the resource and the http method and returning a list of
+                                           filters as in the filter querystring parameter or of criteria specific to
+                                           the data layer (like sqlalchemy expressions)
+        :param callable identity: a function returning a hashable identity of the current user. If provided, the
+                                  filters are cached by identity, resource and method
+        :param float ttl: the number of seconds the filters of an identity stay cached, None for no expiration
+        :param int max_size: the maximum number of cached filter lists
+        """
+        self.permission_filter_func = permission_filter
+        self.permission_identity = identity
+        self.permission_filters_cache = LRUCache(max_size=max_size, ttl=ttl, sizeof=None)
+
+        for resource in self.resource_registry:
+            self.bind_permission_filter(resource)
+
+    def bind_permission_filter(self, resource):
+        """Make the permission filter available to the data layer of a resource
+
+        :param Resource resource: a resource class
+        """
+        if getattr(resource, 'disable_permission', None) is not True:
+            resource.get_permission_filters = self.get_permission_filters
+            resource.get_permission_identity = self.get_permission_identity
+            resource.get_related_permission_filters = self.get_related_permission_filters
+
+    def get_permission_identity(self):
+        """Get the identity of the current user the permission filters are cached by
+
+        :return: the identity, or None if no identity function is provided
+        """
+        if self.permission_identity is None:
+            return None
+        return self.permission_identity()
+
+    def get_permission_filters(self, resource, method):
+        """Get the permission filters of a resource and a method for the current user
+
+        :param Resource resource: a resource class
+        :param str method: an http method
+        :return list: the filters
+        """
+        if self.permission_identity is None:
+            return list(self.permission_filter_func(resource, method) or [])
+
+        key = (self.get_permission_identity(), resource, method)
+        filters = self.permission_filters_cache.get(key)
+        if filters is None:
+            filters = list(self.permission_filter_func(resource, method) or [])
+            self.permission_filters_cache.set(key, filters)
+        return filters
+
+    def get_related_permission_filters(self, schema, method):
+        """Get the permission filters of the related objects of a schema for the current user, those of the resource
+        routed with this schema, preferring a list resource
+
+        :param Schema schema: the schema of the related objects
+        :param str method: an http method
+        :return list: the filters, empty if no resource with permissions is routed with the schema
+        """
+        resources = [resource for resource in self.resource_registry if getattr(resource, 'schema', None) is schema]
+        if not resources:
+            return []
+
+        related_resource = next((resource for resource in resources if issubclass(resource, ResourceList)),
+                                resources[0])
+        if getattr(related_resource, 'disable_permission', None) is True:
+            return []
+
+        return self.get_permission_filters(related_resource, method)
+
     def has_permission(self, *args, **kwargs):
         """Decorator used to check permissions before to call resource manager method"""
         def wrapper(view):
@@ -2,20 +2,87 @@
 
 """This module is a CRUD interface between resource managers and the sqlalchemy ORM"""
 
+import pickle
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import UnboundExecutionError
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.collections import InstrumentedList
 from sqlalchemy.inspection import inspect
 from sqlalchemy.orm.attributes import QueryableAttribute
-from sqlalchemy.orm import joinedload, ColumnProperty, RelationshipProperty
-from marshmallow import class_registry
-from marshmallow.base import SchemaABC
+from sqlalchemy.orm import joinedload, configure_mappers, aliased, object_session, with_parent, ColumnProperty, \
+    RelationshipProperty, Session, scoped_session
 
-from flask import current_app
+from flask import current_app, request, g, has_request_context
 from flask_rest_jsonapi.data_layers.base import BaseDataLayer
 from flask_rest_jsonapi.exceptions import RelationNotFound, RelatedObjectNotFound, JsonApiException,\
-    InvalidSort, ObjectNotFound, InvalidInclude, InvalidType
-from flask_rest_jsonapi.data_layers.filtering.alchemy import create_filters
-from flask_rest_jsonapi.schema import get_model_field, get_related_schema, get_relationships, get_nested_fields, get_schema_field
+    InvalidSort, ObjectNotFound, InvalidInclude, InvalidType, InvalidAggregate, InvalidGroupBy
+from flask_rest_jsonapi.utils import LRUCache
+from flask_rest_jsonapi.schema import get_model_field, get_relationships, get_nested_fields, get_schema_field,\
+    get_related_schema_cls, plan_includes
+
+count_executor = None
+count_executor_lock = Lock()
+
+# time of the last write of each model, used to keep reading from the primary session for a while after a write. It
+# is kept by process, so reads only follow the writes of the same worker
+last_writes = {}
+
+
+def get_count_executor():
+    """Get the thread pool running the count queries of collections, created on first use with
+    CONCURRENT_COUNT_MAX_WORKERS threads
+
+    :return ThreadPoolExecutor: the thread pool
+    """
+    global count_executor
+    if count_executor is None:
+        with count_executor_lock:
+            if count_executor is None:
+                count_executor = ThreadPoolExecutor(current_app.config.get('CONCURRENT_COUNT_MAX_WORKERS', 4))
+    return count_executor
+
+
+def same_permission_filters(filters, other_filters):
+    """Check if two lists of permission filters are the same: filters as in the filter querystring parameter are
+    compared by value and criteria specific to the data layer by identity
+
+    :param list filters: permission filters
+    :param list other_filters: other permission filters
+    :return bool: True if the filters are the same
+    """
+    return len(filters) == len(other_filters) and \
+        all(filter_ is other_filter or isinstance(filter_, dict) and filter_ == other_filter
+            for filter_, other_filter in zip(filters, other_filters))
+
+
+def freeze_include_tree(include_tree):
+    """Convert a tree of includes to a hashable value
+
+    :param dict include_tree: the included relationship fields, each mapped to the tree of its own includes
+    :return tuple: the sorted pairs of fields and frozen trees
+    """
+    return tuple(sorted((field, freeze_include_tree(related_include_tree))
+                        for field, related_include_tree in include_tree.items()))
+
+
+def count_in_session(query, bind):
+    """Count the results of a query in a dedicated session
+
+    :param Query query: the query to count
+    :param Engine bind: the engine of the dedicated session
+    :return int: the number of results
+    """
+    session = Session(bind=bind)
+    try:
+        return query.with_session(session).count()
+    finally:
+        session.close()
 
 
 class SqlalchemyDataLayer(BaseDataLayer):
@@ -35,6 +102,53 @@ class SqlalchemyDataLayer(BaseDataLayer):
             raise Exception("You must provide a model in data_layer_kwargs to use sqlalchemy data layer in {}"
                             .format(self.resource.__name__))
 
+        # loader options by include tree, built once since requests use few distinct includes
+        self.include_loaders = LRUCache(max_size=256, sizeof=None)
+
+    def warmup(self):
+        """Configure the mappers, check that the identifier, relationship and nested fields of the resource schema
+        map to attributes of the model, and fill the caches of the filter value coercers of the schema and of its
+        related schemas and of the loader options of each relationship include
+        """
+        configure_mappers()
+
+        id_field = getattr(self, 'id_field', inspect(self.model).primary_key[0].key)
+        if not hasattr(self.model, id_field):
+            raise Exception("{} has no attribute {}".format(self.model.__name__, id_field))
+
+        schema = getattr(self.resource, 'schema', None)
+        if schema is None:
+            return
+
+        relationships = inspect(self.model).relationships
+        for field in get_relationships(schema):
+            model_field = get_model_field(schema, field)
+            if model_field not in relationships:
+                raise Exception("{}.{} is not a relationship of {}".format(schema.__name__,
+                                                                           field,
+                                                                           self.model.__name__))
+
+            related_model = relationships[model_field].mapper.class_
+            related_id_field = schema._declared_fields[field].id_field
+            if not hasattr(related_model, related_id_field):
+                raise Exception("{}.{}: {} has no attribute {}".format(schema.__name__,
+                                                                       field,
+                                                                       related_model.__name__,
+                                                                       related_id_field))
+
+        for field in get_nested_fields(schema, model_field=True):
+            if not hasattr(self.model, field):
+                raise Exception("{} has no attribute {}".format(self.model.__name__, field))
+
+        from flask_rest_jsonapi.data_layers.filtering.alchemy import get_coercers
+
+        get_coercers(schema, self.model)
+        for field in get_relationships(schema):
+            related_schema = get_related_schema_cls(schema, field)
+            if related_schema is not None:
+                get_coercers(related_schema, relationships[get_model_field(schema, field)].mapper.class_)
+            self.get_cached_include_loaders(schema, {field: {}})
+
     def create_object(self, data, view_kwargs):
         """Create an object through sqlalchemy
 
@@ -56,6 +170,7 @@ class SqlalchemyDataLayer(BaseDataLayer):
 
         self.session.add(obj)
         try:
+            self.stick_to_primary()
             self.session.commit()
         except JsonApiException as e:
             self.session.rollback()
@@ -85,20 +200,66 @@ class SqlalchemyDataLayer(BaseDataLayer):
         url_field = getattr(self, 'url_field', 'id')
         filter_value = view_kwargs[url_field]
 
-        query = self.retrieve_object_query(view_kwargs, filter_field, filter_value)
+        # objects loaded with includes are not memoized since their includes depend on the querystring
+        memo = self.get_object_memo() if qs is None or not qs.include else None
+        memo_key = (self, id_field, filter_value)
 
-        if qs is not None and getattr(self, 'eagerload_includes', True):
-            query = self.eagerload_includes(query, qs)
+        permission_filters = self.get_permission_filters()
 
-        try:
-            obj = query.one()
-        except NoResultFound:
-            obj = None
+        # a memoized object was loaded through the query restricted by its permission filters, so it is only reused
+        # under the same filters and never checked again
+        memoized = memo.get(memo_key) if memo is not None else None
+        if memoized is not None and same_permission_filters(memoized[0], permission_filters):
+            obj = memoized[1]
+        elif (qs is None or not qs.include) and not permission_filters and self.is_identity_lookup(id_field):
+            # the identity map of the session is checked before emitting a query
+            obj = self.get_read_session().get(self.model, filter_value)
+        else:
+            query = self.retrieve_object_query(view_kwargs, filter_field, filter_value)
+            query = self.apply_permission_filters(query, permission_filters)
+
+            if qs is not None and getattr(self, 'eagerload_includes', True):
+                query = self.eagerload_includes(query, qs)
+
+            try:
+                obj = query.one()
+            except NoResultFound:
+                obj = None
+
+        if memo is not None and obj is not None:
+            memo[memo_key] = (list(permission_filters), obj)
 
         self.after_get_object(obj, view_kwargs)
 
         return obj
 
+    def is_identity_lookup(self, id_field):
+        """Check if an object can be retrieved by primary key with Session.get instead of retrieve_object_query
+
+        :param str id_field: the identifier field of the model
+        :return bool: True if the identifier is the whole primary key and retrieve_object_query is not rewritten
+        """
+        if 'retrieve_object_query' in self.__dict__ \
+                or type(self).retrieve_object_query is not SqlalchemyDataLayer.retrieve_object_query:
+            return False
+
+        primary_key = inspect(self.model).primary_key
+        return len(primary_key) == 1 and inspect(self.model).get_property_by_column(primary_key[0]).key == id_field
+
+    def get_object_memo(self):
+        """Get the objects retrieved by get_object during the current request, if the memoize_get_object parameter is
+        True, so that the several get_object calls of a request share one load
+
+        :return dict: the objects with the permission filters they were loaded with, by data layer, identifier field
+                      and identifier value, or None
+        """
+        if getattr(self, 'memoize_get_object', False) is not True or not has_request_context():
+            return None
+
+        if 'jsonapi_object_memo' not in g:
+            g.jsonapi_object_memo = {}
+        return g.jsonapi_object_memo
+
     def get_collection(self, qs, view_kwargs, filters=None):
         """Retrieve a collection of objects through sqlalchemy
 
@@ -110,29 +271,175 @@ class SqlalchemyDataLayer(BaseDataLayer):
         self.before_get_collection(qs, view_kwargs)
 
         query = self.query(view_kwargs)
+        query = self.apply_permission_filters(query, self.get_permission_filters())
 
         if filters:
             query = query.filter_by(**filters)
 
+        joins = {}
         if qs.filters:
-            query = self.filter_query(query, qs.filters, self.model)
+            query = self.filter_query(query, qs.filters, self.model, joins)
 
         if qs.sorting:
-            query = self.sort_query(query, qs.sorting)
+            query = self.sort_query(query, qs.sorting, joins)
 
-        object_count = query.count()
+        count_bind = self.get_concurrent_count_bind(query.session)
+        if count_bind is not None:
+            object_count = get_count_executor().submit(count_in_session, query, count_bind)
+        else:
+            object_count = query.count()
 
-        if getattr(self, 'eagerload_includes', True):
-            query = self.eagerload_includes(query, qs)
+        if getattr(self, 'deferred_join', False) is True and int(qs.pagination.get('size', 1)) != 0:
+            collection = self.get_page_by_primary_keys(query, qs)
+        else:
+            if getattr(self, 'eagerload_includes', True):
+                query = self.eagerload_includes(query, qs)
+
+            query = self.paginate_query(query, qs.pagination)
 
-        query = self.paginate_query(query, qs.pagination)
+            collection = query.all()
 
-        collection = query.all()
+        if count_bind is not None:
+            object_count = object_count.result()
 
         collection = self.after_get_collection(collection, qs, view_kwargs)
 
         return object_count, collection
 
+    def get_aggregates(self, qs, view_kwargs, filters=None):
+        """Compute aggregates of a collection with a GROUP BY query
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param dict filters: A dictionary of key/value filters to apply to the eventual query
+        :return list: a dict by group like {'group': {'status': 'open'}, 'count': {'*': 12}, 'sum': {'amount': 150}}
+        """
+        query = self.query(view_kwargs)
+        query = self.apply_permission_filters(query, self.get_permission_filters())
+
+        if filters:
+            query = query.filter_by(**filters)
+
+        if qs.filters:
+            query = self.filter_query(query, qs.filters, self.model, {})
+
+        group_by = qs.group_by
+        aggregates = qs.aggregates
+
+        group_columns = []
+        for group in group_by:
+            if not hasattr(self.model, group['column']):
+                raise InvalidGroupBy("{} has no attribute {}".format(self.model.__name__, group['column']))
+            group_columns.append(getattr(self.model, group['column']))
+
+        aggregate_columns = []
+        for aggregate in aggregates:
+            if aggregate['column'] is None:
+                aggregate_columns.append(func.count())
+                continue
+            if not hasattr(self.model, aggregate['column']):
+                raise InvalidAggregate("{} has no attribute {}".format(self.model.__name__, aggregate['column']))
+            aggregate_columns.append(getattr(func, aggregate['function'])(getattr(self.model, aggregate['column'])))
+
+        query = query.with_entities(*(group_columns + aggregate_columns))
+        if group_columns:
+            query = query.group_by(*group_columns).order_by(*group_columns)
+
+        results = []
+        for row in query:
+            result = {'group': {group['field']: value for group, value in zip(group_by, row)}}
+            for aggregate, value in zip(aggregates, row[len(group_by):]):
+                result.setdefault(aggregate['function'], {})[aggregate['field']] = value
+            results.append(result)
+
+        return results
+
+    def get_concurrent_count_bind(self, session):
+        """Get the engine to run the count query of a collection on, concurrently with the page query. The count runs
+        on another connection so it is only done if the concurrent_count parameter is True, the session has no pending
+        changes and no transaction in progress, which could have written, and the session is bound to an engine whose
+        connections see the same data
+
+        :param Session session: the session of the collection query
+        :return Engine: the engine, or None to count in the session of the query
+        """
+        if getattr(self, 'concurrent_count', False) is not True:
+            return None
+
+        # another connection doesn't see the changes of the transaction of the session, flushed or not
+        if session.new or session.dirty or session.deleted or session.in_transaction():
+            return None
+
+        bind = session.get_bind(mapper=inspect(self.model))
+        if isinstance(bind, Connection):
+            return None
+        if bind.dialect.name == 'sqlite' and bind.url.database in (None, '', ':memory:'):
+            return None
+
+        return bind
+
+    def get_read_session(self):
+        """Get the session used to read data. The read_session parameter is used for GET and HEAD requests, except
+        after a write of the current request or within sticky_primary_seconds after a write of the model, so that
+        writes are read back from the primary session. A read_session that is a scoped_session is removed at the end
+        of the request
+
+        :return Session: the session to read data from
+        """
+        read_session = getattr(self, 'read_session', None)
+        if read_session is None or not has_request_context() or request.method not in ('GET', 'HEAD'):
+            return self.session
+
+        if g.get('jsonapi_read_primary') is True:
+            return self.session
+
+        sticky_primary_seconds = getattr(self, 'sticky_primary_seconds', 0)
+        if sticky_primary_seconds and time.monotonic() - last_writes.get(self.model, float('-inf')) \
+                < sticky_primary_seconds:
+            return self.session
+
+        if isinstance(read_session, scoped_session):
+            g.setdefault('jsonapi_read_sessions', set()).add(read_session)
+        return read_session
+
+    def stick_to_primary(self):
+        """Read from the primary session for the rest of the request and, with sticky_primary_seconds, for the next
+        requests reading the model
+        """
+        if has_request_context():
+            g.jsonapi_read_primary = True
+        if getattr(self, 'sticky_primary_seconds', 0):
+            last_writes[self.model] = time.monotonic()
+
+    def detach_objects(self, objects):
+        """Pickle objects to cache them, so that the cache keeps copies of their loaded attributes and relationships
+        out of the session instead of instances of the session of the request that read them
+
+        :param objects: an object, a list of objects, a tuple of them or None
+        :return bytes: the pickled objects
+        """
+        return pickle.dumps(objects, pickle.HIGHEST_PROTOCOL)
+
+    def attach_objects(self, value):
+        """Unpickle cached objects and merge them into the read session without querying the database, so that
+        the attributes they don't have loaded are lazy loaded as usual
+
+        :param bytes value: objects pickled by detach_objects
+        :return: the objects
+        """
+        session = self.get_read_session()
+
+        def merge(objects):
+            if objects is None:
+                return None
+            if isinstance(objects, tuple):
+                return tuple(merge(item) for item in objects)
+            if isinstance(objects, list):
+                return type(objects)(merge(item) for item in objects)
+            return session.merge(objects, load=False)
+
+        return merge(pickle.loads(value))
+
     def update_object(self, obj, data, view_kwargs):
         """Update an object through sqlalchemy
 
@@ -162,6 +469,7 @@ class SqlalchemyDataLayer(BaseDataLayer):
         self.apply_nested_fields(data, obj)
 
         try:
+            self.stick_to_primary()
             self.session.commit()
         except JsonApiException as e:
             self.session.rollback()
@@ -186,8 +494,14 @@ class SqlalchemyDataLayer(BaseDataLayer):
 
         self.before_delete_object(obj, view_kwargs)
 
+        memo = self.get_object_memo()
+        if memo is not None:
+            for key in [key for key, value in memo.items() if value[1] is obj]:
+                del memo[key]
+
         self.session.delete(obj)
         try:
+            self.stick_to_primary()
             self.session.commit()
         except JsonApiException as e:
             self.session.rollback()
@@ -245,6 +559,7 @@ class SqlalchemyDataLayer(BaseDataLayer):
                 updated = True
 
         try:
+            self.stick_to_primary()
             self.session.commit()
         except JsonApiException as e:
             self.session.rollback()
@@ -281,6 +596,20 @@ class SqlalchemyDataLayer(BaseDataLayer):
 
         related_objects = getattr(obj, relationship_field)
 
+        related_schema = get_related_schema_cls(self.resource.schema,
+                                                get_schema_field(self.resource.schema, relationship_field))
+        permission_filters = self.get_related_permission_filters(related_schema)
+        if permission_filters and related_objects is not None:
+            attribute = getattr(self.model, relationship_field)
+            related_model = attribute.property.mapper.class_
+            query = (object_session(obj) or self.session).query(related_model).filter(with_parent(obj, attribute))
+            query = self.apply_permission_filters(query, permission_filters, related_model, related_schema)
+            if isinstance(related_objects, InstrumentedList):
+                query = query.order_by(*(attribute.property.order_by or inspect(related_model).primary_key))
+                related_objects = InstrumentedList(query.all())
+            else:
+                related_objects = query.one_or_none()
+
         if related_objects is None:
             return obj, related_objects
 
@@ -344,6 +673,7 @@ class SqlalchemyDataLayer(BaseDataLayer):
                 updated = True
 
         try:
+            self.stick_to_primary()
             self.session.commit()
         except JsonApiException as e:
             self.session.rollback()
@@ -394,6 +724,7 @@ class SqlalchemyDataLayer(BaseDataLayer):
             updated = True
 
         try:
+            self.stick_to_primary()
             self.session.commit()
         except JsonApiException as e:
             self.session.rollback()
@@ -406,6 +737,53 @@ class SqlalchemyDataLayer(BaseDataLayer):
 
         return obj, updated
 
+    def get_relationship_counts(self, objects, relationship_fields):
+        """Count the related objects of to-many relationships of objects with one query, joining a grouped count
+        subquery by relationship
+
+        :param list objects: the objects
+        :param list relationship_fields: the schema fields of the relationships
+        :return dict: the numbers of related objects, in the order of the objects, by relationship field
+        """
+        primary_key = inspect(self.model).primary_key
+        if len(primary_key) != 1:
+            raise Exception("Relationship counts require a single column primary key on {}".format(self.model.__name__))
+        id_attribute = getattr(self.model, inspect(self.model).get_property_by_column(primary_key[0]).key)
+
+        ids = [getattr(obj, id_attribute.key) for obj in objects]
+        if not ids or not relationship_fields:
+            return {field: [0] * len(ids) for field in relationship_fields}
+
+        session = self.get_read_session()
+        query = session.query(id_attribute).filter(id_attribute.in_(set(ids)))
+        for field in relationship_fields:
+            attribute = getattr(self.model, get_model_field(self.resource.schema, field), None)
+            if not isinstance(getattr(attribute, 'property', None), RelationshipProperty) \
+                    or not attribute.property.uselist:
+                raise Exception("{} is not a to-many relationship of {}".format(field, self.model.__name__))
+
+            related_model = attribute.property.mapper.class_
+            related_primary_key = inspect(attribute.property.mapper).primary_key[0]
+            count_query = session.query(id_attribute.label('id'), func.count(related_primary_key).label('count'))\
+                .join(attribute)\
+                .filter(id_attribute.in_(set(ids)))
+            related_schema = get_related_schema_cls(self.resource.schema, field)
+            permission_filters = self.get_related_permission_filters(related_schema)
+            if permission_filters:
+                count_query = self.apply_permission_filters(count_query,
+                                                            permission_filters,
+                                                            related_model,
+                                                            related_schema)
+            count_query = count_query.group_by(id_attribute).subquery()
+            query = query.outerjoin(count_query, count_query.c.id == id_attribute).add_columns(count_query.c.count)
+
+        rows = {row[0]: row[1:] for row in query}
+        counts = {field: [] for field in relationship_fields}
+        for id_ in ids:
+            for field, count in zip(relationship_fields, rows.get(id_) or [0] * len(relationship_fields)):
+                counts[field].append(count or 0)
+        return counts
+
     def get_related_object(self, related_model, related_id_field, obj):
         """Get a related object
 
@@ -491,35 +869,136 @@ class SqlalchemyDataLayer(BaseDataLayer):
         for nested_field in nested_fields_to_apply:
             setattr(obj, nested_field['field'], nested_field['value'])
 
-    def filter_query(self, query, filter_info, model):
+    def filter_query(self, query, filter_info, model, joins=None, schema=None):
         """Filter query according to jsonapi 1.0
 
         :param Query query: sqlalchemy query to sort
         :param filter_info: filter information
         :type filter_info: dict or None
         :param DeclarativeMeta model: an sqlalchemy model
+        :param dict joins: the aliases already joined to the query by relationship path, None to not join
+        :param Schema schema: the schema of the filtered model, the schema of the resource by default
         :return Query: the sorted query
         """
         if filter_info:
-            filters = create_filters(model, filter_info, self.resource)
-            query = query.filter(*filters)
+            from flask_rest_jsonapi.data_layers.filtering.alchemy import create_filters
+
+            join = None
+            joined_query = [query]
+            if getattr(self, 'filter_join_strategy', 'exists') == 'join' and joins is not None and model is self.model:
+                def join(path):
+                    joined_query[0], alias = self.join_relationship_path(joined_query[0], list(path), joins)
+                    return alias
+
+            filters = create_filters(model,
+                                     filter_info,
+                                     self.resource,
+                                     join,
+                                     self.get_dialect_name(query),
+                                     schema=schema)
+            query = joined_query[0].filter(*filters)
+
+        return query
+
+    def get_dialect_name(self, query):
+        """Get the name of the database dialect a query runs on
+
+        :param Query query: sqlalchemy query
+        :return str: the name of the dialect, None if the session is not bound
+        """
+        try:
+            return query.session.get_bind(mapper=inspect(self.model).mapper).dialect.name
+        except UnboundExecutionError:
+            return None
+
+    def apply_permission_filters(self, query, permission_filters, model=None, schema=None):
+        """Restrict a query to the objects the current request can access
+
+        :param Query query: sqlalchemy query
+        :param list permission_filters: filters as in the filter querystring parameter or sqlalchemy criteria
+        :param DeclarativeMeta model: the model the filters apply to, the model of the data layer by default
+        :param Schema schema: the schema of this model, the schema of the resource by default
+        :return Query: the restricted query
+        """
+        filter_info = [filter_ for filter_ in permission_filters if isinstance(filter_, dict)]
+        criteria = [filter_ for filter_ in permission_filters if not isinstance(filter_, dict)]
+
+        if filter_info:
+            query = self.filter_query(query, filter_info, model or self.model, schema=schema)
+        if criteria:
+            query = query.filter(*criteria)
 
         return query
 
-    def sort_query(self, query, sort_info):
+    def sort_query(self, query, sort_info, joins=None):
         """Sort query according to jsonapi 1.0
 
         :param Query query: sqlalchemy query to sort
         :param list sort_info: sort information
+        :param dict joins: the aliases already joined to the query by relationship path
         :return Query: the sorted query
         """
+        joins = joins if joins is not None else {}
         for sort_opt in sort_info:
-            field = sort_opt['field']
-            if not hasattr(self.model, field):
-                raise InvalidSort("{} has no attribute {}".format(self.model.__name__, field))
-            query = query.order_by(getattr(getattr(self.model, field), sort_opt['order'])())
+            path = sort_opt['field'].split('.')
+            query, entity = self.join_relationship_path(query, path[:-1], joins)
+
+            field = path[-1]
+            if not hasattr(entity, field):
+                raise InvalidSort("{} has no attribute {}".format(inspect(entity).mapper.class_.__name__, field))
+            query = query.order_by(getattr(getattr(entity, field), sort_opt['order'])())
         return query
 
+    def join_relationship_path(self, query, path, joins):
+        """Outer join the models of a path of to-one relationships to a query, once for each path prefix
+
+        :param Query query: sqlalchemy query
+        :param list path: the relationship attributes, from the model of the data layer
+        :param dict joins: the aliases already joined to the query by relationship path, updated with new ones
+        :return tuple: the query and the alias of the last model of the path
+        """
+        entity = self.model
+        for index, relationship_field in enumerate(path):
+            key = tuple(path[:index + 1])
+            if key not in joins:
+                attribute = getattr(entity, relationship_field, None)
+                if not isinstance(getattr(attribute, 'property', None), RelationshipProperty):
+                    raise InvalidSort("{} is not a relationship of {}"
+                                      .format(relationship_field, inspect(entity).mapper.class_.__name__))
+                if attribute.property.uselist:
+                    raise InvalidSort("{} is a to-many relationship".format(relationship_field))
+
+                joins[key] = aliased(attribute.property.mapper.class_)
+                query = query.outerjoin(attribute.of_type(joins[key]))
+            entity = joins[key]
+
+        return query, entity
+
+    def get_page_by_primary_keys(self, query, qs):
+        """Retrieve a page of objects with a deferred join: select the primary keys of the page with the filters, the
+        sort and the pagination of the query, then load the objects and their includes for these keys only
+
+        :param Query query: sqlalchemy query filtered and sorted
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :return list: the objects of the page, in the order of the query
+        """
+        primary_key = inspect(self.model).primary_key
+        keys = self.paginate_query(query.with_entities(*primary_key), qs.pagination).all()
+        if not keys:
+            return []
+
+        object_query = query.session.query(self.model)
+        if len(primary_key) == 1:
+            object_query = object_query.filter(primary_key[0].in_([key[0] for key in keys]))
+        else:
+            object_query = object_query.filter(tuple_(*primary_key).in_([tuple(key) for key in keys]))
+
+        if getattr(self, 'eagerload_includes', True):
+            object_query = self.eagerload_includes(object_query, qs)
+
+        objects = {inspect(obj).identity: obj for obj in object_query}
+        return [objects[tuple(key)] for key in keys if tuple(key) in objects]
+
     def paginate_query(self, query, paginate_info):
         """Paginate query according to jsonapi 1.0
 
@@ -544,41 +1023,129 @@ class SqlalchemyDataLayer(BaseDataLayer):
         :param QueryStringManager qs: a querystring manager to retrieve information from url
         :return Query: the query with includes eagerloaded
         """
-        for include in qs.include:
-            joinload_object = None
-
-            if '.' in include:
-                current_schema = self.resource.schema
-                for obj in include.split('.'):
-                    try:
-                        field = get_model_field(current_schema, obj)
-                    except Exception as e:
-                        raise InvalidInclude(str(e))
+        if qs.include:
+            # included relationships limited by page[<relationship>][size] are loaded by get_include_pages
+            include_pagination = self.get_include_pagination(qs)
+            include_tree = {field: related_include_tree
+                            for field, related_include_tree in plan_includes(qs.include).items()
+                            if field not in include_pagination}
+            if include_tree:
+                query = query.options(*self.get_cached_include_loaders(self.resource.schema, include_tree))
 
-                    if joinload_object is None:
-                        joinload_object = joinedload(field)
-                    else:
-                        joinload_object = joinload_object.joinedload(field)
+        return query
 
-                    related_schema_cls = get_related_schema(current_schema, obj)
+    def get_cached_include_loaders(self, schema, include_tree):
+        """Get the loader options of a tree of includes of the model, built by get_include_loaders on first use
 
-                    if isinstance(related_schema_cls, SchemaABC):
-                        related_schema_cls = related_schema_cls.__class__
-                    else:
-                        related_schema_cls = class_registry.get_class(related_schema_cls)
+        :param Schema schema: the schema of the model
+        :param dict include_tree: the included relationship fields, each mapped to the tree of its own includes
+        :return list: the loader options
+        """
+        key = (schema, freeze_include_tree(include_tree))
+        loaders = self.include_loaders.get(key)
+        if loaders is None:
+            loaders = self.get_include_loaders(schema, self.model, include_tree)
+            self.include_loaders.set(key, loaders)
+        return loaders
 
-                    current_schema = related_schema_cls
-            else:
-                try:
-                    field = get_model_field(self.resource.schema, include)
-                except Exception as e:
-                    raise InvalidInclude(str(e))
+    def get_include_pagination(self, qs):
+        """Get the maximum numbers of included objects by to-many relationship that get_include_pages loads with
+        window queries
 
-                joinload_object = joinedload(field)
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :return dict: the page sizes by relationship field
+        """
+        if len(inspect(self.model).primary_key) != 1:
+            return {}
+        return qs.include_pagination
 
-            query = query.options(joinload_object)
+    def get_include_pages(self, objects, qs):
+        """Get the first related objects of the included relationships limited by page[<relationship>][size]
+        parameters, with one query by relationship numbering the related objects of each object with
+        ROW_NUMBER() OVER (PARTITION BY <object>), so that popular objects don't load all their related objects.
+        The relationships of the objects are left untouched in the session.
 
-        return query
+        :param list objects: the objects
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :return dict: the lists of related objects, in the order of the objects, by relationship field
+        """
+        include_pagination = self.get_include_pagination(qs)
+        if not include_pagination:
+            return super(SqlalchemyDataLayer, self).get_include_pages(objects, qs)
+        if not objects:
+            return {field: [] for field in include_pagination}
+
+        schema = self.resource.schema
+        include_tree = plan_includes(qs.include)
+        session = object_session(objects[0]) or self.session
+        mapper = inspect(self.model)
+        parent = aliased(self.model)
+        parent_key = getattr(parent, mapper.get_property_by_column(mapper.primary_key[0]).key)
+        keys = [inspect(obj).identity[0] for obj in objects]
+
+        pages = {}
+        for field, size in include_pagination.items():
+            attribute = getattr(self.model, get_model_field(schema, field))
+            related_model = attribute.property.mapper.class_
+            order_by = attribute.property.order_by or inspect(related_model).primary_key
+
+            row_number = func.row_number().over(partition_by=parent_key, order_by=order_by).label('row_number')
+            numbered = session.query(related_model, parent_key.label('parent_key'), row_number)\
+                .select_from(parent)\
+                .join(getattr(parent, attribute.key))\
+                .filter(parent_key.in_(keys))
+            related_schema = get_related_schema_cls(schema, field)
+            permission_filters = self.get_related_permission_filters(related_schema)
+            if permission_filters:
+                numbered = self.apply_permission_filters(numbered, permission_filters, related_model, related_schema)
+            numbered = numbered.subquery()
+            related = aliased(related_model, numbered)
+
+            query = session.query(related, numbered.c.parent_key)\
+                .filter(numbered.c.row_number <= size)\
+                .order_by(numbered.c.parent_key, numbered.c.row_number)
+            if include_tree[field]:
+                query = query.options(*self.get_include_loaders(related_schema,
+                                                                related,
+                                                                include_tree[field]))
+
+            related_objects = defaultdict(list)
+            for related_obj, key in query:
+                related_objects[key].append(related_obj)
+
+            pages[field] = [related_objects[key] for key in keys]
+
+        return pages
+
+    def get_include_loaders(self, schema, model, include_tree):
+        """Build one tree of joinedload options for a tree of includes, so that include paths sharing a prefix join
+        it once
+
+        :param Schema schema: the schema of the model
+        :param DeclarativeMeta model: an sqlalchemy model
+        :param dict include_tree: the included relationship fields, each mapped to the tree of its own includes
+        :return list: the loader options
+        """
+        loaders = []
+        for field, related_include_tree in include_tree.items():
+            try:
+                attribute = getattr(model, get_model_field(schema, field))
+                # loader options built from mapped attributes instead of strings have a stable cache key
+                loader = joinedload(attribute)
+
+                if related_include_tree:
+                    related_loaders = self.get_include_loaders(get_related_schema_cls(schema, field),
+                                                               attribute.property.mapper.class_,
+                                                               related_include_tree)
+                    loader = loader.options(*related_loaders)
+            except InvalidInclude:
+                raise
+            except Exception as e:
+                raise InvalidInclude(str(e))
+
+            loaders.append(loader)
+
+        return loaders
 
     def retrieve_object_query(self, view_kwargs, filter_field, filter_value):
         """Build query to retrieve object
@@ -588,14 +1155,14 @@ class SqlalchemyDataLayer(BaseDataLayer):
         :params filter_value: the value to filter with
         :return sqlalchemy query: a query from sqlalchemy
         """
-        return self.session.query(self.model).filter(filter_field == filter_value)
+        return self.get_read_session().query(self.model).filter(filter_field == filter_value)
 
     def query(self, view_kwargs):
         """Construct the base query to retrieve wanted data
 
         :param dict view_kwargs: kwargs from the resource view
         """
-        return self.session.query(self.model)
+        return self.get_read_session().query(self.model)
 
     def before_create_object(self, data, view_kwargs):
         """Provide additional data before object creation
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""This module is a CRUD interface between asynchronous resource managers and the asyncio extension of sqlalchemy.
+
+The data layer runs the logic of SqlalchemyDataLayer (filters, sorts, pagination, includes, relationships) inside
+AsyncSession.run_sync so that database I/O is awaited. Requests run as tasks of the event loop shared by the process
+(see resource.run_awaitable): the I/O of concurrent requests is multiplexed on this loop, but the worker thread of each
+request waits for its task, so the number of concurrent requests is still bounded by the workers of the server.
+"""
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from flask_rest_jsonapi.data_layers.base import BaseDataLayer
+from flask_rest_jsonapi.data_layers.alchemy import SqlalchemyDataLayer
+from flask_rest_jsonapi.utils import LRUCache
+
+
+def resolve_async_session(session):
+    """Get the asyncio session of the current request from an AsyncSession or an async_scoped_session
+
+    :param session: an AsyncSession or an async_scoped_session
+    :return AsyncSession: an asyncio session
+    """
+    if isinstance(session, AsyncSession):
+        return session
+    return session()
+
+
+class AsyncSqlalchemyDataLayer(SqlalchemyDataLayer):
+    """Sqlalchemy data layer using an asyncio session"""
+
+    def __init__(self, kwargs):
+        """Initialize an instance of AsyncSqlalchemyDataLayer
+
+        :param dict kwargs: initialization parameters of an AsyncSqlalchemyDataLayer instance
+        """
+        BaseDataLayer.__init__(self, kwargs)
+
+        if getattr(self, 'async_session', None) is None:
+            raise Exception("You must provide a session in data_layer_kwargs to use async sqlalchemy data layer")
+        if not hasattr(self, 'model'):
+            raise Exception("You must provide a model in data_layer_kwargs to use async sqlalchemy data layer")
+
+        self.include_loaders = LRUCache(max_size=256, sizeof=None)
+
+    @property
+    def session(self):
+        """The synchronous session wrapped by the asyncio session of the current request. It can only do I/O inside
+        run_sync
+        """
+        return self.get_async_session().sync_session
+
+    @session.setter
+    def session(self, session):
+        """Set the asyncio session of the data layer
+
+        :param session: an AsyncSession or an async_scoped_session
+        """
+        self.async_session = session
+
+    def get_async_session(self):
+        """Get the asyncio session to use for the current request
+
+        :return AsyncSession: an asyncio session
+        """
+        return resolve_async_session(self.async_session)
+
+    def get_read_session(self):
+        """Get the synchronous session wrapped by the asyncio session to read data from
+
+        :return Session: the session to read data from
+        """
+        session = super(AsyncSqlalchemyDataLayer, self).get_read_session()
+        if session is not self.session:
+            session = resolve_async_session(session).sync_session
+        return session
+
+    def get_concurrent_count_bind(self, session):
+        """The count query can't leave the greenlet of the asyncio session, so it is never run concurrently
+
+        :param Session session: the session of the collection query
+        :return None: always None
+        """
+        return None
+
+    async def run_sync(self, func, *args, **kwargs):
+        """Run a synchronous function in a greenlet of the asyncio session so that the data layer methods it calls
+        await database I/O on the event loop
+
+        :param callable func: the function to run
+        :param list args: positional arguments of the function
+        :param dict kwargs: keyword arguments of the function
+        :return: the result of the function
+        """
+        return await self.get_async_session().run_sync(lambda sync_session: func(*args, **kwargs))
+
+    async def remove_session(self):
+        """Close and discard the sessions of the current request of async_scoped_session. A plain AsyncSession is
+        shared by every request, so it is left to the application
+        """
+        for session in (self.async_session, getattr(self, 'read_session', None)):
+            if session is not None and not isinstance(session, AsyncSession):
+                await session.remove()
@@ -4,6 +4,20 @@
 
 import types
 
+from flask import request, has_request_context, g
+
+from flask_rest_jsonapi.schema import get_model_field
+
+
+def remove_read_sessions(exception=None):
+    """Remove the scoped read sessions used by data layers during the current request, registered as a teardown
+    function by Api
+
+    :param Exception exception: the exception that ended the request, if any
+    """
+    for read_session in g.pop('jsonapi_read_sessions', ()):
+        read_session.remove()
+
 
 class BaseDataLayer(object):
     """Base class of a data layer"""
@@ -70,6 +84,17 @@ class BaseDataLayer(object):
         """
         raise NotImplementedError
 
+    def get_aggregates(self, qs, view_kwargs, filters=None):
+        """Compute the aggregates of the aggregate querystring parameter over the filtered collection, by group of
+        the group_by querystring parameter
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param dict filters: A dictionary of key/value filters to apply to the eventual query
+        :return list: a dict by group like {'group': {'status': 'open'}, 'count': {'*': 12}, 'sum': {'amount': 150}}
+        """
+        raise NotImplementedError
+
     def update_object(self, obj, data, view_kwargs):
         """Update an object
 
@@ -131,6 +156,84 @@ class BaseDataLayer(object):
         """
         raise NotImplementedError
 
+    def get_relationship_counts(self, objects, relationship_fields):
+        """Count the related objects of to-many relationships of objects
+
+        :param list objects: the objects
+        :param list relationship_fields: the schema fields of the relationships
+        :return dict: the numbers of related objects, in the order of the objects, by relationship field
+        """
+        counts = {}
+        for field in relationship_fields:
+            model_field = get_model_field(self.resource.schema, field)
+            counts[field] = [len(getattr(obj, model_field) or ()) for obj in objects]
+        return counts
+
+    def get_include_pages(self, objects, qs):
+        """Get the first related objects of the included relationships limited by page[<relationship>][size]
+        parameters. They are returned apart from the objects so that the limited lists never replace the
+        relationships of the objects themselves
+
+        :param list objects: the objects
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :return dict: the lists of related objects, in the order of the objects, by relationship field
+        """
+        pages = {}
+        for field, size in qs.include_pagination.items():
+            model_field = get_model_field(self.resource.schema, field)
+            pages[field] = [list(getattr(obj, model_field) or ())[:size] for obj in objects]
+        return pages
+
+    def detach_objects(self, objects):
+        """Get the value to cache for objects read by the data layer, shared by the next requests. Objects are cached
+        as is by default
+
+        :param objects: an object, a list of objects, a tuple of them or None
+        :return: the value to cache
+        """
+        return objects
+
+    def attach_objects(self, value):
+        """Get the objects of a value returned by detach_objects for the current request
+
+        :param value: a cached value
+        :return: the objects
+        """
+        return value
+
+    def get_permission_filters(self):
+        """Get the filters restricting the objects the current request can access, registered with
+        Api.permission_filter
+
+        :return list: filters as in the filter querystring parameter or criteria specific to the data layer
+        """
+        get_permission_filters = getattr(getattr(self, 'resource', None), 'get_permission_filters', None)
+        if get_permission_filters is None or not has_request_context():
+            return []
+
+        return get_permission_filters(self.resource, request.method)
+
+    def get_related_permission_filters(self, related_schema):
+        """Get the filters restricting the related objects the current request can access, those registered with
+        Api.permission_filter for the resource routed with the schema of the related objects
+
+        :param Schema related_schema: the schema of the related objects
+        :return list: filters as in the filter querystring parameter or criteria specific to the data layer
+        """
+        get_related_permission_filters = getattr(getattr(self, 'resource', None),
+                                                 'get_related_permission_filters',
+                                                 None)
+        if get_related_permission_filters is None or not has_request_context():
+            return []
+
+        return get_related_permission_filters(related_schema, 'GET')
+
+    def warmup(self):
+        """Resolve and validate the configuration of the data layer at startup. Override it to pre-build caches or to
+        fail fast on misconfiguration instead of failing on the first request
+        """
+        pass
+
     def query(self, view_kwargs):
         """Construct the base query to retrieve wanted data
 
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+"""A data layer wrapping another data layer to cache the results of its read methods.
+
+Results are cached in a LRUCache shared by every caching data layer of the same namespace (the model of the wrapped
+data layer by default) and the whole namespace is invalidated by the write methods of any of them. Objects are cached
+as returned by the detach_objects method of the wrapped data layer, copies out of the session with the SQLAlchemy data
+layer, and given back to each request by its attach_objects method.
+"""
+
+import json
+import sys
+from threading import Lock
+
+from flask import request, has_request_context
+
+from flask_rest_jsonapi.data_layers.base import BaseDataLayer
+from flask_rest_jsonapi.utils import LRUCache
+
+caches = {}
+caches_lock = Lock()
+
+# number of invalidations of each namespace, part of the cache keys so that a result read before an invalidation
+# is never stored under the key of the results read after it
+generations = {}
+
+
+def cached_size(value):
+    """Estimate the size of a cached result in bytes, without walking the objects it refers to
+
+    :param value: a cached result
+    :return int: the size in bytes
+    """
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(cached_size(item) for item in value)
+    if hasattr(value, '__dict__'):
+        return sys.getsizeof(value) + sys.getsizeof(value.__dict__)
+    return sys.getsizeof(value)
+
+
+def get_cache(namespace, max_size=1024, ttl=None, max_bytes=None):
+    """Get the cache of a namespace, created on first use
+
+    :param namespace: the namespace
+    :param int max_size: the maximum number of entries
+    :param float ttl: the number of seconds an entry stays valid
+    :param int max_bytes: the maximum total size of the entries in bytes
+    :return LRUCache: the cache
+    """
+    with caches_lock:
+        cache = caches.get(namespace)
+        if cache is None:
+            cache = caches[namespace] = LRUCache(max_size=max_size, ttl=ttl, max_bytes=max_bytes, sizeof=cached_size)
+        elif (cache.max_size, cache.ttl, cache.max_bytes) != (max_size, ttl, max_bytes):
+            raise Exception("The cache of namespace {} already exists with max_size={}, ttl={} and max_bytes={}"
+                            .format(namespace, cache.max_size, cache.ttl, cache.max_bytes))
+    return cache
+
+
+def get_generation(namespace):
+    """Get the number of invalidations of a namespace
+
+    :param namespace: the namespace
+    :return int: the generation
+    """
+    return generations.get(namespace, 0)
+
+
+def invalidate(namespace):
+    """Clear the cache of a namespace
+
+    :param namespace: the namespace
+    """
+    with caches_lock:
+        generations[namespace] = generations.get(namespace, 0) + 1
+        cache = caches.get(namespace)
+    if cache is not None:
+        cache.clear()
+
+
+class CachingDataLayer(BaseDataLayer):
+    """Data layer caching the results of get_object, get_collection and get_relationship of another data layer"""
+
+    def __init__(self, kwargs):
+        """Initialize an instance of CachingDataLayer
+
+        :param dict kwargs: initialization parameters of a CachingDataLayer instance
+        """
+        super(CachingDataLayer, self).__init__(kwargs)
+
+        if not hasattr(self, 'layer'):
+            raise Exception("You must provide the data layer to wrap in data_layer_kwargs to use caching data layer")
+
+        if not hasattr(self, 'namespace'):
+            self.namespace = getattr(self.layer, 'store', None) or getattr(self.layer, 'model', None) or self.layer
+
+        self.cache = get_cache(self.namespace,
+                               max_size=getattr(self, 'max_size', 1024),
+                               ttl=getattr(self, 'ttl', None),
+                               max_bytes=getattr(self, 'max_bytes', None))
+
+    def __getattr__(self, name):
+        """Give access to the attributes of the wrapped data layer"""
+        if name == 'layer':
+            raise AttributeError(name)
+        return getattr(self.layer, name)
+
+    @property
+    def resource(self):
+        """The resource of the wrapped data layer"""
+        return self.layer.resource
+
+    @resource.setter
+    def resource(self, resource):
+        self.layer.resource = resource
+
+    def create_object(self, data, view_kwargs):
+        obj = self.layer.create_object(data, view_kwargs)
+        self.invalidate()
+        return obj
+
+    def get_object(self, view_kwargs, qs=None):
+        """Retrieve an object from the cache or from the wrapped data layer
+
+        :params dict view_kwargs: kwargs from the resource view
+        :return: an object
+        """
+        if not self.is_cacheable():
+            return self.layer.get_object(view_kwargs, qs=qs)
+
+        key = self.cache_key('object', view_kwargs, qs.include if qs is not None else None)
+        value = self.cache.get(key, self)
+        if value is not self:
+            return self.layer.attach_objects(value)
+
+        obj = self.layer.get_object(view_kwargs, qs=qs)
+        self.cache.set(key, self.layer.detach_objects(obj))
+        return obj
+
+    def get_collection(self, qs, view_kwargs, filters=None):
+        """Retrieve a collection of objects from the cache or from the wrapped data layer
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param dict filters: A dictionary of key/value filters to apply to the eventual query
+        :return tuple: the number of object and the list of objects
+        """
+        if not self.is_cacheable():
+            return self.layer.get_collection(qs, view_kwargs, filters=filters)
+
+        key = self.cache_key('collection', view_kwargs, filters, qs.filters, qs.sorting, qs.pagination, qs.include)
+        value = self.cache.get(key)
+        if value is not None:
+            return value[0], self.layer.attach_objects(value[1])
+
+        object_count, collection = self.layer.get_collection(qs, view_kwargs, filters=filters)
+        collection = list(collection)
+        self.cache.set(key, (object_count, self.layer.detach_objects(collection)))
+        return object_count, collection
+
+    def get_aggregates(self, qs, view_kwargs, filters=None):
+        """Get aggregates from the cache or from the wrapped data layer
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param dict filters: A dictionary of key/value filters to apply to the eventual query
+        :return list: the aggregates by group
+        """
+        if not self.is_cacheable():
+            return self.layer.get_aggregates(qs, view_kwargs, filters=filters)
+
+        key = self.cache_key('aggregates', view_kwargs, filters, qs.filters, qs.aggregates, qs.group_by)
+        result = self.cache.get(key)
+        if result is None:
+            result = self.layer.get_aggregates(qs, view_kwargs, filters=filters)
+            self.cache.set(key, result)
+        return result
+
+    def update_object(self, obj, data, view_kwargs):
+        result = self.layer.update_object(obj, data, view_kwargs)
+        self.invalidate()
+        return result
+
+    def delete_object(self, obj, view_kwargs):
+        self.layer.delete_object(obj, view_kwargs)
+        self.invalidate()
+
+    def create_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
+        result = self.layer.create_relationship(json_data, relationship_field, related_id_field, view_kwargs)
+        self.invalidate()
+        return result
+
+    def get_relationship(self, relationship_field, related_type_, related_id_field, view_kwargs):
+        """Get a relationship from the cache or from the wrapped data layer
+
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_type_: the related resource type
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        :return tuple: the object and related object(s)
+        """
+        if not self.is_cacheable():
+            return self.layer.get_relationship(relationship_field, related_type_, related_id_field, view_kwargs)
+
+        key = self.cache_key('relationship', view_kwargs, relationship_field, related_type_, related_id_field)
+        value = self.cache.get(key)
+        if value is not None:
+            return tuple(self.layer.attach_objects(value))
+
+        result = self.layer.get_relationship(relationship_field, related_type_, related_id_field, view_kwargs)
+        self.cache.set(key, self.layer.detach_objects(result))
+        return result
+
+    def get_relationship_counts(self, objects, relationship_fields):
+        return self.layer.get_relationship_counts(objects, relationship_fields)
+
+    def get_include_pages(self, objects, qs):
+        return self.layer.get_include_pages(objects, qs)
+
+    def update_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
+        result = self.layer.update_relationship(json_data, relationship_field, related_id_field, view_kwargs)
+        self.invalidate()
+        return result
+
+    def delete_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
+        result = self.layer.delete_relationship(json_data, relationship_field, related_id_field, view_kwargs)
+        self.invalidate()
+        return result
+
+    def warmup(self):
+        self.layer.warmup()
+
+    def query(self, view_kwargs):
+        return self.layer.query(view_kwargs)
+
+    def is_cacheable(self):
+        """Check if results can be read from the cache. Objects read by write requests are not cached because they
+        are modified by the request, and results restricted by permission filters are only cached by identity
+
+        :return bool: True for GET and HEAD requests
+        """
+        if not has_request_context() or request.method not in ('GET', 'HEAD'):
+            return False
+
+        return not self.get_permission_filters() or self.get_permission_identity() is not None
+
+    def get_permission_identity(self):
+        """Get the identity of the current user the permission filters are cached by
+
+        :return: the identity, or None
+        """
+        get_permission_identity = getattr(self.resource, 'get_permission_identity', None)
+        if get_permission_identity is None:
+            return None
+        return get_permission_identity()
+
+    def cache_key(self, *args):
+        """Compute a cache key, scoped to the resource and the class of the wrapped data layer since resources sharing
+        a namespace can query the same model differently, and to the generation of the namespace read before the
+        wrapped data layer is called
+
+        :param list args: the values identifying a result
+        :return str: the key
+        """
+        resource = getattr(self.layer, 'resource', None)
+        layer_cls = type(self.layer)
+        args = (get_generation(self.namespace),
+                '{}.{}'.format(getattr(resource, '__module__', None), getattr(resource, '__name__', None)),
+                '{}.{}'.format(layer_cls.__module__, layer_cls.__name__)) + args
+        if self.get_permission_filters():
+            args = (self.get_permission_identity(),) + args
+        return json.dumps(args, sort_keys=True, default=str)
+
+    def invalidate(self):
+        """Clear the cache of the namespace of the data layer and of the namespaces listed in the invalidates
+        parameter
+        """
+        invalidate(self.namespace)
+        for namespace in getattr(self, 'invalidates', ()):
+            invalidate(namespace)
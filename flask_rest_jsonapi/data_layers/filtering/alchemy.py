@@ -2,49 +2,213 @@
 
 """Helper to create sqlalchemy filters according to filter querystring parameter"""
 
-from sqlalchemy import and_, or_, not_
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+
+from flask import current_app, has_app_context
+from marshmallow import fields, ValidationError
+from sqlalchemy import and_, or_, not_, any_, bindparam, func, inspect, select, String
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import ColumnProperty, RelationshipProperty
 
 from flask_rest_jsonapi.exceptions import InvalidFilters
 from flask_rest_jsonapi.schema import get_relationships, get_nested_fields, get_model_field
 
 
-def create_filters(model, filter_info, resource):
+class DateOrDateTime(fields.DateTime):
+    """A datetime field also accepting ISO dates, as midnight, so that DateTime columns are filtered by day"""
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        try:
+            return super(DateOrDateTime, self)._deserialize(value, attr, data, **kwargs)
+        except ValidationError as e:
+            try:
+                return datetime.combine(fields.Date()._deserialize(value, attr, data, **kwargs), time())
+            except ValidationError:
+                raise e
+
+
+class IntegralInteger(fields.Integer):
+    """An integer field refusing numbers with a fractional part instead of truncating them"""
+
+    def _validated(self, value):
+        if isinstance(value, (float, Decimal)) and value % 1 != 0:
+            raise self.make_error('invalid', input=value)
+        return super(IntegralInteger, self)._validated(value)
+
+
+COERCER_FIELDS = ((bool, fields.Boolean),
+                  (int, IntegralInteger),
+                  (float, fields.Float),
+                  (Decimal, fields.Decimal),
+                  (datetime, DateOrDateTime),
+                  (date, fields.Date),
+                  (time, fields.Time),
+                  (UUID, fields.UUID))
+
+PATTERN_OPERATORS = ('like', 'ilike', 'notlike', 'notilike', 'startswith', 'endswith', 'contains', 'match')
+
+IN_OPERATORS = ('in', 'in_', 'notin', 'notin_', 'not_in')
+
+coercers_cache = {}
+
+
+def create_filters(model, filter_info, resource, join=None, dialect=None, schema=None):
     """Apply filters from filters information to base query
 
     :param DeclarativeMeta model: the model of the node
     :param dict filter_info: current node filter information
     :param Resource resource: the resource
+    :param callable join: a function joining a path of to-one relationships to the query and returning the alias of
+                          the last related model, to filter on to-one relationships with joins instead of EXISTS
+    :param str dialect: the name of the database dialect of the query, to bind large lists of values efficiently
+    :param Schema schema: the schema the filtered fields belong to, the schema of the resource by default
     """
+    schema = schema or resource.schema
     filters = []
-    for filter_ in filter_info:
-        filters.append(Node(model, filter_, resource, resource.schema).resolve())
+    for filter_ in merge_relationship_filters(filter_info, ('has',), 'and'):
+        filters.append(Node(model, filter_, resource, schema, join, dialect=dialect).resolve())
 
     return filters
 
 
+def get_coercers(schema, model):
+    """Get the functions converting filter values to the python type of the columns of the fields of a schema, so that
+    they are compared to the columns without casts. They are computed once by schema and model.
+
+    :param Schema schema: a marshmallow schema
+    :param DeclarativeMeta model: an sqlalchemy model or alias
+    :return dict: the coercers by schema field
+    """
+    mapper = inspect(model).mapper
+    key = (schema, mapper)
+    if key not in coercers_cache:
+        coercers = {}
+        for name in schema._declared_fields:
+            prop = mapper.attrs.get(get_model_field(schema, name))
+            if not isinstance(prop, ColumnProperty) or len(prop.columns) != 1:
+                continue
+
+            try:
+                python_type = prop.columns[0].type.python_type
+            except NotImplementedError:
+                continue
+
+            for type_, field_class in COERCER_FIELDS:
+                if issubclass(python_type, type_):
+                    coercers[name] = field_class().deserialize
+                    break
+        coercers_cache[key] = coercers
+
+    return coercers_cache[key]
+
+
+def get_in_list_threshold():
+    """Get the number of values above which a list of values is bound as one parameter
+
+    :return int: the number of values
+    """
+    if has_app_context():
+        return current_app.config.get('FILTER_IN_LIST_THRESHOLD', 100)
+    return 100
+
+
+def create_in_list_filter(column, values, dialect):
+    """Create a filter checking that a column is in a large list of values, bound as one array parameter on
+    PostgreSQL and one JSON parameter on SQLite, so that the statement doesn't depend on the number of values and
+    doesn't hit the limits of parameters of drivers
+
+    :param InstrumentedAttribute column: the column to filter on
+    :param list values: the values
+    :param str dialect: the name of the database dialect
+    :return: the filter
+    """
+    if dialect == 'postgresql':
+        return column == any_(bindparam(None, values, type_=postgresql.ARRAY(column.type)))
+
+    if dialect == 'sqlite' and all(isinstance(value, (int, float, str)) for value in values):
+        json_values = func.json_each(bindparam(None, json.dumps(values), type_=String)).table_valued('value')
+        return column.in_(select(json_values.c.value))
+
+    return column.in_(values)
+
+
+def merge_relationship_filters(filter_info, ops, conjunction):
+    """Merge sibling filters on the same relationship into one filter so that they produce one EXISTS subquery
+
+    :param list filter_info: sibling filters
+    :param tuple ops: the relationship operators whose filters can be merged
+    :param str conjunction: "and" or "or", the conjunction of the sibling filters
+    :return list: the filters
+    """
+    merged = []
+    relationship_filters = {}
+    merged_keys = set()
+    for filter_ in filter_info:
+        name = filter_.get('name') if isinstance(filter_, dict) else None
+        if name is None or '__' in name or filter_.get('op') not in ops or filter_.get('field') is not None \
+                or not isinstance(filter_.get('val'), dict):
+            merged.append(filter_)
+            continue
+
+        key = (name, filter_['op'])
+        if key not in relationship_filters:
+            relationship_filters[key] = dict(filter_)
+            merged.append(relationship_filters[key])
+            continue
+
+        relationship_filter = relationship_filters[key]
+        if key not in merged_keys:
+            relationship_filter['val'] = {conjunction: [relationship_filter['val']]}
+            merged_keys.add(key)
+        relationship_filter['val'][conjunction].append(filter_['val'])
+
+    return merged
+
+
 class Node(object):
     """Helper to recursively create filters with sqlalchemy according to filter querystring parameter"""
 
-    def __init__(self, model, filter_, resource, schema):
+    def __init__(self, model, filter_, resource, schema, join=None, path=(), dialect=None):
         """Initialize an instance of a filter node
 
         :param Model model: an sqlalchemy model
         :param dict filter_: filters information of the current node and deeper nodes
         :param Resource resource: the base resource to apply filters on
         :param Schema schema: the serializer of the resource
+        :param callable join: the function joining to-one relationships to the query, None to use EXISTS
+        :param tuple path: the relationship attributes from the model of the query to the model of the node
+        :param str dialect: the name of the database dialect of the query
         """
         self.model = model
         self.filter_ = filter_
         self.resource = resource
         self.schema = schema
+        self.join = join
+        self.path = path
+        self.dialect = dialect
 
     def resolve(self):
         """Create filter for a particular node of the filter tree"""
         if 'or' not in self.filter_ and 'and' not in self.filter_ and 'not' not in self.filter_:
             value = self.value
 
+            if isinstance(value, dict) and self.join is not None and self.op == 'has' \
+                    and '__' not in self.filter_.get('name', '') and self.is_to_one_relationship:
+                return self.resolve_join(value)
+
             if isinstance(value, dict):
-                value = Node(self.related_model, value, self.resource, self.related_schema).resolve()
+                value = Node(self.related_model, value, self.resource, self.related_schema,
+                             dialect=self.dialect).resolve()
+            else:
+                value = self.coerce(value)
+
+                if self.op in IN_OPERATORS and isinstance(value, list) and '__' not in self.filter_.get('name', '') \
+                        and len(value) > get_in_list_threshold():
+                    condition = create_in_list_filter(self.column, value, self.dialect)
+                    return not_(condition) if self.op.startswith('not') else condition
 
             if '__' in self.filter_.get('name', ''):
                 value = {self.filter_['name'].split('__')[1]: value}
@@ -55,11 +219,50 @@ class Node(object):
                 return getattr(self.column, self.operator)(value)
 
         if 'or' in self.filter_:
-            return or_(Node(self.model, filt, self.resource, self.schema).resolve() for filt in self.filter_['or'])
+            return or_(Node(self.model, filt, self.resource, self.schema, dialect=self.dialect).resolve()
+                       for filt in merge_relationship_filters(self.filter_['or'], ('has', 'any'), 'or'))
         if 'and' in self.filter_:
-            return and_(Node(self.model, filt, self.resource, self.schema).resolve() for filt in self.filter_['and'])
+            return and_(Node(self.model, filt, self.resource, self.schema, self.join, self.path, self.dialect).resolve()
+                        for filt in merge_relationship_filters(self.filter_['and'], ('has',), 'and'))
         if 'not' in self.filter_:
-            return not_(Node(self.model, self.filter_['not'], self.resource, self.schema).resolve())
+            return not_(Node(self.model, self.filter_['not'], self.resource, self.schema,
+                             dialect=self.dialect).resolve())
+
+    def resolve_join(self, value):
+        """Create the filter of a to-one relationship on the joined related model instead of an EXISTS subquery
+
+        :param dict value: the filter of the related model
+        :return: the filter
+        """
+        path = self.path + (self.column.key,)
+        alias = self.join(path)
+        mapper = inspect(alias).mapper
+        related_exists = and_(*(getattr(alias, mapper.get_property_by_column(column).key).isnot(None)
+                                for column in mapper.primary_key))
+
+        return and_(related_exists,
+                    Node(alias, value, self.resource, self.related_schema, self.join, path, self.dialect).resolve())
+
+    def coerce(self, value):
+        """Convert a value to the python type of the column of the node
+
+        :param value: the value to filter on
+        :return: the converted value
+        """
+        if self.filter_.get('field') is not None or '__' in self.filter_.get('name', '') \
+                or self.op in PATTERN_OPERATORS:
+            return value
+
+        coercer = get_coercers(self.schema, self.model).get(self.name)
+        if coercer is None:
+            return value
+
+        try:
+            if isinstance(value, (list, tuple)):
+                return [coercer(item) if item is not None else None for item in value]
+            return coercer(value) if value is not None else None
+        except ValidationError as e:
+            raise InvalidFilters("Invalid value of {}: {}".format(self.name, e.messages))
 
     @property
     def name(self):
@@ -108,6 +311,15 @@ class Node(object):
         except AttributeError:
             raise InvalidFilters("{} has no attribute {}".format(self.model.__name__, model_field))
 
+    @property
+    def is_to_one_relationship(self):
+        """Check if the column is a to-one relationship
+
+        :return bool: True if the column is a to-one relationship
+        """
+        prop = getattr(self.column, 'property', None)
+        return isinstance(prop, RelationshipProperty) and not prop.uselist
+
     @property
     def operator(self):
         """Get the function operator from his name
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""Instrumentation of the sqlalchemy engines used by data layers"""
+
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+
+
+class CompiledCacheStats(object):
+    """Count the hits and misses of the compiled statement cache of sqlalchemy engines
+
+    Usage example:
+
+        stats = CompiledCacheStats(engine)
+        ...
+        print(stats.hit_ratio)
+    """
+
+    def __init__(self, engine=None):
+        """Initialize the statistics and listen to an engine
+
+        :param Engine engine: an sqlalchemy engine
+        """
+        self.lock = Lock()
+        self.reset()
+
+        if engine is not None:
+            self.listen(engine)
+
+    def listen(self, engine):
+        """Count the statements executed by an engine
+
+        :param Engine engine: an sqlalchemy engine
+        """
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def remove(self, engine):
+        """Stop counting the statements executed by an engine
+
+        :param Engine engine: an sqlalchemy engine
+        """
+        event.remove(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def reset(self):
+        """Reset the counters"""
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+            self.uncached = 0
+
+    @property
+    def hit_ratio(self):
+        """The ratio of cacheable statements found in the compiled cache
+
+        :return float: the hit ratio, or None if no cacheable statement was executed
+        """
+        total = self.hits + self.misses
+        if total == 0:
+            return None
+        return self.hits / float(total)
+
+    def to_dict(self):
+        """Get the counters as a dict
+
+        :return dict: the counters and the hit ratio
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'uncached': self.uncached,
+                'hit_ratio': self.hit_ratio}
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """Count an executed statement according to the compiled cache status of its execution context"""
+        if context is None:
+            return
+
+        cache_hit = getattr(context, 'cache_hit', None)
+        with self.lock:
+            if cache_hit is CACHE_HIT:
+                self.hits += 1
+            elif cache_hit is CACHE_MISS:
+                self.misses += 1
+            else:
+                self.uncached += 1
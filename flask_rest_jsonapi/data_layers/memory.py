@@ -0,0 +1,1202 @@
+# -*- coding: utf-8 -*-
+
+"""This module is a CRUD interface between resource managers and objects kept in memory.
+
+Objects are stored in an InMemoryStore that keeps a hash index on identifiers and optional hash and sorted indexes on
+other fields, so that filters and sorts on indexed fields don't scan every object.
+"""
+
+import re
+from functools import lru_cache
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from threading import RLock
+
+from flask import current_app
+from marshmallow import ValidationError
+from marshmallow_jsonapi.fields import BaseRelationship
+
+from flask_rest_jsonapi.data_layers.base import BaseDataLayer
+from flask_rest_jsonapi.exceptions import RelationNotFound, RelatedObjectNotFound, ObjectNotFound, InvalidFilters,\
+    InvalidSort
+from flask_rest_jsonapi.schema import get_model_field, get_relationships, get_nested_fields, get_related_schema_cls
+
+
+def get_path(obj, path):
+    """Get the value of a dotted attribute path, through related objects
+
+    :param obj: an object
+    :param str path: the attribute path, like "author.name"
+    :return: the value, or None if an object of the path is None
+    """
+    for field in path.split('.'):
+        if obj is None:
+            return None
+        obj = getattr(obj, field, None)
+    return obj
+
+
+class InMemoryObject(object):
+    """A plain object created from keyword arguments, the default model of the in-memory data layer"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.__dict__)
+
+
+class SortedIndex(object):
+    """Index of the identifiers of objects sorted by the value of a field"""
+
+    def __init__(self):
+        self.values = []
+        self.ids = []
+        self.nulls = {}
+
+    def build(self, pairs):
+        """Index objects at once with a single sort, instead of one insertion by object
+
+        :param iterable pairs: the values of the field and the identifiers of the objects
+        """
+        indexed = list(zip(self.values, self.ids))
+        for value, id_ in pairs:
+            if value is None:
+                self.nulls[id_] = None
+            else:
+                indexed.append((value, id_))
+        indexed.sort(key=lambda pair: pair[0])
+        self.values = [value for value, id_ in indexed]
+        self.ids = [id_ for value, id_ in indexed]
+
+    def add(self, value, id_):
+        """Index an object
+
+        :param value: the value of the field
+        :param id_: the identifier of the object
+        """
+        if value is None:
+            self.nulls[id_] = None
+            return
+
+        position = bisect_right(self.values, value)
+        self.values.insert(position, value)
+        self.ids.insert(position, id_)
+
+    def remove(self, value, id_):
+        """Remove an object from the index
+
+        :param value: the indexed value of the field
+        :param id_: the identifier of the object
+        """
+        if value is None:
+            self.nulls.pop(id_, None)
+            return
+
+        for position in range(bisect_left(self.values, value), bisect_right(self.values, value)):
+            if self.ids[position] == id_:
+                del self.values[position]
+                del self.ids[position]
+                return
+
+    def range(self, op, value):
+        """Get the identifiers of the objects whose value matches a comparison
+
+        :param str op: the comparison operator: lt, le, gt, ge or between
+        :param value: the value to compare with, a pair of bounds for between
+        :return list: the identifiers
+        """
+        if op == 'lt':
+            return self.ids[:bisect_left(self.values, value)]
+        if op == 'le':
+            return self.ids[:bisect_right(self.values, value)]
+        if op == 'gt':
+            return self.ids[bisect_right(self.values, value):]
+        if op == 'ge':
+            return self.ids[bisect_left(self.values, value):]
+        return self.ids[bisect_left(self.values, value[0]):bisect_right(self.values, value[1])]
+
+    def ordered_ids(self, order):
+        """Iterate over the identifiers in the order of the field values, null values first in ascending order
+
+        :param str order: asc or desc
+        :return iterator: the identifiers
+        """
+        if order == 'desc':
+            for id_ in reversed(self.ids):
+                yield id_
+            for id_ in self.nulls:
+                yield id_
+        else:
+            for id_ in self.nulls:
+                yield id_
+            for id_ in self.ids:
+                yield id_
+
+
+class InMemoryStore(object):
+    """Objects of a resource kept in memory and indexed by identifier"""
+
+    def __init__(self, objects=None, id_field='id', id_type=int, indexes=None, sorted_indexes=None):
+        """Initialize a store
+
+        :param iterable objects: the initial objects
+        :param str id_field: the identifier attribute of the objects
+        :param callable id_type: the type identifiers from urls and requests are converted to, None to keep them as is
+        :param iterable indexes: the fields to keep a hash index on, used by eq and in filters
+        :param iterable sorted_indexes: the fields to keep a sorted index on, used by sorts and range filters
+        """
+        self.id_field = id_field
+        self.id_type = id_type
+        self.objects = {}
+        self.snapshot = None
+        self.hash_indexes = {field: {} for field in indexes or ()}
+        self.sorted_indexes = {field: SortedIndex() for field in sorted_indexes or ()}
+        self.last_id = 0
+        self.lock = RLock()
+
+        for obj in objects or ():
+            id_ = self.identify(obj)
+            self.objects[id_] = obj
+            for field, index in self.hash_indexes.items():
+                index.setdefault(getattr(obj, field, None), {})[id_] = None
+        for field, index in self.sorted_indexes.items():
+            index.build((getattr(obj, field, None), id_) for id_, obj in self.objects.items())
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        # the objects are copied once after each addition or removal, not on every iteration
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self.lock:
+                if self.snapshot is None:
+                    self.snapshot = tuple(self.objects.values())
+                snapshot = self.snapshot
+        return iter(snapshot)
+
+    def coerce_id(self, value):
+        """Convert an identifier from an url or a request to the type of the identifiers of the store
+
+        :param value: an identifier
+        :return: the converted identifier, or None if it can't be converted
+        """
+        if self.id_type is None or value is None:
+            return value
+        try:
+            return self.id_type(value)
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, id_):
+        """Get an object by identifier
+
+        :param id_: the identifier
+        :return: the object or None
+        """
+        return self.objects.get(self.coerce_id(id_))
+
+    def identify(self, obj):
+        """Get the identifier of an object, an integer identifier is generated if it has none
+
+        :param obj: the object
+        :return: the identifier
+        """
+        id_ = getattr(obj, self.id_field, None)
+        if id_ is None:
+            id_ = self.last_id + 1
+            setattr(obj, self.id_field, id_)
+        if isinstance(id_, int):
+            self.last_id = max(self.last_id, id_)
+        return id_
+
+    def add(self, obj):
+        """Add an object, an integer identifier is generated if it has none
+
+        :param obj: the object
+        :return: the object
+        """
+        with self.lock:
+            id_ = self.identify(obj)
+            self.objects[id_] = obj
+            self.snapshot = None
+            self.index(obj, id_)
+
+        return obj
+
+    def update(self, obj, changes):
+        """Update fields of an object and its indexes
+
+        :param obj: the object
+        :param dict changes: the new values by field
+        """
+        with self.lock:
+            id_ = getattr(obj, self.id_field)
+            self.unindex(obj, id_)
+            for key, value in changes.items():
+                setattr(obj, key, value)
+            self.index(obj, id_)
+
+    def remove(self, obj):
+        """Remove an object
+
+        :param obj: the object
+        """
+        with self.lock:
+            id_ = getattr(obj, self.id_field)
+            if self.objects.pop(id_, None) is not None:
+                self.snapshot = None
+                self.unindex(obj, id_)
+
+    def index(self, obj, id_):
+        """Add an object to the indexes
+
+        :param obj: the object
+        :param id_: the identifier of the object
+        """
+        for field, index in self.hash_indexes.items():
+            index.setdefault(getattr(obj, field, None), {})[id_] = None
+        for field, index in self.sorted_indexes.items():
+            index.add(getattr(obj, field, None), id_)
+
+    def unindex(self, obj, id_):
+        """Remove an object from the indexes
+
+        :param obj: the object
+        :param id_: the identifier of the object
+        """
+        for field, index in self.hash_indexes.items():
+            value = getattr(obj, field, None)
+            index.get(value, {}).pop(id_, None)
+            if not index.get(value, True):
+                del index[value]
+        for field, index in self.sorted_indexes.items():
+            index.remove(getattr(obj, field, None), id_)
+
+    def lookup(self, field, values):
+        """Get the identifiers of the objects whose field is one of the values, with the hash indexes
+
+        :param str field: the field
+        :param iterable values: the values
+        :return set: the identifiers, or None if the field isn't indexed
+        """
+        if field == self.id_field:
+            ids = [self.coerce_id(value) for value in values]
+            with self.lock:
+                return {id_ for id_ in ids if id_ in self.objects}
+
+        index = self.hash_indexes.get(field)
+        if index is None:
+            return None
+
+        ids = set()
+        with self.lock:
+            try:
+                for value in values:
+                    ids.update(index.get(value, ()))
+            except TypeError:
+                return None
+        return ids
+
+    def range(self, field, op, value):
+        """Get the identifiers of the objects whose field matches a comparison, with the sorted indexes
+
+        :param str field: the field
+        :param str op: the comparison operator: lt, le, gt, ge or between
+        :param value: the value to compare with, a pair of bounds for between
+        :return list: the identifiers
+        """
+        with self.lock:
+            return self.sorted_indexes[field].range(op, value)
+
+    def ordered_ids(self, field, order):
+        """Get the identifiers in the order of the values of a field, with the sorted indexes
+
+        :param str field: the field
+        :param str order: asc or desc
+        :return list: the identifiers, copied so that writes don't change them while they are read
+        """
+        with self.lock:
+            return list(self.sorted_indexes[field].ordered_ids(order))
+
+    def ids(self):
+        """Get the identifiers of the objects
+
+        :return set: the identifiers
+        """
+        with self.lock:
+            return set(self.objects)
+
+
+@lru_cache(maxsize=256)
+def like_to_regex(pattern, flags=0):
+    """Convert a SQL LIKE pattern to a compiled regular expression
+
+    :param str pattern: the LIKE pattern
+    :param int flags: the regular expression flags
+    :return: the compiled regular expression
+    """
+    regex = ''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in pattern)
+    return re.compile(regex + r'\Z', flags | re.DOTALL)
+
+
+def ne(value, other):
+    if other is None:
+        return value is not None
+    return value is not None and value != other
+
+
+OPERATORS = {
+    'eq': lambda value, other: value == other,
+    'ne': ne,
+    'lt': lambda value, other: value is not None and value < other,
+    'le': lambda value, other: value is not None and value <= other,
+    'gt': lambda value, other: value is not None and value > other,
+    'ge': lambda value, other: value is not None and value >= other,
+    'between': lambda value, other: value is not None and other[0] <= value <= other[1],
+    'in': lambda value, other: value in other,
+    'notin': lambda value, other: value is not None and value not in other,
+    'is': lambda value, other: value is other,
+    'isnot': lambda value, other: value is not other,
+    'like': lambda value, other: value is not None and like_to_regex(other).match(value) is not None,
+    'ilike': lambda value, other: value is not None and like_to_regex(other, re.I).match(value) is not None,
+    'notlike': lambda value, other: value is not None and like_to_regex(other).match(value) is None,
+    'notilike': lambda value, other: value is not None and like_to_regex(other, re.I).match(value) is None,
+    'startswith': lambda value, other: value is not None and value.startswith(other),
+    'endswith': lambda value, other: value is not None and value.endswith(other),
+    'contains': lambda value, other: value is not None and other in value,
+}
+
+RANGE_OPERATORS = ('lt', 'le', 'gt', 'ge', 'between')
+
+PATTERN_OPERATORS = ('like', 'ilike', 'notlike', 'notilike', 'startswith', 'endswith', 'contains')
+
+
+class InMemoryDataLayer(BaseDataLayer):
+    """Data layer of objects kept in an InMemoryStore"""
+
+    def __init__(self, kwargs):
+        """Initialize an instance of InMemoryDataLayer
+
+        :param dict kwargs: initialization parameters of an InMemoryDataLayer instance
+        """
+        super(InMemoryDataLayer, self).__init__(kwargs)
+
+        if not hasattr(self, 'store'):
+            raise Exception("You must provide a store in data_layer_kwargs to use in-memory data layer")
+
+        if not hasattr(self, 'model'):
+            self.model = InMemoryObject
+        if not hasattr(self, 'related_stores'):
+            self.related_stores = {}
+
+    def create_object(self, data, view_kwargs):
+        """Create an object in the store
+
+        :param dict data: the data validated by marshmallow
+        :param dict view_kwargs: kwargs from the resource view
+        :return: an object
+        """
+        self.before_create_object(data, view_kwargs)
+
+        relationship_fields = get_relationships(self.resource.schema, model_field=True)
+
+        obj = self.model(**{key: value for (key, value) in data.items() if key not in relationship_fields})
+        for field in get_relationships(self.resource.schema):
+            model_field = get_model_field(self.resource.schema, field)
+            if model_field not in data and not hasattr(obj, model_field):
+                setattr(obj, model_field, [] if self.resource.schema._declared_fields[field].many else None)
+        self.apply_relationships(data, obj)
+
+        self.store.add(obj)
+
+        self.after_create_object(obj, data, view_kwargs)
+
+        return obj
+
+    def get_object(self, view_kwargs, qs=None):
+        """Retrieve an object from the store
+
+        :params dict view_kwargs: kwargs from the resource view
+        :return: an object
+        """
+        self.before_get_object(view_kwargs)
+
+        id_field = getattr(self, 'id_field', self.store.id_field)
+        url_field = getattr(self, 'url_field', 'id')
+        filter_value = view_kwargs[url_field]
+
+        if id_field == self.store.id_field:
+            obj = self.store.get(filter_value)
+        else:
+            obj = next((obj_ for obj_ in self.select_objects(self.filter_by(None, {id_field: filter_value}))), None)
+
+        permission_filters = self.get_permission_filters()
+        if obj is not None and permission_filters:
+            obj_id = getattr(obj, self.store.id_field)
+            if obj_id not in self.apply_permission_filters({obj_id}, permission_filters):
+                obj = None
+
+        self.after_get_object(obj, view_kwargs)
+
+        return obj
+
+    def get_collection(self, qs, view_kwargs, filters=None):
+        """Retrieve a collection of objects from the store
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param dict filters: A dictionary of key/value filters to apply to the eventual query
+        :return tuple: the number of object and the list of objects
+        """
+        self.before_get_collection(qs, view_kwargs)
+
+        query = self.query(view_kwargs)
+        ids = None if query is self.store else {getattr(obj, self.store.id_field) for obj in query}
+        ids = self.apply_permission_filters(ids, self.get_permission_filters())
+
+        if filters:
+            ids = self.filter_by(ids, filters)
+
+        if qs.filters:
+            ids = self.filter_query(ids, qs.filters, self.resource.schema)
+
+        object_count = len(self.store) if ids is None else len(ids)
+
+        objects = self.sort_query(ids, qs.sorting)
+
+        collection = self.paginate_query(objects, qs.pagination)
+
+        collection = self.after_get_collection(collection, qs, view_kwargs)
+
+        return object_count, collection
+
+    def get_aggregates(self, qs, view_kwargs, filters=None):
+        """Compute aggregates of a collection of the store
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param dict filters: A dictionary of key/value filters to apply to the eventual query
+        :return list: a dict by group like {'group': {'status': 'open'}, 'count': {'*': 12}, 'sum': {'amount': 150}}
+        """
+        query = self.query(view_kwargs)
+        ids = None if query is self.store else {getattr(obj, self.store.id_field) for obj in query}
+        ids = self.apply_permission_filters(ids, self.get_permission_filters())
+
+        if filters:
+            ids = self.filter_by(ids, filters)
+
+        if qs.filters:
+            ids = self.filter_query(ids, qs.filters, self.resource.schema)
+
+        group_by = qs.group_by
+        aggregates = qs.aggregates
+
+        groups = {} if group_by else {(): []}
+        for obj in self.select_objects(ids):
+            groups.setdefault(tuple(getattr(obj, group['column'], None) for group in group_by), []).append(obj)
+
+        results = []
+        for key in sorted(groups, key=lambda key: [(value is not None, value) for value in key]):
+            result = {'group': {group['field']: value for group, value in zip(group_by, key)}}
+            for aggregate in aggregates:
+                result.setdefault(aggregate['function'], {})[aggregate['field']] = \
+                    self.aggregate(aggregate, groups[key])
+            results.append(result)
+
+        return results
+
+    def aggregate(self, aggregate, objects):
+        """Compute an aggregate of objects like a database does, ignoring None values
+
+        :param dict aggregate: aggregate information
+        :param list objects: the objects
+        :return: the value of the aggregate
+        """
+        if aggregate['column'] is None:
+            return len(objects)
+
+        values = [getattr(obj, aggregate['column'], None) for obj in objects]
+        values = [value for value in values if value is not None]
+        if aggregate['function'] == 'count':
+            return len(values)
+        if not values:
+            return None
+        if aggregate['function'] == 'sum':
+            return sum(values)
+        if aggregate['function'] == 'avg':
+            return sum(values) / len(values)
+        return min(values) if aggregate['function'] == 'min' else max(values)
+
+    def update_object(self, obj, data, view_kwargs):
+        """Update an object of the store
+
+        :param obj: an object
+        :param dict data: the data validated by marshmallow
+        :param dict view_kwargs: kwargs from the resource view
+        :return boolean: True if object have changed else False
+        """
+        if obj is None:
+            url_field = getattr(self, 'url_field', 'id')
+            filter_value = view_kwargs[url_field]
+            raise ObjectNotFound('{}: {} not found'.format(self.model.__name__, filter_value),
+                                 source={'parameter': url_field})
+
+        self.before_update_object(obj, data, view_kwargs)
+
+        relationship_fields = get_relationships(self.resource.schema, model_field=True)
+
+        self.store.update(obj, {key: value for (key, value) in data.items()
+                                if hasattr(obj, key) and key not in relationship_fields})
+        self.apply_relationships(data, obj)
+
+        self.after_update_object(obj, data, view_kwargs)
+
+    def delete_object(self, obj, view_kwargs):
+        """Delete an object from the store
+
+        :param obj: an object
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        if obj is None:
+            url_field = getattr(self, 'url_field', 'id')
+            filter_value = view_kwargs[url_field]
+            raise ObjectNotFound('{}: {} not found'.format(self.model.__name__, filter_value),
+                                 source={'parameter': url_field})
+
+        self.before_delete_object(obj, view_kwargs)
+
+        self.store.remove(obj)
+
+        self.after_delete_object(obj, view_kwargs)
+
+    def create_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
+        """Create a relationship
+
+        :param dict json_data: the request params
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        :return boolean: True if relationship have changed else False
+        """
+        self.before_create_relationship(json_data, relationship_field, related_id_field, view_kwargs)
+
+        obj = self.get_relationship_object(relationship_field, view_kwargs)
+
+        updated = False
+
+        if isinstance(json_data['data'], list):
+            obj_ids = {str(getattr(obj__, related_id_field)) for obj__ in getattr(obj, relationship_field)}
+
+            for obj_ in json_data['data']:
+                if obj_['id'] not in obj_ids:
+                    getattr(obj, relationship_field).append(self.get_related_object(relationship_field,
+                                                                                    related_id_field,
+                                                                                    obj_))
+                    updated = True
+        else:
+            related_object = None
+
+            if json_data['data'] is not None:
+                related_object = self.get_related_object(relationship_field, related_id_field, json_data['data'])
+
+            obj_id = getattr(getattr(obj, relationship_field), related_id_field, None)
+            new_obj_id = getattr(related_object, related_id_field, None)
+            if obj_id != new_obj_id:
+                setattr(obj, relationship_field, related_object)
+                updated = True
+
+        self.after_create_relationship(obj, updated, json_data, relationship_field, related_id_field, view_kwargs)
+
+        return obj, updated
+
+    def get_relationship(self, relationship_field, related_type_, related_id_field, view_kwargs):
+        """Get a relationship
+
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_type_: the related resource type
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        :return tuple: the object and related object(s)
+        """
+        self.before_get_relationship(relationship_field, related_type_, related_id_field, view_kwargs)
+
+        obj = self.get_relationship_object(relationship_field, view_kwargs)
+
+        related_objects = getattr(obj, relationship_field)
+
+        if related_objects is None:
+            return obj, related_objects
+
+        self.after_get_relationship(obj, related_objects, relationship_field, related_type_, related_id_field,
+                                    view_kwargs)
+
+        if isinstance(related_objects, (list, tuple)):
+            return obj,\
+                [{'type': related_type_, 'id': getattr(obj_, related_id_field)} for obj_ in related_objects]
+        else:
+            return obj, {'type': related_type_, 'id': getattr(related_objects, related_id_field)}
+
+    def update_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
+        """Update a relationship
+
+        :param dict json_data: the request params
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        :return boolean: True if relationship have changed else False
+        """
+        self.before_update_relationship(json_data, relationship_field, related_id_field, view_kwargs)
+
+        obj = self.get_relationship_object(relationship_field, view_kwargs)
+
+        updated = False
+
+        if isinstance(json_data['data'], list):
+            related_objects = [self.get_related_object(relationship_field, related_id_field, obj_)
+                               for obj_ in json_data['data']]
+
+            obj_ids = {getattr(obj__, related_id_field) for obj__ in getattr(obj, relationship_field)}
+            new_obj_ids = {getattr(related_object, related_id_field) for related_object in related_objects}
+            if obj_ids != new_obj_ids:
+                setattr(obj, relationship_field, related_objects)
+                updated = True
+        else:
+            related_object = None
+
+            if json_data['data'] is not None:
+                related_object = self.get_related_object(relationship_field, related_id_field, json_data['data'])
+
+            obj_id = getattr(getattr(obj, relationship_field), related_id_field, None)
+            new_obj_id = getattr(related_object, related_id_field, None)
+            if obj_id != new_obj_id:
+                setattr(obj, relationship_field, related_object)
+                updated = True
+
+        self.after_update_relationship(obj, updated, json_data, relationship_field, related_id_field, view_kwargs)
+
+        return obj, updated
+
+    def delete_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
+        """Delete a relationship
+
+        :param dict json_data: the request params
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        self.before_delete_relationship(json_data, relationship_field, related_id_field, view_kwargs)
+
+        obj = self.get_relationship_object(relationship_field, view_kwargs)
+
+        updated = False
+
+        if isinstance(json_data['data'], list):
+            obj_ids = {str(getattr(obj__, related_id_field)) for obj__ in getattr(obj, relationship_field)}
+
+            for obj_ in json_data['data']:
+                if obj_['id'] in obj_ids:
+                    getattr(obj, relationship_field).remove(self.get_related_object(relationship_field,
+                                                                                    related_id_field,
+                                                                                    obj_))
+                    updated = True
+        else:
+            setattr(obj, relationship_field, None)
+            updated = True
+
+        self.after_delete_relationship(obj, updated, json_data, relationship_field, related_id_field, view_kwargs)
+
+        return obj, updated
+
+    def get_relationship_object(self, relationship_field, view_kwargs):
+        """Get the object of a relationship request
+
+        :param str relationship_field: the model attribute used for relationship
+        :param dict view_kwargs: kwargs from the resource view
+        :return: the object
+        """
+        obj = self.get_object(view_kwargs)
+
+        if obj is None:
+            url_field = getattr(self, 'url_field', 'id')
+            filter_value = view_kwargs[url_field]
+            raise ObjectNotFound('{}: {} not found'.format(self.model.__name__, filter_value),
+                                 source={'parameter': url_field})
+
+        if not hasattr(obj, relationship_field):
+            raise RelationNotFound("{} has no attribute {}".format(obj.__class__.__name__, relationship_field))
+
+        return obj
+
+    def get_related_object(self, relationship_field, related_id_field, obj):
+        """Get a related object from the store of a relationship
+
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict obj: the resource identifier of the related object
+        :return: a related object
+        """
+        store = self.related_stores.get(relationship_field)
+        if store is None:
+            raise Exception("You must provide the store of the relationship {} in related_stores to use in-memory data "
+                            "layer".format(relationship_field))
+
+        if related_id_field == store.id_field:
+            related_object = store.get(obj['id'])
+        else:
+            related_object = next((related for related in store
+                                   if str(getattr(related, related_id_field, None)) == str(obj['id'])), None)
+
+        if related_object is None:
+            raise RelatedObjectNotFound("{}.{}: {} not found".format(relationship_field, related_id_field, obj['id']))
+
+        return related_object
+
+    def apply_relationships(self, data, obj):
+        """Apply relationship provided by data to obj
+
+        :param dict data: data provided by the client
+        :param obj: the object to plug relationships to
+        """
+        for field in get_relationships(self.resource.schema):
+            model_field = get_model_field(self.resource.schema, field)
+            if model_field not in data:
+                continue
+
+            related_id_field = self.resource.schema._declared_fields[field].id_field
+            value = data[model_field]
+            if isinstance(value, list):
+                setattr(obj, model_field, [self.get_related_object(model_field, related_id_field, {'id': id_})
+                                           for id_ in value])
+            elif value is not None:
+                setattr(obj, model_field, self.get_related_object(model_field, related_id_field, {'id': value}))
+            else:
+                setattr(obj, model_field, None)
+
+    def select_objects(self, ids):
+        """Iterate over the objects of the store having one of the identifiers, in the order of the identifiers
+
+        :param set ids: the identifiers, None for all the objects
+        :return iterator: the objects
+        """
+        if ids is None:
+            return iter(self.store)
+
+        try:
+            ordered_ids = sorted(ids)
+        except TypeError:
+            ordered_ids = sorted(ids, key=repr)
+        objects = (self.store.objects.get(id_) for id_ in ordered_ids)
+        return (obj for obj in objects if obj is not None)
+
+    def filter_by(self, ids, filters):
+        """Keep the objects whose attributes equal the values of filters
+
+        :param set ids: the identifiers of the candidate objects, None for all the objects
+        :param dict filters: values by attribute
+        :return set: the identifiers of the objects matching the filters
+        """
+        for field, value in filters.items():
+            matching = self.store.lookup(field, [value])
+            if matching is None:
+                matching = {getattr(obj, self.store.id_field) for obj in self.select_objects(ids)
+                            if getattr(obj, field, None) == value}
+            ids = matching if ids is None else ids & matching
+        return ids
+
+    def filter_query(self, ids, filter_info, schema):
+        """Filter objects according to jsonapi 1.0
+
+        :param set ids: the identifiers of the candidate objects, None for all the objects
+        :param list filter_info: filter information
+        :param Schema schema: the schema of the objects
+        :return set: the identifiers of the objects matching every filter
+        """
+        for filter_ in filter_info:
+            ids = self.resolve_filter(ids, filter_, schema)
+        return ids
+
+    def apply_permission_filters(self, ids, permission_filters):
+        """Restrict objects to the ones the current request can access
+
+        :param set ids: the identifiers of the candidate objects, None for all the objects
+        :param list permission_filters: filters as in the filter querystring parameter
+        :return set: the identifiers of the objects matching every permission filter
+        """
+        if not permission_filters:
+            return ids
+
+        if not all(isinstance(filter_, dict) for filter_ in permission_filters):
+            raise Exception("{} only supports permission filters as in the filter querystring parameter"
+                            .format(self.__class__.__name__))
+
+        return self.filter_query(ids, permission_filters, self.resource.schema)
+
+    def resolve_filter(self, ids, filter_, schema):
+        """Get the identifiers of the candidate objects matching a node of the filter tree, with the indexes of the
+        store when possible
+
+        :param set ids: the identifiers of the candidate objects, None for all the objects
+        :param dict filter_: filter information of the node
+        :param Schema schema: the schema of the objects
+        :return set: the identifiers of the matching objects
+        """
+        if 'and' in filter_:
+            for sub_filter in filter_['and']:
+                ids = self.resolve_filter(ids, sub_filter, schema)
+            return ids
+
+        if 'or' in filter_:
+            matching = set()
+            for sub_filter in filter_['or']:
+                matching |= self.resolve_filter(ids, sub_filter, schema)
+            return matching
+
+        if 'not' in filter_:
+            excluded = self.resolve_filter(ids, filter_['not'], schema)
+            candidates = self.store.ids() if ids is None else ids
+            return candidates - excluded
+
+        field, op, value = self.parse_filter(filter_, schema)
+
+        matching = None
+        if '__' not in filter_['name'] and 'field' not in filter_:
+            if op == 'eq':
+                matching = self.store.lookup(field, [value])
+            elif op == 'in':
+                matching = self.store.lookup(field, value)
+            elif op in RANGE_OPERATORS and field in self.store.sorted_indexes and value is not None:
+                try:
+                    matching = set(self.store.range(field, op, value))
+                except TypeError:
+                    raise InvalidFilters("Can't compare {} with {}".format(field, value))
+
+        if matching is None:
+            predicate = self.create_predicate(filter_, schema)
+            return {getattr(obj, self.store.id_field) for obj in self.select_objects(ids) if predicate(obj)}
+
+        return matching if ids is None else ids & matching
+
+    def parse_filter(self, filter_, schema):
+        """Get the model field, the normalized operator and the value of a filter
+
+        :param dict filter_: filter information of the node
+        :param Schema schema: the schema of the objects
+        :return tuple: the model field, the operator and the value
+        """
+        name = filter_.get('name')
+        if name is None:
+            raise InvalidFilters("Can't find name of a filter")
+        name = name.split('__')[0]
+        if name not in schema._declared_fields:
+            raise InvalidFilters("{} has no attribute {}".format(schema.__name__, name))
+
+        if 'op' not in filter_:
+            raise InvalidFilters("Can't find op of a filter")
+        op = filter_['op'].replace('_', '')
+
+        if op not in OPERATORS and op not in ('has', 'any'):
+            raise InvalidFilters("{} has no operator {}".format(name, filter_['op']))
+
+        if 'field' not in filter_ and 'val' not in filter_:
+            raise InvalidFilters("Can't find value or field in a filter")
+
+        return get_model_field(schema, name), op, self.deserialize_value(filter_, schema, name, op)
+
+    def deserialize_value(self, filter_, schema, name, op):
+        """Deserialize the value of a filter with the schema field it applies to, so that it compares with the values
+        of the objects like a database would convert it
+
+        :param dict filter_: filter information of the node
+        :param Schema schema: the schema of the objects
+        :param str name: the schema field of the filter
+        :param str op: the normalized operator
+        :return: the value to filter with
+        """
+        value = filter_.get('val')
+        field = schema._declared_fields[name]
+        if value is None or '__' in filter_['name'] or op in ('has', 'any') or op in PATTERN_OPERATORS \
+                or isinstance(field, BaseRelationship):
+            return value
+
+        try:
+            if op in ('in', 'notin', 'between') and isinstance(value, (list, tuple)):
+                return [field.deserialize(item) for item in value]
+            return field.deserialize(value)
+        except ValidationError as e:
+            raise InvalidFilters("Invalid value of {}: {}".format(name, e.messages))
+
+    def create_predicate(self, filter_, schema):
+        """Create a function checking if an object matches a node of the filter tree
+
+        :param dict filter_: filter information of the node
+        :param Schema schema: the schema of the objects
+        :return callable: the predicate
+        """
+        if 'and' in filter_:
+            predicates = [self.create_predicate(sub_filter, schema) for sub_filter in filter_['and']]
+            return lambda obj: all(predicate(obj) for predicate in predicates)
+        if 'or' in filter_:
+            predicates = [self.create_predicate(sub_filter, schema) for sub_filter in filter_['or']]
+            return lambda obj: any(predicate(obj) for predicate in predicates)
+        if 'not' in filter_:
+            predicate = self.create_predicate(filter_['not'], schema)
+            return lambda obj: not predicate(obj)
+
+        field, op, value = self.parse_filter(filter_, schema)
+        name = filter_['name'].split('__')[0]
+
+        if op in ('has', 'any'):
+            if name not in get_relationships(schema) + get_nested_fields(schema):
+                raise InvalidFilters("{} has no relationship or nested attribute {}".format(schema.__name__, name))
+            if not isinstance(value, dict):
+                raise InvalidFilters("The value of a {} filter must be a filter".format(op))
+            if name in get_relationships(schema):
+                related_schema = get_related_schema_cls(schema, name)
+            else:
+                related_schema = schema._declared_fields[name].schema.__class__
+            related_predicate = self.create_predicate(value, related_schema)
+            if op == 'any':
+                return lambda obj: any(related_predicate(related) for related in getattr(obj, field, None) or ())
+            return lambda obj: getattr(obj, field, None) is not None and related_predicate(getattr(obj, field))
+
+        operator = OPERATORS[op]
+        key = filter_['name'].split('__')[1] if '__' in filter_['name'] else None
+        other_field = filter_.get('field')
+
+        def predicate(obj):
+            obj_value = getattr(obj, field, None)
+            if key is not None:
+                obj_value = obj_value.get(key) if isinstance(obj_value, dict) else getattr(obj_value, key, None)
+            other = getattr(obj, other_field, None) if other_field is not None else value
+            try:
+                return operator(obj_value, other)
+            except TypeError:
+                raise InvalidFilters("Can't apply {} on {}".format(filter_['op'], name))
+
+        return predicate
+
+    def sort_query(self, ids, sort_info):
+        """Sort objects according to jsonapi 1.0
+
+        :param set ids: the identifiers of the objects, None for all the objects
+        :param list sort_info: sort information
+        :return iterable: the sorted objects
+        """
+        if not sort_info:
+            return self.select_objects(ids)
+
+        if len(sort_info) == 1 and sort_info[0]['field'] in self.store.sorted_indexes:
+            ordered_ids = self.store.ordered_ids(sort_info[0]['field'], sort_info[0]['order'])
+            if ids is not None:
+                ordered_ids = (id_ for id_ in ordered_ids if id_ in ids)
+            objects = (self.store.objects.get(id_) for id_ in ordered_ids)
+            return (obj for obj in objects if obj is not None)
+
+        objects = list(self.select_objects(ids))
+        for sort_opt in reversed(sort_info):
+            field = sort_opt['field']
+            try:
+                objects.sort(key=lambda obj: (get_path(obj, field) is not None, get_path(obj, field)),
+                             reverse=sort_opt['order'] == 'desc')
+            except TypeError:
+                raise InvalidSort("Can't sort on {}".format(field))
+        return objects
+
+    def paginate_query(self, objects, paginate_info):
+        """Paginate objects according to jsonapi 1.0
+
+        :param iterable objects: the sorted objects
+        :param dict paginate_info: pagination information
+        :return list: the objects of the page
+        """
+        if int(paginate_info.get('size', 1)) == 0:
+            return list(objects)
+
+        page_size = int(paginate_info.get('size', 0)) or current_app.config['PAGE_SIZE']
+        offset = 0
+        if paginate_info.get('number'):
+            offset = (int(paginate_info['number']) - 1) * page_size
+
+        return list(islice(objects, offset, offset + page_size))
+
+    def query(self, view_kwargs):
+        """Construct the base query to retrieve wanted data, the whole store by default. A rewritten query can return
+        any iterable of objects of the store
+
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        return self.store
+
+    def before_create_object(self, data, view_kwargs):
+        """Provide additional data before object creation
+
+        :param dict data: the data validated by marshmallow
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def after_create_object(self, obj, data, view_kwargs):
+        """Provide additional data after object creation
+
+        :param obj: an object from data layer
+        :param dict data: the data validated by marshmallow
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def before_get_object(self, view_kwargs):
+        """Make work before to retrieve an object
+
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def after_get_object(self, obj, view_kwargs):
+        """Make work after to retrieve an object
+
+        :param obj: an object from data layer
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def before_get_collection(self, qs, view_kwargs):
+        """Make work before to retrieve a collection of objects
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def after_get_collection(self, collection, qs, view_kwargs):
+        """Make work after to retrieve a collection of objects
+
+        :param iterable collection: the collection of objects
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        return collection
+
+    def before_update_object(self, obj, data, view_kwargs):
+        """Make checks or provide additional data before update object
+
+        :param obj: an object from data layer
+        :param dict data: the data validated by marshmallow
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def after_update_object(self, obj, data, view_kwargs):
+        """Make work after update object
+
+        :param obj: an object from data layer
+        :param dict data: the data validated by marshmallow
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def before_delete_object(self, obj, view_kwargs):
+        """Make checks before delete object
+
+        :param obj: an object from data layer
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def after_delete_object(self, obj, view_kwargs):
+        """Make work after delete object
+
+        :param obj: an object from data layer
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def before_create_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
+        """Make work before to create a relationship
+
+        :param dict json_data: the request params
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def after_create_relationship(self, obj, updated, json_data, relationship_field, related_id_field, view_kwargs):
+        """Make work after to create a relationship
+
+        :param obj: an object from data layer
+        :param bool updated: True if object was updated else False
+        :param dict json_data: the request params
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def before_get_relationship(self, relationship_field, related_type_, related_id_field, view_kwargs):
+        """Make work before to get information about a relationship
+
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_type_: the related resource type
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def after_get_relationship(self, obj, related_objects, relationship_field, related_type_, related_id_field,
+                               view_kwargs):
+        """Make work after to get information about a relationship
+
+        :param obj: an object from data layer
+        :param iterable related_objects: related objects of the object
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_type_: the related resource type
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def before_update_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
+        """Make work before to update a relationship
+
+        :param dict json_data: the request params
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def after_update_relationship(self, obj, updated, json_data, relationship_field, related_id_field, view_kwargs):
+        """Make work after to update a relationship
+
+        :param obj: an object from data layer
+        :param bool updated: True if object was updated else False
+        :param dict json_data: the request params
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def before_delete_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
+        """Make work before to delete a relationship
+
+        :param dict json_data: the request params
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
+
+    def after_delete_relationship(self, obj, updated, json_data, relationship_field, related_id_field, view_kwargs):
+        """Make work after to delete a relationship
+
+        :param obj: an object from data layer
+        :param bool updated: True if object was updated else False
+        :param dict json_data: the request params
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        """
+        pass
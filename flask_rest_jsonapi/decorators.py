@@ -76,6 +76,8 @@ def jsonapi_exception_formatter(func):
         try:
             return func(*args, **kwargs)
         except JsonApiException as e:
+            if e.headers:
+                headers.update(e.headers)
             return make_response(jsonify(jsonapi_errors([e.to_dict()])),
                                  e.status,
                                  headers)
@@ -2,6 +2,8 @@
 
 """Collection of useful http error for the Api"""
 
+from math import ceil
+
 
 class JsonApiException(Exception):
     """Base exception class for unknown errors"""
@@ -9,12 +11,15 @@ class JsonApiException(Exception):
     title = 'Unknown error'
     status = '500'
     source = None
+    headers = None
 
-    def __init__(self, detail, source=None, title=None, status=None, code=None, id_=None, links=None, meta=None):
+    def __init__(self, detail, source=None, title=None, status=None, code=None, id_=None, links=None, meta=None,
+                 headers=None):
         """Initialize a jsonapi exception
 
         :param dict source: the source of the error
         :param str detail: the detail of the error
+        :param dict headers: additional headers of the error response
         """
         self.detail = detail
         self.source = source
@@ -26,6 +31,8 @@ class JsonApiException(Exception):
             self.title = title
         if status is not None:
             self.status = status
+        if headers is not None:
+            self.headers = headers
 
     def to_dict(self):
         """Return values of each fields of an jsonapi error"""
@@ -74,6 +81,26 @@ class InvalidSort(BadRequest):
     source = {'parameter': 'sort'}
 
 
+class InvalidAggregate(BadRequest):
+    """Error to warn that an aggregate querystring parameter uses an unknown function or field"""
+
+    title = 'Invalid aggregate querystring parameter.'
+    source = {'parameter': 'aggregate'}
+
+
+class InvalidGroupBy(BadRequest):
+    """Error to warn that a field specified in group_by querystring parameter is not in the requested resource schema"""
+
+    title = 'Invalid group_by querystring parameter.'
+    source = {'parameter': 'group_by'}
+
+
+class QueryTooExpensive(BadRequest):
+    """Error to warn that the estimated cost of the query of a request exceeds the budget of the resource"""
+
+    title = 'Query too expensive'
+
+
 class ObjectNotFound(JsonApiException):
     """Error to warn that an object is not found in a database"""
 
@@ -105,3 +132,37 @@ class AccessDenied(JsonApiException):
 
     title = 'Access denied'
     status = '403'
+
+
+class TooManyRequests(JsonApiException):
+    """Error to warn that a client exceeds the rate limit of a resource"""
+
+    title = 'Too many requests'
+    status = '429'
+
+    def __init__(self, detail, retry_after=None, **kwargs):
+        """Initialize the error
+
+        :param str detail: the detail of the error
+        :param float retry_after: the number of seconds before a new request can be admitted
+        """
+        super(TooManyRequests, self).__init__(detail, **kwargs)
+        if retry_after is not None:
+            self.headers = dict(self.headers or {}, **{'Retry-After': str(int(ceil(retry_after)))})
+
+
+class ServiceUnavailable(JsonApiException):
+    """Error to warn that a resource sheds load because it handles too many concurrent requests"""
+
+    title = 'Service unavailable'
+    status = '503'
+
+    def __init__(self, detail, retry_after=None, **kwargs):
+        """Initialize the error
+
+        :param str detail: the detail of the error
+        :param float retry_after: the number of seconds before a new request can be admitted
+        """
+        super(ServiceUnavailable, self).__init__(detail, **kwargs)
+        if retry_after is not None:
+            self.headers = dict(self.headers or {}, **{'Retry-After': str(int(ceil(retry_after)))})
@@ -6,8 +6,10 @@ import json
 
 from flask import current_app
 
-from flask_rest_jsonapi.exceptions import BadRequest, InvalidFilters, InvalidSort, InvalidField, InvalidInclude
-from flask_rest_jsonapi.schema import get_model_field, get_relationships, get_schema_from_type
+from flask_rest_jsonapi.exceptions import BadRequest, InvalidFilters, InvalidSort, InvalidField, InvalidInclude,\
+    InvalidAggregate, InvalidGroupBy
+from flask_rest_jsonapi.schema import get_model_field, get_relationships, get_schema_from_type, get_related_schema_cls,\
+    plan_includes
 
 
 class QueryStringManager(object):
@@ -19,9 +21,18 @@ class QueryStringManager(object):
         'fields',
         'sort',
         'include',
-        'q'
+        'q',
+        'aggregate',
+        'group_by'
     )
 
+    AGGREGATE_FUNCTIONS = ('count', 'sum', 'avg', 'min', 'max')
+
+    # weights of the query cost estimation
+    FILTER_COST = 10
+    SORT_COST = 10
+    UNPAGINATED_ROWS = 1000
+
     def __init__(self, querystring, schema):
         """Initialization instance
 
@@ -97,6 +108,11 @@ class QueryStringManager(object):
                 raise InvalidFilters("Parse error")
         if self._get_key_values('filter['):
             results.extend(self._simple_filters(self._get_key_values('filter[')))
+
+        if current_app.config.get('MAX_FILTER_IN_SIZE') is not None:
+            for filter_ in results:
+                self._check_list_size(filter_, current_app.config['MAX_FILTER_IN_SIZE'])
+
         return results
 
     @property
@@ -118,8 +134,12 @@ class QueryStringManager(object):
             >>> parsed_query.pagination
             {'number': '25', 'size': '10'}
         """
+        # page[<relationship>][size] parameters are the pagination of included relationships
+        include_keys = {key[len('page['):key.index(']')] for key in self.qs
+                        if key.startswith('page[') and key.count('[') > 1}
+
         # check values type
-        result = self._get_key_values('page')
+        result = {key: value for key, value in self._get_key_values('page').items() if key not in include_keys}
         for key, value in result.items():
             if key not in ('number', 'size'):
                 raise BadRequest("{} is not a valid parameter of pagination".format(key), source={'parameter': 'page'})
@@ -181,30 +201,245 @@ class QueryStringManager(object):
         if self.qs.get('sort'):
             sorting_results = []
             for sort_field in self.qs['sort'].split(','):
-                field = sort_field.replace('-', '')
-                if field not in self.schema._declared_fields:
-                    raise InvalidSort("{} has no attribute {}".format(self.schema.__name__, field))
-                if field in get_relationships(self.schema):
+                path = sort_field.replace('-', '').split('.')
+                schema = self.schema
+                model_path = []
+
+                # sort through to-one relationships, like author.name
+                for relationship_field in path[:-1]:
+                    if relationship_field not in schema._declared_fields:
+                        raise InvalidSort("{} has no attribute {}".format(schema.__name__, relationship_field))
+                    if relationship_field not in get_relationships(schema):
+                        raise InvalidSort("{} is not a relationship field of {}"
+                                          .format(relationship_field, schema.__name__))
+                    if schema._declared_fields[relationship_field].many:
+                        raise InvalidSort("You can't sort through {} because it is a to-many relationship field"
+                                          .format(relationship_field))
+                    model_path.append(get_model_field(schema, relationship_field))
+                    schema = get_related_schema_cls(schema, relationship_field)
+
+                field = path[-1]
+                if field not in schema._declared_fields:
+                    raise InvalidSort("{} has no attribute {}".format(schema.__name__, field))
+                if field in get_relationships(schema):
                     raise InvalidSort("You can't sort on {} because it is a relationship field".format(field))
-                field = get_model_field(self.schema, field)
+                model_path.append(get_model_field(schema, field))
                 order = 'desc' if sort_field.startswith('-') else 'asc'
-                sorting_results.append({'field': field, 'order': order})
+                sorting_results.append({'field': '.'.join(model_path), 'order': order})
             return sorting_results
 
         return []
 
+    def _is_dumped(self, field):
+        """Check that a field of the schema is serialized, so that aggregates don't disclose load_only or excluded
+        fields
+
+        :param str field: the name of the field in the schema
+        :return bool: True if the schema serializes the field
+        """
+        return self.schema._declared_fields[field].load_only is not True \
+            and field not in self.schema.opts.load_only \
+            and field not in self.schema.opts.exclude
+
+    @property
+    def aggregates(self):
+        """Return the aggregates to compute instead of retrieving a collection
+
+        :return list: a list of aggregate information
+
+        Example of return value for aggregate[count]=*&aggregate[sum]=amount::
+
+            [
+                {'function': 'count', 'field': '*', 'column': None},
+                {'function': 'sum', 'field': 'amount', 'column': 'amount'},
+            ]
+
+        """
+        results = []
+        for function, fields in self._get_key_values('aggregate').items():
+            if function not in self.AGGREGATE_FUNCTIONS:
+                raise InvalidAggregate("{} is not an aggregate function. Use one of {}"
+                                       .format(function, ', '.join(self.AGGREGATE_FUNCTIONS)))
+
+            for field in fields if isinstance(fields, list) else [fields]:
+                if field == '*' and function == 'count':
+                    results.append({'function': function, 'field': field, 'column': None})
+                    continue
+                if field not in self.schema._declared_fields:
+                    raise InvalidAggregate("{} has no attribute {}".format(self.schema.__name__, field))
+                if field in get_relationships(self.schema):
+                    raise InvalidAggregate("You can't aggregate {} because it is a relationship field".format(field))
+                if not self._is_dumped(field):
+                    raise InvalidAggregate("You can't aggregate {} because it is not serialized".format(field))
+                results.append({'function': function, 'field': field, 'column': get_model_field(self.schema, field)})
+
+        return results
+
+    @property
+    def group_by(self):
+        """Return the fields to group aggregates by
+
+        :return list: a list of group by information
+
+        Example of return value for group_by=status::
+
+            [
+                {'field': 'status', 'column': 'status'},
+            ]
+
+        """
+        group_by_param = self.qs.get('group_by')
+        if not group_by_param:
+            return []
+
+        if not self._get_key_values('aggregate'):
+            raise InvalidGroupBy("group_by requires an aggregate querystring parameter")
+
+        results = []
+        for field in group_by_param.split(','):
+            if field not in self.schema._declared_fields:
+                raise InvalidGroupBy("{} has no attribute {}".format(self.schema.__name__, field))
+            if field in get_relationships(self.schema):
+                raise InvalidGroupBy("You can't group by {} because it is a relationship field".format(field))
+            if not self._is_dumped(field):
+                raise InvalidGroupBy("You can't group by {} because it is not serialized".format(field))
+            results.append({'field': field, 'column': get_model_field(self.schema, field)})
+
+        return results
+
     @property
     def include(self):
         """Return fields to include
 
         :return list: a list of include information
         """
-        include_param = self.qs.get('include', [])
+        include_param = self.qs.get('include')
+        include = include_param.split(',') if include_param else []
 
         if current_app.config.get('MAX_INCLUDE_DEPTH') is not None:
-            for include_path in include_param:
+            for include_path in include:
                 if len(include_path.split('.')) > current_app.config['MAX_INCLUDE_DEPTH']:
                     raise InvalidInclude("You can't use include through more than {} relationships"
                                          .format(current_app.config['MAX_INCLUDE_DEPTH']))
 
-        return include_param.split(',') if include_param else []
+        return include
+
+    @property
+    def include_pagination(self):
+        """Return the maximum numbers of objects included by to-many relationship, from page[<relationship>][size]
+        parameters
+
+        :return dict: the page sizes by relationship field
+
+        Example::
+
+            >>> query_string = {'include': 'comments', 'page[comments][size]': '5'}
+            >>> parsed_query.include_pagination
+            {'comments': 5}
+        """
+        result = {}
+        for key, value in self.qs.items():
+            if not key.startswith('page[') or not key.endswith('][size]') or key.count('[') != 2:
+                continue
+
+            field = key[len('page['):-len('][size]')]
+            if field not in plan_includes(self.include):
+                raise BadRequest("{} is not included".format(field), source={'parameter': key})
+            if field not in get_relationships(self.schema) or not self.schema._declared_fields[field].many:
+                raise BadRequest("{} is not a to-many relationship field of {}".format(field, self.schema.__name__),
+                                 source={'parameter': key})
+            try:
+                size = int(value)
+            except ValueError:
+                raise BadRequest("Parse error", source={'parameter': key})
+            if size < 1:
+                raise BadRequest("The size of an included relationship must be at least 1", source={'parameter': key})
+            if current_app.config.get('MAX_PAGE_SIZE') is not None and size > current_app.config['MAX_PAGE_SIZE']:
+                raise BadRequest("Maximum page size is {}".format(current_app.config['MAX_PAGE_SIZE']),
+                                 source={'parameter': key})
+
+            result[field] = size
+
+        return result
+
+    def cost(self, to_many_factor=10, rows=None):
+        """Estimate the cost of the query of a request from the number of rows it loads, with its includes, and from
+        the number of its filters and sort keys
+
+        :param int to_many_factor: the estimated number of objects of each to-many relationship
+        :param int rows: the number of objects of the resource, the page size by default
+        :return float: the estimated cost
+        """
+        if rows is None:
+            rows = int(self.pagination.get('size', 0)) or current_app.config['PAGE_SIZE']
+            if int(self.pagination.get('size', 1)) == 0:
+                rows = current_app.config.get('MAX_PAGE_SIZE') or self.UNPAGINATED_ROWS
+
+        include_rows = self._include_rows(self.schema, plan_includes(self.include), rows, to_many_factor,
+                                          self.include_pagination)
+
+        return rows + include_rows \
+            + self.FILTER_COST * sum(self._count_filters(filter_) for filter_ in self.filters) \
+            + self.SORT_COST * len(self.sorting)
+
+    def _include_rows(self, schema, include_tree, rows, to_many_factor, include_pagination=None):
+        """Estimate the number of related objects loaded by a tree of includes
+
+        :param Schema schema: the schema of the objects
+        :param dict include_tree: the included relationship fields, each mapped to the tree of its own includes
+        :param int rows: the number of objects
+        :param int to_many_factor: the estimated number of objects of each to-many relationship
+        :param dict include_pagination: the maximum numbers of included objects by relationship field
+        :return int: the number of related objects
+        """
+        include_pagination = include_pagination or {}
+        include_rows = 0
+        for field, related_include_tree in include_tree.items():
+            if field not in get_relationships(schema):
+                raise InvalidInclude("{} is not a relationship attribute of {}".format(field, schema.__name__))
+
+            related_rows = rows
+            if schema._declared_fields[field].many:
+                related_rows = rows * min(to_many_factor, include_pagination.get(field, to_many_factor))
+            include_rows += related_rows
+            if related_include_tree:
+                include_rows += self._include_rows(get_related_schema_cls(schema, field),
+                                                   related_include_tree,
+                                                   related_rows,
+                                                   to_many_factor)
+
+        return include_rows
+
+    def _check_list_size(self, filter_, max_size):
+        """Check that the lists of values of a filter and of its sub filters are not longer than a maximum size
+
+        :param dict filter_: filter information
+        :param int max_size: the maximum number of values of a list
+        """
+        if not isinstance(filter_, dict):
+            return
+        if 'and' in filter_ or 'or' in filter_:
+            for sub_filter in filter_.get('and', filter_.get('or')):
+                self._check_list_size(sub_filter, max_size)
+        elif 'not' in filter_:
+            self._check_list_size(filter_['not'], max_size)
+        elif isinstance(filter_.get('val'), dict):
+            self._check_list_size(filter_['val'], max_size)
+        elif isinstance(filter_.get('val'), list) and len(filter_['val']) > max_size:
+            raise InvalidFilters("The maximum number of values of a filter is {}".format(max_size))
+
+    def _count_filters(self, filter_):
+        """Count the conditions of a filter
+
+        :param dict filter_: filter information
+        :return int: the number of conditions
+        """
+        if not isinstance(filter_, dict):
+            return 1
+        if 'and' in filter_ or 'or' in filter_:
+            return sum(self._count_filters(sub_filter) for sub_filter in filter_.get('and', filter_.get('or')))
+        if 'not' in filter_:
+            return self._count_filters(filter_['not'])
+        if isinstance(filter_.get('val'), dict):
+            return 1 + self._count_filters(filter_['val'])
+        return 1
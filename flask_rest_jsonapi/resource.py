@@ -2,27 +2,41 @@
 
 """This module contains the logic of resource management"""
 
+import asyncio
+import contextvars
 import inspect
 import json
+import re
+from concurrent.futures import Future
+from functools import wraps
+from threading import Lock, Thread
 from six import with_metaclass
+from six.moves.urllib.parse import urlencode
 
 from werkzeug.wrappers import Response
-from flask import request, url_for, make_response
+from flask import request, url_for, make_response, current_app
 from flask.wrappers import Response as FlaskResponse
 from flask.views import MethodView, MethodViewType
 from marshmallow_jsonapi.exceptions import IncorrectTypeError
 from marshmallow import ValidationError
 
+from flask_rest_jsonapi.admission import admission_control
 from flask_rest_jsonapi.querystring import QueryStringManager as QSManager
 from flask_rest_jsonapi.pagination import add_pagination_links
-from flask_rest_jsonapi.exceptions import InvalidType, BadRequest, RelationNotFound
+from flask_rest_jsonapi.exceptions import InvalidType, BadRequest, RelationNotFound, QueryTooExpensive, \
+    InvalidAggregate, InvalidGroupBy
 from flask_rest_jsonapi.decorators import check_headers, check_method_requirements, jsonapi_exception_formatter
-from flask_rest_jsonapi.schema import compute_schema, get_relationships, get_model_field
+from flask_rest_jsonapi.schema import compute_schema, get_relationships, get_model_field, LimitedRelationships
 from flask_rest_jsonapi.data_layers.base import BaseDataLayer
-from flask_rest_jsonapi.data_layers.alchemy import SqlalchemyDataLayer
 from flask_rest_jsonapi.utils import JSONEncoder
 from marshmallow_jsonapi.fields import BaseRelationship
 
+# the name of a variable of an url rule like <int:id>
+RULE_VARIABLE = re.compile(r'<(?:[^<>]*:)?([^<>:]+)>')
+
+event_loop = None
+event_loop_lock = Lock()
+
 
 class ResourceMeta(MethodViewType):
     """Meta class to initilize the data layer and decorators of a resource"""
@@ -39,9 +53,23 @@ class ResourceMeta(MethodViewType):
                 raise Exception("You must provide a data layer class inherited from BaseDataLayer in {}"
                                 .format(cls.__name__))
 
-            data_layer_cls = d['data_layer'].get('class', SqlalchemyDataLayer)
-            data_layer_kwargs = d['data_layer']
+            data_layer_cls = d['data_layer'].get('class')
+            if data_layer_cls is None and getattr(rv, 'asynchronous', False) is True:
+                from flask_rest_jsonapi.data_layers.async_alchemy import AsyncSqlalchemyDataLayer
+                data_layer_cls = AsyncSqlalchemyDataLayer
+            elif data_layer_cls is None:
+                # imported here so that sqlalchemy is only loaded by resources using the default data layer
+                from flask_rest_jsonapi.data_layers.alchemy import SqlalchemyDataLayer
+                data_layer_cls = SqlalchemyDataLayer
+            # copied so that the data_layer dict of the class keeps its cache parameter
+            data_layer_kwargs = dict(d['data_layer'])
+            cache_options = data_layer_kwargs.pop('cache', None)
             rv._data_layer = data_layer_cls(data_layer_kwargs)
+            if cache_options:
+                from flask_rest_jsonapi.data_layers.caching import CachingDataLayer
+                cache_options = {} if cache_options is True else dict(cache_options)
+                cache_options['layer'] = rv._data_layer
+                rv._data_layer = CachingDataLayer(cache_options)
 
         rv.decorators = (check_headers,)
         if 'decorators' in d:
@@ -50,6 +78,77 @@ class ResourceMeta(MethodViewType):
         return rv
 
 
+def get_event_loop():
+    """Get the event loop shared by the async resource managers of the process, run by a daemon thread created on
+    first use
+
+    :return AbstractEventLoop: the event loop
+    """
+    global event_loop
+    if event_loop is None:
+        with event_loop_lock:
+            if event_loop is None:
+                loop = asyncio.new_event_loop()
+                Thread(target=loop.run_forever, name='flask-rest-jsonapi-event-loop', daemon=True).start()
+                event_loop = loop
+    return event_loop
+
+
+def run_awaitable(awaitable):
+    """Wait for the result of an awaitable returned by an async resource method from the synchronous dispatch
+
+    The awaitable runs as a task of the event loop shared by the process, in a copy of the context of the request, so
+    the database I/O of concurrent requests is multiplexed on one loop and one connection pool. The worker thread of
+    the request still waits until the task completes.
+
+    :param awaitable: the awaitable to wait for
+    :return: the result of the awaitable
+    """
+    loop = get_event_loop()
+    context = contextvars.copy_context()
+    result = Future()
+
+    async def wait():
+        return await awaitable
+
+    def set_result(task):
+        if task.cancelled():
+            result.cancel()
+        elif task.exception() is not None:
+            result.set_exception(task.exception())
+        else:
+            result.set_result(task.result())
+
+    def start():
+        # the task copies the current context when it is created, so it sees the request context of the worker
+        context.run(loop.create_task, wait()).add_done_callback(set_result)
+
+    loop.call_soon_threadsafe(start)
+    return result.result()
+
+
+def run_in_data_layer(method):
+    """Create an async resource method running a synchronous resource method inside the run_sync of the data layer
+
+    The whole request logic (data layer calls, hooks and serialization) runs in the same greenlet so that lazy loads
+    done by marshmallow are awaited too. The session of the data layer is removed at the end of the request.
+
+    :param callable method: the synchronous resource method
+    :return callable: the async resource method
+    """
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        data_layer = getattr(self, '_data_layer', None)
+        if not hasattr(data_layer, 'run_sync'):
+            return method(self, *args, **kwargs)
+
+        try:
+            return await data_layer.run_sync(method, self, *args, **kwargs)
+        finally:
+            await data_layer.remove_session()
+    return wrapper
+
+
 class Resource(MethodView):
     """Base resource class"""
 
@@ -60,6 +159,133 @@ class Resource(MethodView):
 
         return super(Resource, cls).__new__(cls)
 
+    @classmethod
+    def bind_url_rules(cls, rules):
+        """Precompute the routing metadata of url rules when the resource is routed, so that it is not computed from
+        the request url on each request
+
+        :param list rules: the url rules of the resource
+        """
+        pass
+
+    @classmethod
+    def _get_url_rules_metadata(cls, name):
+        """Get the routing metadata dict of this resource class, creating it if needed
+
+        :param str name: the name of the class attribute holding the metadata
+        :return dict: the routing metadata by url rule
+        """
+        if name not in cls.__dict__:
+            setattr(cls, name, {})
+        return cls.__dict__[name]
+
+    def limit_query_cost(self, qs, collection=True):
+        """Check the estimated cost of the query of a request against the max_query_cost attribute of the resource or
+        the MAX_QUERY_COST configuration key. An expensive request is rejected or, if the query_cost_strategy attribute
+        of the resource is "downscale", its page size is reduced to fit in the budget
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param bool collection: whether the request retrieves a collection or a single object
+        """
+        max_cost = getattr(self, 'max_query_cost', None)
+        if max_cost is None:
+            max_cost = current_app.config.get('MAX_QUERY_COST')
+        if max_cost is None:
+            return
+
+        to_many_factor = current_app.config.get('QUERY_COST_TO_MANY_FACTOR', 10)
+        cost = qs.cost(to_many_factor, rows=None if collection else 1)
+        if cost <= max_cost:
+            return
+
+        if collection and getattr(self, 'query_cost_strategy', 'reject') == 'downscale':
+            fixed_cost = qs.cost(to_many_factor, rows=0)
+            page_size = int((max_cost - fixed_cost) // (qs.cost(to_many_factor, rows=1) - fixed_cost))
+            if page_size >= 1:
+                qs.qs = dict(qs.qs.items(), **{'page[size]': str(page_size)})
+                return
+
+        raise QueryTooExpensive("The estimated cost of the query is {} but the maximum is {}. Reduce the page size, "
+                                "the includes, the filters or the sort keys".format(cost, max_cost))
+
+    def add_relationship_counts(self, data, schema, objects):
+        """Add the number of related objects of the to-many relationships listed in the relationship_counts parameter
+        of the data layer to relationships.<name>.meta.count of serialized objects
+
+        :param list data: the serialized objects
+        :param Schema schema: the schema that serialized the objects
+        :param list objects: the objects
+        """
+        data_layer = getattr(self, '_data_layer', None)
+        relationship_fields = [field for field in getattr(data_layer, 'relationship_counts', None) or ()
+                               if field in schema.fields and (schema.only is None or field in schema.only)]
+        if not relationship_fields or not objects:
+            return
+
+        counts = data_layer.get_relationship_counts(objects, relationship_fields)
+        for field in relationship_fields:
+            key = schema.inflect(schema.fields[field].data_key or field)
+            for item, count in zip(data, counts[field]):
+                relationship = item.setdefault('relationships', {}).setdefault(key, {})
+                relationship.setdefault('meta', {})['count'] = count
+
+    def get_include_pagination(self, schema, qs):
+        """Get the page sizes of the included relationships limited by page[<relationship>][size] parameters that a
+        schema serializes
+
+        :param Schema schema: the schema serializing the objects
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :return dict: the page sizes by relationship field
+        """
+        return {field: size for field, size in qs.include_pagination.items()
+                if field in schema.fields and (schema.only is None or field in schema.only)}
+
+    def limit_included_objects(self, schema, objects, qs):
+        """Get the objects to serialize, with the first related objects of the included relationships limited by
+        page[<relationship>][size] parameters in place of the relationships. The objects themselves are left
+        untouched so that the limited lists never reach the session of the data layer or a cache
+
+        :param Schema schema: the schema serializing the objects
+        :param list objects: the objects
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :return list: the objects to serialize
+        """
+        include_pagination = self.get_include_pagination(schema, qs)
+        if not include_pagination or not objects:
+            return objects
+
+        pages = self._data_layer.get_include_pages(objects, qs)
+        model_fields = {field: get_model_field(self.schema, field) for field in include_pagination}
+        return [LimitedRelationships(obj, {model_fields[field]: pages[field][index] for field in include_pagination})
+                for index, obj in enumerate(objects)]
+
+    def add_include_pagination(self, data, schema, objects, qs):
+        """Add the number of related objects of the included relationships limited by page[<relationship>][size]
+        parameters to relationships.<name>.meta.count of serialized objects, and a next link to the related objects
+        left out
+
+        :param list data: the serialized objects
+        :param Schema schema: the schema that serialized the objects
+        :param list objects: the objects
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        """
+        include_pagination = self.get_include_pagination(schema, qs)
+        if not include_pagination or not objects:
+            return
+
+        counts = self._data_layer.get_relationship_counts(objects, list(include_pagination))
+        for field, size in include_pagination.items():
+            key = schema.inflect(schema.fields[field].data_key or field)
+            for item, count in zip(data, counts[field]):
+                relationship = item.setdefault('relationships', {}).setdefault(key, {})
+                relationship.setdefault('meta', {})['count'] = count
+
+                related_url = relationship.get('links', {}).get('related')
+                if count > size and related_url is not None:
+                    relationship['links']['next'] = '{}{}{}'.format(related_url,
+                                                                    '&' if '?' in related_url else '?',
+                                                                    urlencode({'page[size]': size, 'page[number]': 2}))
+
     @jsonapi_exception_formatter
     def dispatch_request(self, *args, **kwargs):
         """Logic of how to handle a request"""
@@ -70,7 +296,11 @@ class Resource(MethodView):
 
         headers = {'Content-Type': 'application/vnd.api+json'}
 
-        response = method(*args, **kwargs)
+        with admission_control(self):
+            response = method(*args, **kwargs)
+
+            if inspect.isawaitable(response):
+                response = run_awaitable(response)
 
         if isinstance(response, Response):
             response.headers.add('Content-Type', 'application/vnd.api+json')
@@ -116,8 +346,13 @@ class ResourceList(with_metaclass(ResourceMeta, Resource)):
         self.before_get(args, kwargs)
 
         qs = QSManager(request.args, self.schema)
+        self.limit_query_cost(qs)
 
         parent_filter = self._get_parent_filter(request.url, kwargs)
+
+        if qs.aggregates or qs.group_by:
+            return self.after_get(self.get_aggregates(qs, kwargs, filters=parent_filter))
+
         objects_count, objects = self.get_collection(qs, kwargs, filters=parent_filter)
 
         schema_kwargs = getattr(self, 'get_schema_kwargs', dict())
@@ -130,7 +365,9 @@ class ResourceList(with_metaclass(ResourceMeta, Resource)):
                                 qs,
                                 qs.include)
 
-        result = schema.dump(objects)
+        result = schema.dump(self.limit_included_objects(schema, objects, qs))
+        self.add_relationship_counts(result['data'], schema, objects)
+        self.add_include_pagination(result['data'], schema, objects, qs)
 
         view_kwargs = request.view_args if getattr(self, 'view_kwargs', None) is True else dict()
         add_pagination_links(result,
@@ -188,22 +425,69 @@ class ResourceList(with_metaclass(ResourceMeta, Resource)):
 
         return result
 
+    @classmethod
+    def bind_url_rules(cls, rules):
+        """Precompute the parent filter of each url rule
+
+        :param list rules: the url rules of the resource
+        """
+        parent_filters = cls._get_url_rules_metadata('_parent_filters')
+        for rule in rules:
+            parent_filters[rule] = cls._compute_parent_filter(rule)
+
+    @classmethod
+    def _compute_parent_filter(cls, rule):
+        """Find the relationship to the parent resource of an url rule like /persons/<int:person_id>/computers from
+        the variables of the rule. The parent_filter attribute, set by Api.route, binds relationship fields to url
+        variables; without it a variable named after the id_field of a single relationship of the schema is used. An
+        id_field of "id" identifies the objects themselves, so it never designates a parent
+
+        :param str rule: an url rule
+        :return tuple: the identifier field of the relationship and the name of the url variable holding the parent
+                       id, or None
+        """
+        variables = RULE_VARIABLE.findall(rule)
+        if not variables or getattr(cls, 'schema', None) is None:
+            return None
+
+        relationships = {key: value for key, value in cls.schema._declared_fields.items()
+                         if isinstance(value, BaseRelationship)}
+
+        parent_filter = getattr(cls, 'parent_filter', None)
+        if parent_filter is not None:
+            for field, variable in parent_filter.items():
+                if field not in relationships:
+                    raise Exception("{} has no relationship {} to filter on".format(cls.schema.__name__, field))
+                if variable in variables:
+                    return relationships[field].id_field, variable
+            return None
+
+        for variable in variables:
+            matching = [value for value in relationships.values() if value.id_field == variable != 'id']
+            if len(matching) == 1:
+                return variable, variable
+
+        return None
+
     def _get_parent_filter(self, url, kwargs):
         """
         Returns a dictionary of filters that should be applied to ensure only resources
         belonging to the parent resource are returned
         """
+        url_rule = getattr(request, 'url_rule', None)
+        if url_rule is None:
+            return {}
 
-        url_segments = url.split('/')
-        parent_segment = url_segments[-3]
-        parent_id = url_segments[-2]
+        parent_filters = self._get_url_rules_metadata('_parent_filters')
+        if url_rule.rule not in parent_filters:
+            parent_filters[url_rule.rule] = self._compute_parent_filter(url_rule.rule)
 
-        for key, value in self.schema._declared_fields.items():
-            if isinstance(value, BaseRelationship):
-                if value.type_ == parent_segment:
-                    return {value.id_field: parent_id}
+        parent_filter = parent_filters[url_rule.rule]
+        if parent_filter is None:
+            return {}
 
-        return {}
+        id_field, variable = parent_filter
+        return {id_field: kwargs[variable]}
 
     def before_get(self, args, kwargs):
         """Hook to make custom work before get method"""
@@ -227,6 +511,44 @@ class ResourceList(with_metaclass(ResourceMeta, Resource)):
     def get_collection(self, qs, kwargs, filters=None):
         return self._data_layer.get_collection(qs, kwargs, filters=filters)
 
+    def get_aggregates(self, qs, kwargs, filters=None):
+        """Compute the aggregates requested by the aggregate and group_by querystring parameters instead of retrieving
+        the collection
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict kwargs: kwargs from the resource view
+        :param dict filters: A dictionary of key/value filters to apply to the eventual query
+        :return dict: the result of the view, with the aggregates in meta
+        """
+        # only the fields the schema of the collection serializes can be aggregated
+        schema = self.schema(**dict(getattr(self, 'get_schema_kwargs', dict()), many=True))
+        for aggregate in qs.aggregates:
+            if aggregate['field'] != '*' and aggregate['field'] not in schema.dump_fields:
+                raise InvalidAggregate("You can't aggregate {} because it is not serialized".format(aggregate['field']))
+        for group_by in qs.group_by:
+            if group_by['field'] not in schema.dump_fields:
+                raise InvalidGroupBy("You can't group by {} because it is not serialized".format(group_by['field']))
+
+        try:
+            aggregates = self._data_layer.get_aggregates(qs, kwargs, filters=filters)
+        except NotImplementedError:
+            raise InvalidAggregate("{} doesn't support aggregates".format(self.__class__.__name__))
+
+        # group values and minimums and maximums are serialized like the fields they come from
+        for aggregate in aggregates:
+            aggregate['group'] = {field: schema.dump_fields[field]._serialize(value, field, None)
+                                  for field, value in aggregate['group'].items()}
+            for function in ('min', 'max'):
+                for field, value in aggregate.get(function, {}).items():
+                    aggregate[function][field] = schema.dump_fields[field]._serialize(value, field, None)
+
+        view_kwargs = request.view_args if getattr(self, 'view_kwargs', None) is True else dict()
+        self_link = url_for(self.view, _external=True, **view_kwargs)
+        if qs.querystring:
+            self_link += '?' + urlencode(qs.querystring)
+
+        return {'meta': {'aggregates': aggregates}, 'links': {'self': self_link}}
+
     def create_object(self, data, kwargs):
         return self._data_layer.create_object(data, kwargs)
 
@@ -240,6 +562,7 @@ class ResourceDetail(with_metaclass(ResourceMeta, Resource)):
         self.before_get(args, kwargs)
 
         qs = QSManager(request.args, self.schema)
+        self.limit_query_cost(qs, collection=False)
 
         obj = self.get_object(kwargs, qs)
 
@@ -250,7 +573,10 @@ class ResourceDetail(with_metaclass(ResourceMeta, Resource)):
                                 qs,
                                 qs.include)
 
-        result = schema.dump(obj) if obj else None
+        result = schema.dump(self.limit_included_objects(schema, [obj], qs)[0]) if obj else None
+        if result is not None:
+            self.add_relationship_counts([result['data']], schema, [obj])
+            self.add_include_pagination([result['data']], schema, [obj], qs)
 
         final_result = self.after_get(result)
 
@@ -519,18 +845,56 @@ class ResourceRelationship(with_metaclass(ResourceMeta, Resource)):
 
         return final_result
 
+    @classmethod
+    def bind_url_rules(cls, rules):
+        """Precompute the relationship data of each url rule
+
+        :param list rules: the url rules of the resource
+        """
+        if getattr(cls, 'schema', None) is None:
+            return
+
+        relationships_data = cls._get_url_rules_metadata('_relationships_data')
+        for rule in rules:
+            relationship_field = rule.split('/')[-1]
+            if not relationship_field.startswith('<'):
+                relationships_data[rule] = cls._compute_relationship_data(relationship_field.replace('-', '_'))
+
+    @classmethod
+    def _compute_relationship_data(cls, relationship_field):
+        """Compute useful data for relationship management
+
+        :param str relationship_field: the name of the relationship field in the schema
+        :return tuple: the relationship field, the model relationship field, the related type and the related
+                       identifier field, or None if the schema has no such relationship
+        """
+        if relationship_field not in get_relationships(cls.schema):
+            return None
+
+        related_type_ = cls.schema._declared_fields[relationship_field].type_
+        related_id_field = cls.schema._declared_fields[relationship_field].id_field
+        model_relationship_field = get_model_field(cls.schema, relationship_field)
+
+        return relationship_field, model_relationship_field, related_type_, related_id_field
+
     def _get_relationship_data(self):
         """Get useful data for relationship management"""
-        relationship_field = request.path.split('/')[-1].replace('-', '_')
+        url_rule = getattr(request, 'url_rule', None)
+        relationships_data = self._get_url_rules_metadata('_relationships_data')
 
-        if relationship_field not in get_relationships(self.schema):
-            raise RelationNotFound("{} has no attribute {}".format(self.schema.__name__, relationship_field))
+        if url_rule is not None and url_rule.rule in relationships_data:
+            relationship_data = relationships_data[url_rule.rule]
+            relationship_field = url_rule.rule.split('/')[-1].replace('-', '_')
+        else:
+            relationship_field = request.path.split('/')[-1].replace('-', '_')
+            relationship_data = self._compute_relationship_data(relationship_field)
+            if url_rule is not None and not url_rule.rule.split('/')[-1].startswith('<'):
+                relationships_data[url_rule.rule] = relationship_data
 
-        related_type_ = self.schema._declared_fields[relationship_field].type_
-        related_id_field = self.schema._declared_fields[relationship_field].id_field
-        model_relationship_field = get_model_field(self.schema, relationship_field)
+        if relationship_data is None:
+            raise RelationNotFound("{} has no attribute {}".format(self.schema.__name__, relationship_field))
 
-        return relationship_field, model_relationship_field, related_type_, related_id_field
+        return relationship_data
 
     def before_get(self, args, kwargs):
         """Hook to make custom work before get method"""
@@ -563,3 +927,33 @@ class ResourceRelationship(with_metaclass(ResourceMeta, Resource)):
     def after_delete(self, result, status_code):
         """Hook to make custom work after delete method"""
         return result, status_code
+
+
+class AsyncResourceList(ResourceList):
+    """Base class of an async resource list manager"""
+
+    asynchronous = True
+
+    get = run_in_data_layer(ResourceList.get)
+    post = run_in_data_layer(ResourceList.post)
+
+
+class AsyncResourceDetail(ResourceDetail):
+    """Base class of an async resource detail manager"""
+
+    asynchronous = True
+
+    get = run_in_data_layer(ResourceDetail.get)
+    patch = run_in_data_layer(ResourceDetail.patch)
+    delete = run_in_data_layer(ResourceDetail.delete)
+
+
+class AsyncResourceRelationship(ResourceRelationship):
+    """Base class of an async resource relationship manager"""
+
+    asynchronous = True
+
+    get = run_in_data_layer(ResourceRelationship.get)
+    post = run_in_data_layer(ResourceRelationship.post)
+    patch = run_in_data_layer(ResourceRelationship.patch)
+    delete = run_in_data_layer(ResourceRelationship.delete)
@@ -9,37 +9,43 @@ from marshmallow_jsonapi.fields import Relationship, List, Nested
 from flask_rest_jsonapi.exceptions import InvalidInclude
 
 
+def plan_includes(include):
+    """Parse include paths into a tree of relationship fields so that paths sharing a prefix are handled once
+
+    :param list include: include paths, like ['author', 'author.company', 'author.company.country']
+    :return dict: the included relationship fields, each mapped to the tree of its own includes
+    """
+    include_tree = {}
+    for include_path in include or ():
+        node = include_tree
+        for field in include_path.split('.'):
+            node = node.setdefault(field, {})
+    return include_tree
+
+
 def compute_schema(schema_cls, default_kwargs, qs, include):
     """Compute a schema around compound documents and sparse fieldsets
 
     :param Schema schema_cls: the schema class
     :param dict default_kwargs: the schema default kwargs
     :param QueryStringManager qs: qs
-    :param list include: the relation field to include data from
+    :param include: the relation field to include data from, as a list of include paths or a tree of includes
 
     :return Schema schema: the schema computed
     """
+    include_tree = include if isinstance(include, dict) else plan_includes(include)
+
     # manage include_data parameter of the schema
     schema_kwargs = default_kwargs
     schema_kwargs['include_data'] = tuple()
 
-    # collect sub-related_includes
-    related_includes = {}
-
-    if include:
-        for include_path in include:
-            field = include_path.split('.')[0]
+    for field in include_tree:
+        if field not in schema_cls._declared_fields:
+            raise InvalidInclude("{} has no attribute {}".format(schema_cls.__name__, field))
+        elif not isinstance(schema_cls._declared_fields[field], Relationship):
+            raise InvalidInclude("{} is not a relationship attribute of {}".format(field, schema_cls.__name__))
 
-            if field not in schema_cls._declared_fields:
-                raise InvalidInclude("{} has no attribute {}".format(schema_cls.__name__, field))
-            elif not isinstance(schema_cls._declared_fields[field], Relationship):
-                raise InvalidInclude("{} is not a relationship attribute of {}".format(field, schema_cls.__name__))
-
-            schema_kwargs['include_data'] += (field, )
-            if field not in related_includes:
-                related_includes[field] = []
-            if '.' in include_path:
-                related_includes[field] += ['.'.join(include_path.split('.')[1:])]
+        schema_kwargs['include_data'] += (field, )
 
     # make sure id field is in only parameter unless marshamllow will raise an Exception
     if schema_kwargs.get('only') is not None and 'id' not in schema_kwargs['only']:
@@ -59,29 +65,47 @@ def compute_schema(schema_cls, default_kwargs, qs, include):
         if schema.only is not None and 'id' not in schema.only:
             schema.only += ('id',)
 
-    # manage compound documents
-    if include:
-        for include_path in include:
-            field = include_path.split('.')[0]
-            relation_field = schema.declared_fields[field]
-            related_schema_cls = schema.declared_fields[field].__dict__['_Relationship__schema']
-            related_schema_kwargs = {}
-            if 'context' in default_kwargs:
-                related_schema_kwargs['context'] = default_kwargs['context']
-            if isinstance(related_schema_cls, SchemaABC):
-                related_schema_kwargs['many'] = related_schema_cls.many
-                related_schema_cls = related_schema_cls.__class__
-            if isinstance(related_schema_cls, str):
-                related_schema_cls = class_registry.get_class(related_schema_cls)
-            related_schema = compute_schema(related_schema_cls,
-                                            related_schema_kwargs,
-                                            qs,
-                                            related_includes[field] or None)
-            relation_field.__dict__['_Relationship__schema'] = related_schema
+    # manage compound documents, building the schema of each included relationship once
+    for field, related_include_tree in include_tree.items():
+        relation_field = schema.declared_fields[field]
+        related_schema_cls = schema.declared_fields[field].__dict__['_Relationship__schema']
+        related_schema_kwargs = {}
+        if 'context' in default_kwargs:
+            related_schema_kwargs['context'] = default_kwargs['context']
+        if isinstance(related_schema_cls, SchemaABC):
+            related_schema_kwargs['many'] = related_schema_cls.many
+            related_schema_cls = related_schema_cls.__class__
+        if isinstance(related_schema_cls, str):
+            related_schema_cls = class_registry.get_class(related_schema_cls)
+        related_schema = compute_schema(related_schema_cls,
+                                        related_schema_kwargs,
+                                        qs,
+                                        related_include_tree)
+        relation_field.__dict__['_Relationship__schema'] = related_schema
 
     return schema
 
 
+class LimitedRelationships(object):
+    """Proxy of an object serialized with given lists of related objects instead of some of its to-many
+    relationships, so that the lists limited by page[<relationship>][size] parameters are never set on the object
+    """
+
+    def __init__(self, obj, related_objects):
+        """Initialize the proxy
+
+        :param obj: the object
+        :param dict related_objects: the lists of related objects by model field
+        """
+        self._obj = obj
+        self._related_objects = related_objects
+
+    def __getattr__(self, name):
+        if name in self._related_objects:
+            return self._related_objects[name]
+        return getattr(self._obj, name)
+
+
 def get_model_field(schema, field):
     """Get the model field of a schema field
 
@@ -140,6 +164,62 @@ def get_related_schema(schema, field):
     return schema._declared_fields[field].__dict__['_Relationship__schema']
 
 
+def get_related_schema_cls(schema, field):
+    """Retrieve the class of the related schema of a relationship field
+
+    :param Schema schema: the schema to retrieve the relationship field from
+    :param str field: the relationship field
+    :return Schema: the related schema class
+    """
+    related_schema = get_related_schema(schema, field)
+
+    if isinstance(related_schema, SchemaABC):
+        return related_schema.__class__
+    if isinstance(related_schema, str):
+        return class_registry.get_class(related_schema)
+    return related_schema
+
+
+def warmup_schema(schema_cls, seen=None):
+    """Instantiate a schema and resolve its relationships recursively so that misconfigurations are raised at startup
+
+    :param Schema schema_cls: the schema class
+    :param set seen: the schema classes already warmed up
+    :return Schema: the schema class
+    """
+    seen = seen if seen is not None else set()
+    if schema_cls in seen:
+        return schema_cls
+    seen.add(schema_cls)
+
+    try:
+        schema_cls()
+    except Exception as e:
+        raise Exception("Can't instantiate {}: {}".format(schema_cls.__name__, e))
+
+    for field in get_relationships(schema_cls):
+        relationship = schema_cls._declared_fields[field]
+        try:
+            related_schema_cls = get_related_schema_cls(schema_cls, field)
+        except Exception as e:
+            raise Exception("Can't resolve the schema of {}.{}: {}".format(schema_cls.__name__, field, e))
+
+        if related_schema_cls is None:
+            continue
+
+        related_type = getattr(getattr(related_schema_cls, 'opts', None), 'type_', None)
+        if related_type is not None and relationship.type_ != related_type:
+            raise Exception("{}.{} has type {} but its schema {} has type {}".format(schema_cls.__name__,
+                                                                                    field,
+                                                                                    relationship.type_,
+                                                                                    related_schema_cls.__name__,
+                                                                                    related_type))
+
+        warmup_schema(related_schema_cls, seen)
+
+    return schema_cls
+
+
 def get_schema_from_type(resource_type):
     """Retrieve a schema from the registry by his type
 
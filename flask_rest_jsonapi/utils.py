@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import json
+import sys
+import time
+from collections import OrderedDict
+from threading import Lock
 from uuid import UUID
 from datetime import datetime
 from decimal import Decimal
@@ -15,3 +19,116 @@ class JSONEncoder(json.JSONEncoder):
         elif isinstance(obj, Decimal):
             return str(obj)            
         return json.JSONEncoder.default(self, obj)
+
+
+def approximate_size(value, seen=None):
+    """Approximate the memory size of a value and of the values it contains
+
+    :param value: a value
+    :param set seen: the identifiers of the values already counted
+    :return int: the size in bytes
+    """
+    seen = seen if seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(key, seen) + approximate_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, seen) for item in value)
+    elif hasattr(value, '__dict__') and not isinstance(value, type):
+        size += sum(approximate_size(item, seen) for key, item in value.__dict__.items() if not key.startswith('_'))
+    return size
+
+
+class LRUCache(object):
+    """A thread safe least recently used cache with optional time to live and size limit in bytes"""
+
+    def __init__(self, max_size=1024, ttl=None, max_bytes=None, sizeof=approximate_size):
+        """Initialize a cache
+
+        :param int max_size: the maximum number of entries
+        :param float ttl: the number of seconds an entry stays valid, None for no expiration
+        :param int max_bytes: the maximum total size of the entries in bytes, None for no limit
+        :param callable sizeof: the function computing the size of a value in bytes, None to not account sizes
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def get(self, key, default=None):
+        """Get the value of a key and mark it as recently used
+
+        :param key: the key
+        :param default: the value returned if the key is missing or expired
+        :return: the value
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                self._delete(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Set the value of a key and evict the least recently used entries over the limits
+
+        :param key: the key
+        :param value: the value
+        :param float ttl: the number of seconds the entry stays valid if shorter than the ttl of the cache
+        """
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            self.delete(key)
+            return
+
+        if self.ttl is not None:
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            self._delete(key)
+            self.entries[key] = (value, expires_at, size)
+            self.bytes += size
+
+            while len(self.entries) > self.max_size or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._delete(next(iter(self.entries)))
+
+    def delete(self, key):
+        """Delete a key
+
+        :param key: the key
+        """
+        with self.lock:
+            self._delete(key)
+
+    def clear(self):
+        """Delete every key"""
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
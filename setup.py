@@ -14,8 +14,7 @@ setup(
     classifiers=[
         'Framework :: Flask',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'License :: OSI Approved :: MIT License',
     ],
@@ -28,8 +27,9 @@ setup(
         'Flask',
         'marshmallow',
         'marshmallow_jsonapi',
-        'sqlalchemy'
+        'sqlalchemy>=1.4'
     ],
+    python_requires='>=3.7',
     setup_requires=['pytest-runner'],
     tests_require=['pytest'],
     extras_require={
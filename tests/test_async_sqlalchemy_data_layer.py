@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('aiosqlite')
+
+from asyncio import current_task
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_scoped_session
+from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import NullPool
+from flask import Flask, request, make_response
+from marshmallow_jsonapi.flask import Schema, Relationship
+from marshmallow_jsonapi import fields
+
+from flask_rest_jsonapi import Api, AsyncResourceList, AsyncResourceDetail, AsyncResourceRelationship
+from flask_rest_jsonapi.data_layers.async_alchemy import AsyncSqlalchemyDataLayer
+from flask_rest_jsonapi.querystring import QueryStringManager as QSManager
+
+HEADERS = {'Content-Type': 'application/vnd.api+json'}
+
+
+@pytest.fixture(scope="module")
+def database(tmpdir_factory):
+    path = tmpdir_factory.mktemp('async').join('async.db')
+    yield str(path)
+
+
+@pytest.fixture(scope="module")
+def base():
+    yield declarative_base()
+
+
+@pytest.fixture(scope="module")
+def person_model(base):
+    class Person(base):
+        __tablename__ = 'person'
+
+        person_id = Column(Integer, primary_key=True)
+        name = Column(String, nullable=False)
+        computers = relationship("Computer", backref="person")
+
+    yield Person
+
+
+@pytest.fixture(scope="module")
+def computer_model(base):
+    class Computer(base):
+        __tablename__ = 'computer'
+
+        id = Column(Integer, primary_key=True)
+        serial = Column(String, nullable=False)
+        person_id = Column(Integer, ForeignKey('person.person_id'))
+
+    yield Computer
+
+
+@pytest.fixture(scope="module")
+def session(base, database, person_model, computer_model):
+    engine = create_engine('sqlite:///{}'.format(database))
+    base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(person_model.__table__.insert(), [{'person_id': 1, 'name': 'Jean'},
+                                                             {'person_id': 2, 'name': 'Paul'},
+                                                             {'person_id': 3, 'name': 'Pierre'}])
+        connection.execute(computer_model.__table__.insert(), [{'id': 1, 'serial': 'Amstrad', 'person_id': 1},
+                                                               {'id': 2, 'serial': 'Commodore', 'person_id': 2}])
+    engine.dispose()
+
+    async_engine = create_async_engine('sqlite+aiosqlite:///{}'.format(database), poolclass=NullPool)
+    yield async_scoped_session(sessionmaker(async_engine, class_=AsyncSession), scopefunc=current_task)
+
+
+@pytest.fixture(scope="module")
+def person_schema():
+    class AsyncPersonSchema(Schema):
+        class Meta:
+            type_ = 'async_person'
+            self_view = 'async_person_detail'
+            self_view_kwargs = {'person_id': '<id>'}
+
+        id = fields.Integer(as_string=True, attribute='person_id')
+        name = fields.Str(required=True)
+        computers = Relationship(related_view='async_computer_list',
+                                 related_view_kwargs={'person_id': '<person_id>'},
+                                 schema='AsyncComputerSchema',
+                                 type_='async_computer',
+                                 many=True)
+
+    yield AsyncPersonSchema
+
+
+@pytest.fixture(scope="module")
+def computer_schema():
+    class AsyncComputerSchema(Schema):
+        class Meta:
+            type_ = 'async_computer'
+
+        id = fields.Integer(as_string=True)
+        serial = fields.Str(required=True)
+        owner = Relationship(attribute='person',
+                             schema='AsyncPersonSchema',
+                             type_='async_person')
+
+    yield AsyncComputerSchema
+
+
+@pytest.fixture(scope="module")
+def client(session, person_model, computer_model, person_schema, computer_schema):
+    class PersonList(AsyncResourceList):
+        schema = person_schema
+        data_layer = {'session': session,
+                      'model': person_model}
+
+    class PersonDetail(AsyncResourceDetail):
+        schema = person_schema
+        data_layer = {'session': session,
+                      'model': person_model,
+                      'url_field': 'person_id'}
+
+    class PersonComputers(AsyncResourceRelationship):
+        schema = person_schema
+        data_layer = {'session': session,
+                      'model': person_model,
+                      'url_field': 'person_id'}
+
+    class ComputerList(AsyncResourceList):
+        schema = computer_schema
+        data_layer = {'session': session,
+                      'model': computer_model}
+
+    app = Flask(__name__)
+    api = Api(app)
+    api.route(PersonList, 'async_person_list', '/persons')
+    api.route(PersonDetail, 'async_person_detail', '/persons/<int:person_id>')
+    api.route(PersonComputers, 'async_person_computers', '/persons/<int:person_id>/relationships/computers')
+    api.route(ComputerList, 'async_computer_list', '/computers', '/persons/<int:person_id>/computers')
+
+    yield app.test_client()
+
+
+def test_default_data_layer(client):
+    person_list = client.application.view_functions['async_person_list'].view_class
+    assert isinstance(person_list._data_layer, AsyncSqlalchemyDataLayer)
+
+
+def test_get_list(client):
+    querystring = 'filter[name]=Paul&sort=-name&page[size]=10&include=computers&fields[async_person]=name,computers'
+    response = client.get('/persons?' + querystring, headers=HEADERS)
+    assert response.status_code == 200
+    result = json.loads(response.get_data())
+    assert result['meta']['count'] == 1
+    assert result['data'][0]['attributes'] == {'name': 'Paul'}
+    assert result['included'][0]['attributes']['serial'] == 'Commodore'
+
+
+def test_get_list_sort_and_pagination(client):
+    response = client.get('/persons?sort=-name&page[size]=2&page[number]=1', headers=HEADERS)
+    assert response.status_code == 200
+    result = json.loads(response.get_data())
+    assert result['meta']['count'] >= 3
+    assert [person['attributes']['name'] for person in result['data']] == ['Pierre', 'Paul']
+    assert 'next' in result['links']
+
+
+def test_post_patch_delete(client):
+    payload = {'data': {'type': 'async_person', 'attributes': {'name': 'Marie'}}}
+    response = client.post('/persons', data=json.dumps(payload), headers=HEADERS)
+    assert response.status_code == 201
+    person_id = json.loads(response.get_data())['data']['id']
+
+    payload = {'data': {'type': 'async_person', 'id': person_id, 'attributes': {'name': 'Marie Curie'}}}
+    response = client.patch('/persons/' + person_id, data=json.dumps(payload), headers=HEADERS)
+    assert response.status_code == 200
+    assert json.loads(response.get_data())['data']['attributes']['name'] == 'Marie Curie'
+
+    response = client.delete('/persons/' + person_id, headers=HEADERS)
+    assert response.status_code == 200
+
+    response = client.get('/persons/' + person_id, headers=HEADERS)
+    assert json.loads(response.get_data()) is None
+
+
+def test_relationship(client):
+    response = client.get('/persons/3/relationships/computers', headers=HEADERS)
+    assert response.status_code == 200
+    assert json.loads(response.get_data())['data'] == []
+
+    payload = {'data': [{'type': 'async_computer', 'id': '1'}]}
+    response = client.post('/persons/3/relationships/computers', data=json.dumps(payload), headers=HEADERS)
+    assert response.status_code == 200
+
+    response = client.get('/persons/3/relationships/computers?include=computers', headers=HEADERS)
+    result = json.loads(response.get_data())
+    assert result['data'] == [{'type': 'async_computer', 'id': 1}]
+    assert result['included'][0]['attributes']['serial'] == 'Amstrad'
+
+
+def test_lazy_load_during_serialization(client):
+    response = client.get('/persons/2', headers=HEADERS)
+    assert response.status_code == 200
+    assert json.loads(response.get_data())['data']['attributes']['name'] == 'Paul'
+
+
+def test_error(client):
+    response = client.get('/persons?filter=[{"name":"unknown","op":"eq","val":1}]', headers=HEADERS)
+    assert response.status_code == 400
+
+
+def test_run_sync_concurrently(client, person_schema):
+    data_layer = client.application.view_functions['async_person_list'].view_class._data_layer
+
+    async def count_persons():
+        try:
+            with client.application.test_request_context('/persons'):
+                qs = QSManager({}, person_schema)
+                return (await data_layer.run_sync(data_layer.get_collection, qs, {}))[0]
+        finally:
+            await data_layer.remove_session()
+
+    async def main():
+        return await asyncio.gather(*[count_persons() for _ in range(5)])
+
+    counts = asyncio.run(main())
+    assert len(set(counts)) == 1
+
+
+def test_requests_share_event_loop():
+    loops = []
+    waiters = {}
+
+    class WaitingList(AsyncResourceList):
+        async def get(self):
+            loops.append(asyncio.get_running_loop())
+            name = request.args['name']
+            if name == 'first':
+                waiters['first'] = asyncio.Event()
+                # only a request running on the same event loop can wake this one up
+                await asyncio.wait_for(waiters['first'].wait(), 5)
+            else:
+                waiters['first'].set()
+            return make_response(name)
+
+    app = Flask(__name__)
+    api = Api(app)
+    api.route(WaitingList, 'waiting_list', '/waiting')
+
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(app.test_client().get('/waiting?name=first')))
+    thread.start()
+    deadline = time.monotonic() + 5
+    while 'first' not in waiters and time.monotonic() < deadline:
+        time.sleep(0.01)
+    second = app.test_client().get('/waiting?name=second')
+    thread.join()
+
+    assert (responses[0].get_data(as_text=True), second.get_data(as_text=True)) == ('first', 'second')
+    assert loops[0] is loops[1]
+
+
+def test_remove_session_keeps_plain_session(person_model):
+    session = AsyncSession(create_async_engine('sqlite+aiosqlite://'))
+    closed = []
+
+    async def close():
+        closed.append(session)
+
+    session.close = close
+    data_layer = AsyncSqlalchemyDataLayer(dict(session=session, model=person_model))
+    asyncio.run(data_layer.remove_session())
+    assert closed == []
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import subprocess
+import sys
+
+
+def import_time(statement):
+    """Run a statement in a fresh interpreter with -X importtime
+
+    :param str statement: the python statement to run
+    :return dict: the cumulative import time in microseconds of each imported module
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                             stderr=subprocess.PIPE,
+                             universal_newlines=True,
+                             check=True)
+
+    modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+
+    return modules
+
+
+def test_import_time_without_sqlalchemy():
+    modules = import_time('import flask_rest_jsonapi')
+
+    assert 'flask_rest_jsonapi' in modules
+    assert not [name for name in modules if name.startswith('sqlalchemy')]
+    assert 'flask_rest_jsonapi.data_layers.alchemy' not in modules
+    assert 'flask_rest_jsonapi.data_layers.filtering.alchemy' not in modules
+
+
+def test_import_time_filtering_loaded_on_first_use():
+    modules = import_time('import flask_rest_jsonapi.data_layers.alchemy')
+
+    assert 'sqlalchemy' in modules
+    assert 'flask_rest_jsonapi.data_layers.filtering.alchemy' not in modules
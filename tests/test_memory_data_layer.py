@@ -0,0 +1,536 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import time
+
+from six.moves.urllib.parse import urlencode
+import pytest
+
+from flask import Flask, json, request
+from marshmallow_jsonapi.flask import Schema, Relationship
+from marshmallow_jsonapi import fields
+
+from flask_rest_jsonapi import Api, ResourceList, ResourceDetail, ResourceRelationship
+from flask_rest_jsonapi.data_layers.memory import InMemoryDataLayer, InMemoryStore, InMemoryObject, SortedIndex
+from flask_rest_jsonapi.data_layers.caching import CachingDataLayer, invalidate, get_cache
+from flask_rest_jsonapi.utils import LRUCache
+
+HEADERS = {'Content-Type': 'application/vnd.api+json'}
+
+
+@pytest.fixture()
+def stores():
+    computers = InMemoryStore([InMemoryObject(id=i, serial='serial-{}'.format(i), owner=None) for i in range(1, 4)],
+                              indexes=['serial'])
+    persons = InMemoryStore(indexes=['name'], sorted_indexes=['birth_date', 'name'])
+    for i, name in enumerate(['Paul', 'Jean', 'Pierre', 'Marie', None], 1):
+        birth_date = datetime.date(1980 + i % 3, 1, i) if name != 'Marie' else None
+        persons.add(InMemoryObject(id=i, name=name, birth_date=birth_date, computers=[]))
+
+    persons.get(1).computers.append(computers.get(1))
+    computers.get(1).owner = persons.get(1)
+    persons.get(2).computers.append(computers.get(2))
+    computers.get(2).owner = persons.get(2)
+
+    yield persons, computers
+
+
+@pytest.fixture(params=[False, True], ids=['uncached', 'cached'])
+def cache(request):
+    yield {'max_size': 16, 'namespace': object()} if request.param else None
+
+
+@pytest.fixture()
+def client(stores, cache):
+    persons, computers = stores
+
+    class MemoryPersonSchema(Schema):
+        class Meta:
+            type_ = 'memory_person'
+            self_view = 'memory_person_detail'
+            self_view_kwargs = {'id': '<id>'}
+
+        id = fields.Integer(as_string=True)
+        name = fields.Str(allow_none=True)
+        birth_date = fields.Date(allow_none=True)
+        computers = Relationship(self_view='memory_person_computers',
+                                 self_view_kwargs={'id': '<id>'},
+                                 schema='MemoryComputerSchema',
+                                 type_='memory_computer',
+                                 many=True)
+
+    class MemoryComputerSchema(Schema):
+        class Meta:
+            type_ = 'memory_computer'
+
+        id = fields.Integer(as_string=True)
+        serial = fields.Str(required=True)
+        owner = Relationship(schema='MemoryPersonSchema', type_='memory_person')
+
+    person_data_layer = {'class': InMemoryDataLayer,
+                         'store': persons,
+                         'related_stores': {'computers': computers},
+                         'relationship_counts': ['computers'],
+                         'cache': cache}
+
+    class PersonList(ResourceList):
+        schema = MemoryPersonSchema
+        data_layer = dict(person_data_layer)
+
+    class PersonDetail(ResourceDetail):
+        schema = MemoryPersonSchema
+        data_layer = dict(person_data_layer)
+
+    class PersonComputers(ResourceRelationship):
+        schema = MemoryPersonSchema
+        data_layer = dict(person_data_layer)
+
+    class ComputerList(ResourceList):
+        schema = MemoryComputerSchema
+        data_layer = {'class': InMemoryDataLayer,
+                      'store': computers,
+                      'related_stores': {'owner': persons}}
+
+    app = Flask(__name__)
+    api = Api(app)
+    api.route(PersonList, 'memory_person_list', '/persons')
+    api.route(PersonDetail, 'memory_person_detail', '/persons/<int:id>')
+    api.route(PersonComputers, 'memory_person_computers', '/persons/<int:id>/relationships/computers')
+    api.route(ComputerList, 'memory_computer_list', '/computers')
+
+    yield app.test_client()
+
+
+def get(client, url, **querystring):
+    response = client.get(url + '?' + urlencode(querystring), headers=HEADERS)
+    assert response.status_code == 200, response.get_data()
+    return json.loads(response.get_data())
+
+
+def names(result):
+    return [person['attributes']['name'] for person in result['data']]
+
+
+def test_sorted_index():
+    index = SortedIndex()
+    for id_, value in enumerate([3, 1, 2, None, 2]):
+        index.add(value, id_)
+    assert index.range('lt', 2) == [1]
+    assert sorted(index.range('ge', 2)) == [0, 2, 4]
+    assert sorted(index.range('between', (1, 2))) == [1, 2, 4]
+    assert list(index.ordered_ids('asc')) == [3, 1, 2, 4, 0]
+    index.remove(2, 2)
+    index.remove(None, 3)
+    assert list(index.ordered_ids('desc')) == [0, 4, 1]
+
+    built = SortedIndex()
+    built.build((value, id_) for id_, value in enumerate([3, 1, 2, None, 2]))
+    assert (built.values, built.ids, built.nulls) == ([1, 2, 2, 3], [1, 2, 4, 0], {3: None})
+
+
+def test_store_sorted_indexes():
+    store = InMemoryStore([InMemoryObject(id=i, code=-i % 7) for i in range(1, 50)], sorted_indexes=['code'])
+    assert store.ordered_ids('code', 'asc') == sorted(range(1, 50), key=lambda i: -i % 7)
+    store.add(InMemoryObject(code=3))
+    assert [id_ for id_ in store.ordered_ids('code', 'asc') if store.get(id_).code == 3] == list(range(4, 47, 7)) + [50]
+    assert sorted(store.range('code', 'lt', 1)) == list(range(7, 50, 7))
+
+    dl = InMemoryDataLayer(dict(store=store))
+    objects = dl.sort_query(None, [])
+    assert not isinstance(objects, list)
+    assert next(objects) is store.get(1)
+
+
+def test_store_indexes(stores):
+    persons, computers = stores
+    assert persons.lookup('name', ['Paul', 'Jean']) == {1, 2}
+    assert persons.lookup('birth_date', [None]) is None
+    assert persons.lookup('id', ['3', 'x']) == {3}
+
+    persons.update(persons.get(1), {'name': 'Jacques'})
+    assert persons.lookup('name', ['Paul']) == set()
+    assert persons.lookup('name', ['Jacques']) == {1}
+
+    persons.remove(persons.get(1))
+    assert persons.lookup('name', ['Jacques']) == set()
+    assert persons.add(InMemoryObject(name='new')).id == 6
+
+
+def test_store_lookup_without_scan(monkeypatch):
+    store = InMemoryStore([InMemoryObject(id=i, code=i % 100) for i in range(1, 10001)], indexes=['code'])
+    assert iter(store).__next__() is store.get(1)
+    snapshot = store.snapshot
+    list(store)
+    assert store.snapshot is snapshot
+
+    dl = InMemoryDataLayer(dict(store=store))
+
+    def scan(store_):
+        raise AssertionError('the store was scanned')
+
+    monkeypatch.setattr(InMemoryStore, '__iter__', scan)
+    ids = dl.filter_by(None, {'code': 7})
+    assert [obj.id for obj in dl.select_objects(ids)] == list(range(7, 10001, 100))
+    monkeypatch.undo()
+
+    store.remove(store.get(7))
+    assert store.snapshot is None
+    assert [obj.id for obj in dl.select_objects(ids)] == list(range(107, 10001, 100))
+    assert len(list(store)) == 9999
+
+
+def test_get_list(client):
+    result = get(client, '/persons')
+    assert result['meta']['count'] == 5
+    assert names(result) == ['Paul', 'Jean', 'Pierre', 'Marie', None]
+
+
+def test_get_list_filters(client):
+    assert names(get(client, '/persons', **{'filter[name]': 'Paul'})) == ['Paul']
+    assert names(get(client, '/persons', **{'filter[name]': 'Paul,Jean'})) == ['Paul', 'Jean']
+
+    filters = [{'or': [{'name': 'name', 'op': 'like', 'val': 'P%'},
+                       {'name': 'birth_date', 'op': 'ge', 'val': '1982-01-01'}]},
+               {'not': {'name': 'name', 'op': 'eq', 'val': 'Pierre'}}]
+    assert set(names(get(client, '/persons', filter=json.dumps(filters)))) == {'Paul', 'Jean', None}
+
+    filters = [{'name': 'computers', 'op': 'any', 'val': {'name': 'serial', 'op': 'eq', 'val': 'serial-2'}}]
+    assert names(get(client, '/persons', filter=json.dumps(filters))) == ['Jean']
+
+    filters = [{'name': 'owner', 'op': 'has', 'val': {'name': 'name', 'op': 'ilike', 'val': 'pa%'}}]
+    result = get(client, '/computers', filter=json.dumps(filters))
+    assert [computer['id'] for computer in result['data']] == ['1']
+
+    filters = [{'name': 'name', 'op': 'is_', 'val': None}]
+    assert get(client, '/persons', filter=json.dumps(filters))['meta']['count'] == 1
+
+
+def test_get_list_invalid_filters(client):
+    for filters in ([{'name': 'unknown', 'op': 'eq', 'val': 1}],
+                    [{'name': 'name', 'op': 'unknown', 'val': 1}],
+                    [{'name': 'name', 'op': 'eq'}]):
+        response = client.get('/persons?' + urlencode({'filter': json.dumps(filters)}), headers=HEADERS)
+        assert response.status_code == 400
+
+
+def test_get_list_sort_and_pagination(client):
+    result = get(client, '/persons', sort='-name', **{'page[size]': 2, 'page[number]': 2})
+    assert result['meta']['count'] == 5
+    assert names(result) == ['Marie', 'Jean']
+    assert 'next' in result['links']
+
+    result = get(client, '/persons', sort='birth_date,-name', **{'filter[name]': 'Paul,Jean,Pierre,Marie'})
+    assert names(result) == ['Marie', 'Pierre', 'Paul', 'Jean']
+
+    assert len(get(client, '/persons', **{'page[size]': 0})['data']) == 5
+
+
+def test_get_list_sort_relationship_path(client):
+    result = get(client, '/computers', sort='owner.name')
+    assert [computer['id'] for computer in result['data']] == ['3', '2', '1']
+
+    result = get(client, '/computers', sort='-owner.name')
+    assert [computer['id'] for computer in result['data']] == ['1', '2', '3']
+
+    response = client.get('/persons?sort=computers.serial', headers=HEADERS)
+    assert response.status_code == 400
+
+def test_get_list_include_pagination(client, stores):
+    persons, computers = stores
+    persons.get(1).computers.append(computers.get(3))
+
+    result = get(client, '/persons', include='computers', **{'page[computers][size]': 1, 'filter[name]': 'Paul'})
+    relationship = result['data'][0]['relationships']['computers']
+    assert relationship['data'] == [{'type': 'memory_computer', 'id': '1'}]
+    assert relationship['meta'] == {'count': 2}
+    assert [item['id'] for item in result['included']] == ['1']
+    assert len(persons.get(1).computers) == 2
+
+def test_get_list_relationship_counts(client):
+    result = get(client, '/persons', **{'filter[name]': 'Paul,Pierre'})
+    assert [person['relationships']['computers']['meta']['count'] for person in result['data']] == [1, 0]
+
+    result = get(client, '/persons/1')
+    assert result['data']['relationships']['computers']['meta']['count'] == 1
+
+    result = get(client, '/persons', **{'fields[memory_person]': 'name'})
+    assert 'meta' not in result['data'][0].get('relationships', {}).get('computers', {})
+
+
+def test_get_list_aggregates(client):
+    result = get(client, '/persons', **{'aggregate[count]': '*,name', 'aggregate[min]': 'birth_date'})
+    assert result['meta']['aggregates'] == [{'group': {},
+                                             'count': {'*': 5, 'name': 4},
+                                             'min': {'birth_date': '1980-01-03'}}]
+    assert 'data' not in result
+
+    result = get(client, '/persons', group_by='name', **{'aggregate[count]': '*', 'filter[name]': 'Paul,Jean'})
+    assert result['meta']['aggregates'] == [{'group': {'name': 'Jean'}, 'count': {'*': 1}},
+                                            {'group': {'name': 'Paul'}, 'count': {'*': 1}}]
+
+    for querystring in ({'aggregate[median]': 'name'}, {'aggregate[sum]': 'computers'}, {'group_by': 'name'},
+                        {'aggregate[count]': '*', 'group_by': 'unknown'}):
+        response = client.get('/persons?' + urlencode(querystring), headers=HEADERS)
+        assert response.status_code == 400
+
+
+def test_get_list_aggregates_serialized_fields_only():
+    accounts = InMemoryStore([InMemoryObject(id=1, login='paul', password='s3cret', token='t0ken', email='p@x.org')])
+
+    class MemoryAccountSchema(Schema):
+        class Meta:
+            type_ = 'memory_account'
+            exclude = ('token',)
+
+        id = fields.Integer(as_string=True)
+        login = fields.Str()
+        password = fields.Str(load_only=True)
+        token = fields.Str()
+        email = fields.Str()
+
+    class AccountList(ResourceList):
+        schema = MemoryAccountSchema
+        get_schema_kwargs = {'exclude': ('email',)}
+        data_layer = {'class': InMemoryDataLayer, 'store': accounts}
+
+    class NoAggregatesDataLayer(InMemoryDataLayer):
+        def get_aggregates(self, qs, view_kwargs, filters=None):
+            raise NotImplementedError
+
+    class NoAggregatesAccountList(ResourceList):
+        schema = MemoryAccountSchema
+        data_layer = {'class': NoAggregatesDataLayer, 'store': accounts}
+
+    app = Flask(__name__)
+    api = Api(app)
+    api.route(AccountList, 'memory_account_list', '/accounts')
+    api.route(NoAggregatesAccountList, 'memory_no_aggregates_account_list', '/no_aggregates_accounts')
+    client = app.test_client()
+
+    result = get(client, '/accounts', group_by='login', **{'aggregate[max]': 'login'})
+    assert result['meta']['aggregates'] == [{'group': {'login': 'paul'}, 'max': {'login': 'paul'}}]
+
+    for field in ('password', 'token', 'email'):
+        for querystring in ({'aggregate[max]': field}, {'aggregate[count]': '*', 'group_by': field}):
+            response = client.get('/accounts?' + urlencode(querystring), headers=HEADERS)
+            assert response.status_code == 400, (field, querystring)
+            assert 's3cret' not in response.get_data(as_text=True)
+
+    response = client.get('/no_aggregates_accounts?' + urlencode({'aggregate[count]': '*'}), headers=HEADERS)
+    assert response.status_code == 400
+    assert response.json['errors'][0]['title'] == 'Invalid aggregate querystring parameter.'
+
+
+def test_get_list_include(client):
+    result = get(client, '/persons', include='computers', **{'filter[name]': 'Paul'})
+    assert result['included'][0]['attributes']['serial'] == 'serial-1'
+
+
+def test_crud(client, stores):
+    persons, computers = stores
+    payload = {'data': {'type': 'memory_person',
+                        'attributes': {'name': 'Anne'},
+                        'relationships': {'computers': {'data': [{'type': 'memory_computer', 'id': '3'}]}}}}
+    response = client.post('/persons', data=json.dumps(payload), headers=HEADERS)
+    assert response.status_code == 201, response.get_data()
+    person_id = json.loads(response.get_data())['data']['id']
+    assert persons.get(person_id).computers == [computers.get(3)]
+    assert persons.lookup('name', ['Anne']) == {int(person_id)}
+
+    payload = {'data': {'type': 'memory_person', 'id': person_id, 'attributes': {'name': 'Anna'}}}
+    response = client.patch('/persons/' + person_id, data=json.dumps(payload), headers=HEADERS)
+    assert response.status_code == 200
+    assert names(get(client, '/persons', **{'filter[name]': 'Anna'})) == ['Anna']
+
+    response = client.delete('/persons/' + person_id, headers=HEADERS)
+    assert response.status_code == 200
+    assert persons.get(person_id) is None
+
+
+def test_relationships(client, stores):
+    persons, computers = stores
+    assert get(client, '/persons/3/relationships/computers')['data'] == []
+
+    payload = {'data': [{'type': 'memory_computer', 'id': '3'}]}
+    response = client.post('/persons/3/relationships/computers', data=json.dumps(payload), headers=HEADERS)
+    assert response.status_code == 200
+    assert get(client, '/persons/3/relationships/computers')['data'] == [{'type': 'memory_computer', 'id': 3}]
+
+    payload = {'data': [{'type': 'memory_computer', 'id': '1'}, {'type': 'memory_computer', 'id': '2'}]}
+    response = client.patch('/persons/3/relationships/computers', data=json.dumps(payload), headers=HEADERS)
+    assert response.status_code == 200
+    assert persons.get(3).computers == [computers.get(1), computers.get(2)]
+
+    payload = {'data': [{'type': 'memory_computer', 'id': '1'}]}
+    response = client.delete('/persons/3/relationships/computers', data=json.dumps(payload), headers=HEADERS)
+    assert response.status_code == 200
+    assert persons.get(3).computers == [computers.get(2)]
+
+    payload = {'data': [{'type': 'memory_computer', 'id': '42'}]}
+    response = client.post('/persons/3/relationships/computers', data=json.dumps(payload), headers=HEADERS)
+    assert response.status_code == 404
+
+
+def test_data_layer_without_store():
+    with pytest.raises(Exception):
+        InMemoryDataLayer(dict())
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2
+
+    cache = LRUCache(max_bytes=200, sizeof=len)
+    cache.set('a', 'x' * 150)
+    cache.set('b', 'x' * 100)
+    assert 'a' not in cache and cache.bytes == 100
+    cache.set('c', 'x' * 300)
+    assert 'c' not in cache
+
+    cache = LRUCache(ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert cache.bytes == 0
+
+
+@pytest.mark.parametrize('cache', [True], indirect=True)
+def test_caching_data_layer(client, stores):
+    persons, computers = stores
+
+    assert get(client, '/persons')['meta']['count'] == 5
+    persons.add(InMemoryObject(name='Added outside of the api', birth_date=None, computers=[]))
+    assert get(client, '/persons')['meta']['count'] == 5
+    assert get(client, '/persons', sort='name')['meta']['count'] == 6
+
+    payload = {'data': {'type': 'memory_person', 'id': '2', 'attributes': {'name': 'Jeanne'}}}
+    response = client.patch('/persons/2', data=json.dumps(payload), headers=HEADERS)
+    assert response.status_code == 200
+    assert get(client, '/persons/2')['data']['attributes']['name'] == 'Jeanne'
+    assert get(client, '/persons')['meta']['count'] == 6
+
+
+def test_caching_data_layer_scoped_to_resource(stores):
+    persons, computers = stores
+
+    class CachedPersonSchema(Schema):
+        class Meta:
+            type_ = 'cached_memory_person'
+
+        id = fields.Integer(as_string=True)
+        name = fields.Str(allow_none=True)
+
+    class JeanDataLayer(InMemoryDataLayer):
+        def get_collection(self, qs, view_kwargs, filters=None):
+            return super(JeanDataLayer, self).get_collection(qs, view_kwargs, filters={'name': 'Jean'})
+
+    cache = {'namespace': persons}
+
+    class PersonList(ResourceList):
+        schema = CachedPersonSchema
+        data_layer = {'class': InMemoryDataLayer, 'store': persons, 'cache': cache}
+
+    class JeanList(ResourceList):
+        schema = CachedPersonSchema
+        data_layer = {'class': JeanDataLayer, 'store': persons, 'cache': cache}
+
+    assert PersonList.data_layer['cache'] is cache
+    assert isinstance(JeanList._data_layer, CachingDataLayer)
+
+    app = Flask(__name__)
+    api = Api(app)
+    api.route(PersonList, 'cached_memory_person_list', '/persons')
+    api.route(JeanList, 'cached_memory_jean_list', '/jeans')
+    client = app.test_client()
+    try:
+        assert len(get(client, '/persons')['data']) == 5
+        assert [person['attributes']['name'] for person in get(client, '/jeans')['data']] == ['Jean']
+        assert len(get(client, '/persons')['data']) == 5
+    finally:
+        invalidate(persons)
+
+
+def test_caching_data_layer_invalidated_while_reading():
+    store = InMemoryStore([InMemoryObject(name='Paul')])
+
+    class RacingDataLayer(InMemoryDataLayer):
+        def get_collection(self, qs, view_kwargs, filters=None):
+            result = super(RacingDataLayer, self).get_collection(qs, view_kwargs, filters=filters)
+            # a write of another request invalidates the namespace before the stale result is cached
+            if len(store) == 1:
+                store.add(InMemoryObject(name='Jean'))
+                invalidate(store)
+            return result
+
+    class RacingPersonSchema(Schema):
+        class Meta:
+            type_ = 'racing_memory_person'
+
+        id = fields.Integer(as_string=True)
+        name = fields.Str(allow_none=True)
+
+    class PersonList(ResourceList):
+        schema = RacingPersonSchema
+        data_layer = {'class': RacingDataLayer, 'store': store, 'cache': True}
+
+    app = Flask(__name__)
+    Api(app).route(PersonList, 'racing_memory_person_list', '/persons')
+    client = app.test_client()
+    assert get(client, '/persons')['meta']['count'] == 1
+    assert get(client, '/persons')['meta']['count'] == 2
+
+    get_cache(store)
+    with pytest.raises(Exception):
+        get_cache(store, max_size=2)
+
+
+def test_caching_data_layer_without_layer():
+    with pytest.raises(Exception):
+        CachingDataLayer(dict())
+
+
+@pytest.mark.parametrize('cache', [True], indirect=True)
+def test_permission_filter(stores, cache):
+    persons, computers = stores
+
+    class RestrictedPersonSchema(Schema):
+        class Meta:
+            type_ = 'restricted_memory_person'
+
+        id = fields.Integer(as_string=True)
+        name = fields.Str(allow_none=True)
+
+    class PersonList(ResourceList):
+        schema = RestrictedPersonSchema
+        data_layer = {'class': InMemoryDataLayer, 'store': persons, 'cache': cache}
+
+    class PersonDetail(ResourceDetail):
+        schema = RestrictedPersonSchema
+        data_layer = {'class': InMemoryDataLayer, 'store': persons}
+
+    def permission_filter(resource, method):
+        return [{'name': 'name', 'op': 'in', 'val': request.headers['X-Names'].split(',')}]
+
+    app = Flask(__name__)
+    api = Api(app)
+    api.permission_filter(permission_filter, identity=lambda: request.headers['X-Names'])
+    api.route(PersonList, 'restricted_memory_person_list', '/persons')
+    api.route(PersonDetail, 'restricted_memory_person_detail', '/persons/<int:id>')
+    client = app.test_client()
+
+    for allowed in ('Paul,Jean', 'Paul'):
+        response = client.get('/persons?page[size]=1', headers=dict(HEADERS, **{'X-Names': allowed}))
+        result = json.loads(response.get_data())
+        assert result['meta']['count'] == len(allowed.split(','))
+        assert names(result) == ['Paul']
+
+    response = client.get('/persons/2', headers=dict(HEADERS, **{'X-Names': 'Paul'}))
+    assert json.loads(response.get_data()) is None
+    response = client.get('/persons/2', headers=dict(HEADERS, **{'X-Names': 'Jean'}))
+    assert json.loads(response.get_data())['data']['attributes']['name'] == 'Jean'
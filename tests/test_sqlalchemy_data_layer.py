@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import datetime
+import threading
+
 from six.moves.urllib.parse import urlencode, parse_qs
 import pytest
 
-from sqlalchemy import create_engine, Column, Integer, DateTime, String, ForeignKey
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy import event, create_engine, inspect, Column, Integer, DateTime, String, ForeignKey
+from sqlalchemy.orm import sessionmaker, relationship, object_session, scoped_session
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
-from flask import Blueprint, make_response, json
+from flask import Flask, Blueprint, make_response, json, request
 from marshmallow_jsonapi.flask import Schema, Relationship
 from marshmallow import Schema as MarshmallowSchema
 from marshmallow_jsonapi import fields
@@ -15,14 +19,30 @@ from marshmallow import ValidationError
 from flask_rest_jsonapi import Api, ResourceList, ResourceDetail, ResourceRelationship, JsonApiException
 from flask_rest_jsonapi.pagination import add_pagination_links
 from flask_rest_jsonapi.exceptions import RelationNotFound, InvalidSort, InvalidFilters, InvalidInclude, BadRequest
+from flask_rest_jsonapi.exceptions import ServiceUnavailable, TooManyRequests
 from flask_rest_jsonapi.querystring import QueryStringManager as QSManager
 from flask_rest_jsonapi.data_layers.alchemy import SqlalchemyDataLayer
 from flask_rest_jsonapi.data_layers.base import BaseDataLayer
-from flask_rest_jsonapi.data_layers.filtering.alchemy import Node
+from flask_rest_jsonapi.data_layers.caching import CachingDataLayer
+from flask_rest_jsonapi.data_layers.filtering.alchemy import Node, merge_relationship_filters, get_coercers, \
+    create_in_list_filter
+from flask_rest_jsonapi.data_layers.instrumentation import CompiledCacheStats
+from flask_rest_jsonapi.admission import LocalAdmissionBackend
 from flask_rest_jsonapi.decorators import check_headers, check_method_requirements, jsonapi_exception_formatter
 import flask_rest_jsonapi.decorators
 import flask_rest_jsonapi.resource
 import flask_rest_jsonapi.schema
+import flask_rest_jsonapi.data_layers.filtering.alchemy
+
+# cached objects are pickled, so their model can't be defined in a fixture
+cache_base = declarative_base()
+
+
+class CachedCountry(cache_base):
+    __tablename__ = 'cached_country'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
 
 
 @pytest.fixture(scope="module")
@@ -624,6 +644,22 @@ def test_compute_schema_propagate_context(person_schema, computer_schema):
     assert schema.declared_fields['computers'].__dict__['_Relationship__schema'].__dict__['context'] == dict(foo='bar')
 
 
+def test_plan_includes(app, session, person_model, person_schema, person_list):
+    include = ['computers', 'computers.owner', 'computers.owner.computers']
+    assert flask_rest_jsonapi.schema.plan_includes(include) == {'computers': {'owner': {'computers': {}}}}
+
+    with app.test_request_context('/persons'):
+        qsm = QSManager({'include': ','.join(include[:2])}, person_schema)
+        schema = flask_rest_jsonapi.schema.compute_schema(person_schema, dict(), qsm, qsm.include)
+        assert schema.include_data == ('computers',)
+        assert schema.declared_fields['computers'].__dict__['_Relationship__schema'].include_data == ('owner',)
+
+        dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list))
+        statement = str(dl.eagerload_includes(session.query(person_model), qsm))
+        assert statement.count('JOIN computer') == 1
+        assert statement.count('JOIN person') == 1
+
+
 # test good cases
 def test_get_list(client, register_routes, person, person_2):
     with client:
@@ -680,6 +716,28 @@ def test_get_list_with_simple_filter(client, register_routes, person, person_2):
         assert response.status_code == 200, response.json['errors']
 
 
+def test_compiled_cache_stats(client, register_routes, engine, person, person_2):
+    stats = CompiledCacheStats(engine)
+    try:
+        for value in ('test', 'test2'):
+            querystring = urlencode({'page[number]': 2,
+                                     'page[size]': 1,
+                                     'include': 'computers.owner',
+                                     'sort': '-name',
+                                     'filter': json.dumps([{'name': 'name', 'op': 'in_', 'val': [value, 'other']}])})
+            with client:
+                response = client.get('/persons' + '?' + querystring, content_type='application/vnd.api+json')
+                assert response.status_code == 200, response.json['errors']
+            if value == 'test':
+                stats.reset()
+    finally:
+        stats.remove(engine)
+
+    assert stats.misses == 0
+    assert stats.hits > 0
+    assert stats.hit_ratio == 1
+
+
 def test_get_list_disable_pagination(client, register_routes):
     with client:
         querystring = urlencode({'page[size]': 0})
@@ -687,6 +745,65 @@ def test_get_list_disable_pagination(client, register_routes):
         assert response.status_code == 200, response.json['errors']
 
 
+def test_qs_manager_cost(app, person_schema):
+    filters = [{'or': [{'name': 'name', 'op': 'eq', 'val': 'a'}, {'name': 'name', 'op': 'eq', 'val': 'b'}]}]
+    qsm = QSManager({'page[size]': '10',
+                     'include': 'computers.owner',
+                     'sort': '-name',
+                     'filter': json.dumps(filters)}, person_schema)
+    with app.app_context():
+        assert qsm.cost() == 10 + 100 + 100 + 2 * 10 + 10
+        assert qsm.cost(to_many_factor=1, rows=1) == 1 + 1 + 1 + 2 * 10 + 10
+
+        qsm.qs['page[computers][size]'] = '2'
+        assert qsm.pagination == {'size': '10'}
+        assert qsm.include_pagination == {'computers': 2}
+        assert qsm.cost() == 10 + 20 + 20 + 2 * 10 + 10
+
+
+def test_qs_manager_max_include_depth(app, person_schema, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_INCLUDE_DEPTH', 1)
+    with app.app_context():
+        assert QSManager({'include': 'computers'}, person_schema).include == ['computers']
+        with pytest.raises(InvalidInclude):
+            QSManager({'include': 'computers,computers.owner'}, person_schema).include
+
+
+def test_get_list_query_cost(app, client, register_routes, person_list, person, person_2, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_QUERY_COST', 50)
+    querystring = urlencode({'page[size]': 10, 'include': 'computers'})
+    with client:
+        response = client.get('/persons?' + querystring, content_type='application/vnd.api+json')
+        assert response.status_code == 400
+        assert response.json['errors'][0]['title'] == 'Query too expensive'
+
+        monkeypatch.setattr(person_list, 'query_cost_strategy', 'downscale', raising=False)
+        response = client.get('/persons?' + querystring, content_type='application/vnd.api+json')
+        assert response.status_code == 200, response.json['errors']
+        assert 'page%5Bsize%5D=4' in response.json['links']['self']
+
+        monkeypatch.setattr(person_list, 'max_query_cost', 10, raising=False)
+        response = client.get('/persons?' + querystring, content_type='application/vnd.api+json')
+        assert response.status_code == 400
+
+
+def test_get_list_aggregates(client, register_routes, person, person_2):
+    querystring = urlencode({'aggregate[count]': '*',
+                             'aggregate[max]': 'birth_date',
+                             'group_by': 'name',
+                             'filter': json.dumps([{'name': 'name', 'op': 'in_', 'val': ['test', 'test2']}])})
+    with client:
+        response = client.get('/persons?' + querystring, content_type='application/vnd.api+json')
+        assert response.status_code == 200, response.json['errors']
+        assert response.json['meta']['aggregates'] == [
+            {'group': {'name': 'test'}, 'count': {'*': 1}, 'max': {'birth_date': None}},
+            {'group': {'name': 'test2'}, 'count': {'*': 1}, 'max': {'birth_date': None}}]
+
+        querystring = urlencode({'aggregate[avg]': 'unknown'})
+        response = client.get('/persons?' + querystring, content_type='application/vnd.api+json')
+        assert response.status_code == 400
+
+
 def test_head_list(client, register_routes):
     with client:
         response = client.head('/persons', content_type='application/vnd.api+json')
@@ -1179,6 +1296,207 @@ def test_get_list_invalid_sort(client, register_routes):
         assert response.status_code == 400, response.json['errors']
 
 
+def test_get_collection_sort_relationship_path(app, session, computer_model, computer_schema, person, person_2,
+                                               computer):
+    other_computer = computer_model(serial='2', person_id=person.person_id)
+    computer.person_id = person_2.person_id
+    session.add(other_computer)
+    session.commit()
+    dl = SqlalchemyDataLayer(dict(session=session, model=computer_model,
+                                  resource=type('ComputerList', (ResourceList,), {'schema': computer_schema})))
+    try:
+        with app.test_request_context():
+            for sort, serials in (('-owner.name', ['1', '2']), ('owner.name,-serial', ['2', '1'])):
+                ids = '{},{}'.format(computer.id, other_computer.id)
+                qs = QSManager({'sort': sort, 'filter[id]': ids}, computer_schema)
+                count, objects = dl.get_collection(qs, dict())
+                assert [obj.serial for obj in objects] == serials
+    finally:
+        session.delete(other_computer)
+        session.commit()
+
+
+def test_merge_relationship_filters():
+    owner_name = {'name': 'owner', 'op': 'has', 'val': {'name': 'name', 'op': 'eq', 'val': 'test'}}
+    owner_birth_date = {'name': 'owner', 'op': 'has', 'val': {'name': 'birth_date', 'op': 'eq', 'val': None}}
+    computer_serial = {'name': 'computers', 'op': 'any', 'val': {'name': 'serial', 'op': 'eq', 'val': '1'}}
+    filters = [owner_name, computer_serial, computer_serial, owner_birth_date]
+
+    merged = merge_relationship_filters(filters, ('has',), 'and')
+    assert merged == [{'name': 'owner', 'op': 'has', 'val': {'and': [owner_name['val'], owner_birth_date['val']]}},
+                      computer_serial, computer_serial]
+    assert owner_name['val'] == {'name': 'name', 'op': 'eq', 'val': 'test'}
+
+    merged = merge_relationship_filters(filters, ('has', 'any'), 'or')
+    assert merged[1] == {'name': 'computers', 'op': 'any',
+                         'val': {'or': [computer_serial['val'], computer_serial['val']]}}
+
+
+def test_filter_query_relationship_strategies(app, session, computer_model, computer_schema, person, person_2,
+                                              computer):
+    computer.person_id = person.person_id
+    session.commit()
+    resource = type('ComputerList', (ResourceList,), {'schema': computer_schema})
+    filters = [{'name': 'owner', 'op': 'has', 'val': {'name': 'name', 'op': 'eq', 'val': 'test'}},
+               {'name': 'owner', 'op': 'has', 'val': {'name': 'name', 'op': 'ne', 'val': 'test2'}},
+               {'name': 'id', 'op': 'eq', 'val': computer.id}]
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=computer_model, resource=resource))
+    query = dl.filter_query(session.query(computer_model), filters, computer_model, {})
+    assert str(query).count('EXISTS') == 1
+    assert query.all() == [computer]
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=computer_model, resource=resource,
+                                  filter_join_strategy='join'))
+    joins = {}
+    query = dl.filter_query(session.query(computer_model), filters, computer_model, joins)
+    query = dl.sort_query(query, [dict(field='person.name', order='asc')], joins)
+    assert 'EXISTS' not in str(query) and 'DISTINCT' not in str(query)
+    assert str(query).count('JOIN person') == 1
+    assert query.all() == [computer]
+
+    negated = [{'not': filters[0]}, filters[2]]
+    assert dl.filter_query(session.query(computer_model), negated, computer_model, {}).all() == []
+    assert 'EXISTS' in str(dl.filter_query(session.query(computer_model), negated, computer_model, {}))
+
+
+def test_filter_value_coercion(person_model, person_schema):
+    coercers = get_coercers(person_schema, person_model)
+    assert get_coercers(person_schema, person_model) is coercers
+    assert set(coercers) == {'id', 'birth_date'}
+
+    resource = type('PersonList', (ResourceList,), {'schema': person_schema})
+    condition = Node(person_model, {'name': 'id', 'op': 'in_', 'val': ['1', '2']}, resource, person_schema).resolve()
+    assert condition.right.value == [1, 2]
+    condition = Node(person_model, {'name': 'birth_date', 'op': 'ge', 'val': '2020-01-02T03:04:05'}, resource,
+                     person_schema).resolve()
+    assert condition.right.value == datetime.datetime(2020, 1, 2, 3, 4, 5)
+    condition = Node(person_model, {'name': 'name', 'op': 'eq', 'val': '1'}, resource, person_schema).resolve()
+    assert condition.right.value == '1'
+
+    with pytest.raises(InvalidFilters):
+        Node(person_model, {'name': 'id', 'op': 'eq', 'val': 'one'}, resource, person_schema).resolve()
+
+
+def test_filter_datetime_column_by_date(tmpdir, person_model, person_schema):
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('filter_by_date.db')))
+    person_model.metadata.create_all(engine)
+    session_ = sessionmaker(bind=engine)()
+    session_.add_all([person_model(name='Jim', birth_date=datetime.datetime(1995, 5, 1)),
+                      person_model(name='Jim', birth_date=datetime.datetime(1985, 5, 1)),
+                      person_model(name='Jimmy', birth_date=datetime.datetime(1990, 1, 1, 12))])
+    session_.commit()
+
+    resource = type('PersonList', (ResourceList,), {'schema': person_schema})
+    dl = SqlalchemyDataLayer(dict(session=session_, model=person_model, resource=resource))
+    # the example of docs/filtering.rst
+    filters = [{'and': [{'name': 'name', 'op': 'like', 'val': '%Jim%'},
+                        {'name': 'birth_date', 'op': 'gt', 'val': '1990-01-01'}]}]
+    query = dl.filter_query(session_.query(person_model), filters, person_model).order_by(person_model.birth_date)
+    assert [person_.birth_date.year for person_ in query] == [1990, 1995]
+
+    condition = Node(person_model, {'name': 'birth_date', 'op': 'gt', 'val': '1990-01-01'}, resource,
+                     person_schema).resolve()
+    assert condition.right.value == datetime.datetime(1990, 1, 1)
+    with pytest.raises(InvalidFilters):
+        Node(person_model, {'name': 'birth_date', 'op': 'gt', 'val': 'yesterday'}, resource, person_schema).resolve()
+
+
+def test_filter_integer_column_by_fractional_number(person_model, person_schema):
+    resource = type('PersonList', (ResourceList,), {'schema': person_schema})
+    condition = Node(person_model, {'name': 'id', 'op': 'lt', 'val': '2'}, resource, person_schema).resolve()
+    assert condition.right.value == 2
+    for value in (1.5, '1.5', float('inf')):
+        with pytest.raises(InvalidFilters):
+            Node(person_model, {'name': 'id', 'op': 'lt', 'val': value}, resource, person_schema).resolve()
+
+
+def test_filter_large_in_list(app, session, person_model, person_schema, person, person_2, monkeypatch):
+    resource = type('PersonList', (ResourceList,), {'schema': person_schema})
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=resource))
+    ids = [str(person.person_id), str(person_2.person_id)] + [str(-i) for i in range(1, 150)]
+
+    with app.app_context():
+        query = dl.filter_query(session.query(person_model), [{'name': 'id', 'op': 'in', 'val': ids}], person_model)
+        assert 'json_each' in str(query)
+        assert str(query) == str(dl.filter_query(session.query(person_model),
+                                                 [{'name': 'id', 'op': 'in', 'val': ids[:120]}], person_model))
+        assert set(query.all()) == {person, person_2}
+
+        query = dl.filter_query(session.query(person_model), [{'name': 'id', 'op': 'notin_', 'val': ids}],
+                                person_model)
+        assert person not in query.all() and person_2 not in query.all()
+
+        monkeypatch.setitem(app.config, 'FILTER_IN_LIST_THRESHOLD', 1000)
+        query = dl.filter_query(session.query(person_model), [{'name': 'id', 'op': 'in', 'val': ids}], person_model)
+        assert 'json_each' not in str(query)
+
+    condition = create_in_list_filter(person_model.person_id, [1, 2, 3], 'postgresql')
+    assert '= ANY (' in str(condition.compile(dialect=postgresql.dialect()))
+
+
+def test_get_list_max_filter_in_size(client, register_routes, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_FILTER_IN_SIZE', 2)
+    with client:
+        response = client.get('/persons?filter[id]=1,2', content_type='application/vnd.api+json')
+        assert response.status_code == 200
+        response = client.get('/persons?filter[id]=1,2,3', content_type='application/vnd.api+json')
+        assert response.status_code == 400
+        querystring = urlencode({'filter': json.dumps([{'not': {'name': 'id', 'op': 'in_', 'val': [1, 2, 3]}}])})
+        response = client.get('/persons?' + querystring, content_type='application/vnd.api+json')
+        assert response.status_code == 400
+
+
+def test_get_list_include_pagination(client, register_routes, session, computer_model, person, computer):
+    other_computer = computer_model(serial='2', person_id=person.person_id)
+    computer.person_id = person.person_id
+    session.add(other_computer)
+    session.commit()
+    try:
+        with client:
+            querystring = urlencode({'include': 'computers', 'page[computers][size]': 1,
+                                     'filter[id]': person.person_id})
+            response = client.get('/persons?' + querystring, content_type='application/vnd.api+json')
+            assert response.status_code == 200, response.json['errors']
+            relationship = response.json['data'][0]['relationships']['computers']
+            assert relationship['data'] == [{'type': 'computer', 'id': str(computer.id)}]
+            assert relationship['meta'] == {'count': 2}
+            assert parse_qs(relationship['links']['next'].split('?', 1)[1]) == {'page[size]': ['1'],
+                                                                               'page[number]': ['2']}
+            assert [item['id'] for item in response.json['included']] == [str(computer.id)]
+
+            querystring = urlencode({'include': 'computers', 'page[computers][size]': 2})
+            response = client.get('/persons/{}?{}'.format(person.person_id, querystring),
+                                  content_type='application/vnd.api+json')
+            assert response.status_code == 200
+            assert len(response.json['data']['relationships']['computers']['data']) == 2
+            assert 'next' not in response.json['data']['relationships']['computers']['links']
+
+            for querystring in ({'page[computers][size]': 1}, {'include': 'computers', 'page[computers][size]': 0},
+                                {'include': 'computers', 'page[name][size]': 1}):
+                response = client.get('/persons?' + urlencode(querystring), content_type='application/vnd.api+json')
+                assert response.status_code == 400
+    finally:
+        session.delete(other_computer)
+        session.commit()
+
+
+def test_get_list_sort_relationship_path_error(client, register_routes):
+    with client:
+        for sort in ('computers.serial', 'name.first', 'computers.unknown'):
+            response = client.get('/persons?' + urlencode({'sort': sort}), content_type='application/vnd.api+json')
+            assert response.status_code == 400
+
+
+def test_sqlalchemy_data_layer_sort_query_joins(session, computer_model):
+    dl = SqlalchemyDataLayer(dict(session=session, model=computer_model))
+    joins = {}
+    query = dl.sort_query(session.query(computer_model), [dict(field='person.name', order='asc'),
+                                                          dict(field='person.birth_date', order='desc')], joins)
+    assert list(joins) == [('person',)]
+    assert str(query).count('JOIN person') == 1
+
+
 def test_get_detail_object_not_found(client, register_routes):
     with client:
         response = client.get('/persons/3', content_type='application/vnd.api+json')
@@ -1261,6 +1579,371 @@ def test_sqlalchemy_data_layer_without_model(session, person_list):
         SqlalchemyDataLayer(dict(session=session, resource=person_list))
 
 
+def test_sqlalchemy_data_layer_concurrent_count(app, person_model, person_schema, tmpdir):
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('count.db')))
+    person_model.metadata.create_all(engine)
+    session_ = sessionmaker(bind=engine)()
+    session_.add_all([person_model(name='one'), person_model(name='two'), person_model(name='three')])
+    session_.commit()
+
+    threads = set()
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def record_thread(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT COUNT'):
+            threads.add(threading.current_thread())
+
+    dl = SqlalchemyDataLayer(dict(session=session_, model=person_model, concurrent_count=True))
+    with app.test_request_context('/persons'):
+        qs = QSManager({'page[size]': '2', 'sort': 'name'}, person_schema)
+        count, collection = dl.get_collection(qs, dict())
+    assert count == 3
+    assert [person.name for person in collection] == ['one', 'three']
+    assert threading.current_thread() not in threads
+
+    threads.clear()
+    session_.add(person_model(name='four'))
+    with app.test_request_context('/persons'):
+        count, collection = dl.get_collection(qs, dict())
+    assert count == 4
+    assert threads == {threading.current_thread()}
+
+
+def test_sqlalchemy_data_layer_concurrent_count_after_flush(app, person_model, person_schema, tmpdir):
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('count_flush.db')))
+    person_model.metadata.create_all(engine)
+    session_ = sessionmaker(bind=engine)()
+    session_.add_all([person_model(name='one'), person_model(name='two')])
+    session_.commit()
+
+    dl = SqlalchemyDataLayer(dict(session=session_, model=person_model, concurrent_count=True))
+    qs = QSManager({'page[size]': '10'}, person_schema)
+    session_.add(person_model(name='three'))
+    session_.flush()
+    assert not session_.new
+    assert dl.get_concurrent_count_bind(session_) is None
+    with app.test_request_context('/persons'):
+        count, collection = dl.get_collection(qs, dict())
+    assert count == len(collection) == 3
+
+    session_.commit()
+    assert dl.get_concurrent_count_bind(session_) is engine
+
+    session_.execute(person_model.__table__.insert().values(name='four'))
+    assert dl.get_concurrent_count_bind(session_) is None
+    session_.rollback()
+    assert dl.get_concurrent_count_bind(session_) is engine
+    session_.close()
+
+
+def test_sqlalchemy_data_layer_concurrent_count_in_memory(app, session, person_model, person_schema):
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, concurrent_count=True))
+    assert dl.get_concurrent_count_bind(session) is None
+
+
+def test_sqlalchemy_data_layer_read_session(app, person_model, person_schema, person_list, tmpdir):
+    sessions = []
+    for name in ('primary', 'replica'):
+        engine = create_engine('sqlite:///{}'.format(tmpdir.join(name + '.db')))
+        person_model.metadata.create_all(engine)
+        session_ = sessionmaker(bind=engine)()
+        session_.add(person_model(person_id=1, name=name))
+        session_.commit()
+        sessions.append(session_)
+    primary, replica = sessions
+
+    dl = SqlalchemyDataLayer(dict(session=primary, read_session=replica, model=person_model, resource=person_list))
+    qs = QSManager({}, person_schema)
+
+    with app.test_request_context('/persons'):
+        assert [person.name for person in dl.get_collection(qs, dict())[1]] == ['replica']
+        assert dl.get_object({'id': 1}).name == 'replica'
+
+    with app.test_request_context('/persons', method='POST'):
+        assert dl.get_object({'id': 1}).name == 'primary'
+
+    with app.test_request_context('/persons'):
+        dl.create_object({'name': 'new'}, dict())
+        assert dl.get_collection(qs, dict())[0] == 2
+
+    dl.sticky_primary_seconds = 60
+    with app.test_request_context('/persons', method='POST'):
+        dl.create_object({'name': 'other'}, dict())
+    with app.test_request_context('/persons'):
+        assert dl.get_collection(qs, dict())[0] == 3
+
+
+def test_sqlalchemy_data_layer_read_session_removed(person_model, person_schema, person_list, tmpdir):
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('scoped_replica.db')))
+    person_model.metadata.create_all(engine)
+    replica = scoped_session(sessionmaker(bind=engine))
+    replica.add(person_model(person_id=1, name='replica'))
+    replica.commit()
+    replica.remove()
+
+    app = Flask(__name__)
+    Api(app)
+    dl = SqlalchemyDataLayer(dict(session=sessionmaker(bind=engine)(), read_session=replica, model=person_model,
+                                  resource=person_list))
+    with app.test_request_context('/persons'):
+        assert dl.get_object({'id': 1}).name == 'replica'
+        assert replica.registry.has()
+    assert not replica.registry.has()
+
+
+def test_sqlalchemy_data_layer_deferred_join(app, tmpdir, person_model, computer_model, person_schema, person_list):
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('deferred_join.db')))
+    person_model.metadata.create_all(engine)
+    session_ = sessionmaker(bind=engine)()
+    session_.add_all([person_model(name=name, computers=[computer_model(serial=name)])
+                      for name in ('one', 'two', 'three', 'four', 'five')])
+    session_.commit()
+
+    statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    qs = QSManager({'page[size]': '2', 'page[number]': '2', 'sort': '-name', 'filter[name]': 'one,two,three,four',
+                    'include': 'computers'}, person_schema)
+    with app.test_request_context('/persons'):
+        dl = SqlalchemyDataLayer(dict(session=session_, model=person_model, resource=person_list))
+        expected = [person.name for person in dl.get_collection(qs, dict())[1]]
+        session_.expunge_all()
+
+        dl = SqlalchemyDataLayer(dict(session=session_, model=person_model, resource=person_list, deferred_join=True))
+        del statements[:]
+        count, collection = dl.get_collection(qs, dict())
+
+    assert count == 4
+    assert [person.name for person in collection] == expected == ['one', 'four']
+    assert len(statements) == 3
+    assert 'LIMIT' in statements[1] and 'JOIN computer' not in statements[1]
+    assert 'LIMIT' not in statements[2] and 'JOIN computer' in statements[2]
+    assert [computer.serial for person in collection for computer in person.computers] == ['one', 'four']
+    assert len(statements) == 3
+
+    with app.test_request_context('/persons'):
+        qs = QSManager({'page[size]': '2', 'page[number]': '4'}, person_schema)
+        assert dl.get_collection(qs, dict()) == (5, [])
+
+
+def test_sqlalchemy_data_layer_include_pagination(app, tmpdir, person_model, computer_model, person_schema,
+                                                  person_list):
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('include_pagination.db')))
+    person_model.metadata.create_all(engine)
+    session_ = sessionmaker(bind=engine)()
+    session_.add_all([person_model(name='one', computers=[computer_model(serial=str(i)) for i in range(3)]),
+                      person_model(name='two', computers=[computer_model(serial='3')]),
+                      person_model(name='three')])
+    session_.commit()
+
+    statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    dl = SqlalchemyDataLayer(dict(session=session_, model=person_model, resource=person_list))
+    with app.test_request_context('/persons'):
+        qs = QSManager({'include': 'computers.owner', 'page[computers][size]': '2', 'sort': 'name'}, person_schema)
+        count, collection = dl.get_collection(qs, dict())
+        assert len(statements) == 2
+        pages = dl.get_include_pages(collection, qs)
+        assert len(statements) == 3
+        assert 'ROW_NUMBER() OVER (PARTITION BY' in statements[2].upper()
+        assert [[computer.serial for computer in page] for page in pages['computers']] == [['0', '1'], [], ['3']]
+        assert pages['computers'][0][0].person is collection[0]
+        assert len(statements) == 3
+
+        # the limited lists are not set on the objects, whose relationships still load every related object
+        assert [computer.serial for computer in collection[0].computers] == ['0', '1', '2']
+
+        session_.expunge_all()
+        obj = dl.get_object({'id': collection[0].person_id}, qs=qs)
+        assert [computer.serial for computer in dl.get_include_pages([obj], qs)['computers'][0]] == ['0', '1']
+        assert dl.get_relationship_counts([obj], ['computers']) == {'computers': [3]}
+
+
+def test_sqlalchemy_data_layer_get_object_identity_map(app, engine, session, person, person_model, person_schema,
+                                                       person_list):
+    statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    try:
+        dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list))
+        assert person.name == 'test'
+        del statements[:]
+        assert dl.get_object({'id': person.person_id}) is person
+        assert statements == []
+
+        with app.test_request_context('/persons?include=computers'):
+            qs = QSManager({'include': 'computers'}, person_schema)
+            assert dl.get_object({'id': person.person_id}, qs=qs) is person
+        assert len(statements) == 1
+
+        dl.memoize_get_object = True
+        person_id = person.person_id
+        session.expire(person)
+        del statements[:]
+        with app.test_request_context('/persons'):
+            assert dl.get_object({'id': person_id}) is person
+            assert dl.get_object({'id': person_id}) is person
+        assert len(statements) == 1
+
+        # objects loaded with includes are not memoized
+        del statements[:]
+        with app.test_request_context('/persons?include=computers'):
+            assert dl.get_object({'id': person_id}, qs=qs) is person
+            assert dl.get_object({'id': person_id}, qs=qs) is person
+        assert len(statements) == 2
+
+        # the memo is kept by data layer
+        other_dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list,
+                                            memoize_get_object=True,
+                                            retrieve_object_query=lambda view_kwargs, field, value:
+                                            session.query(person_model).filter(person_model.person_id < 0)))
+        with app.test_request_context('/persons'):
+            assert dl.get_object({'id': person_id}) is person
+            assert other_dl.get_object({'id': person_id}) is None
+
+        # the permission filters are applied to memoized objects
+        filters = []
+        dl.get_permission_filters = lambda: filters
+        with app.test_request_context('/persons'):
+            filters.append({'name': 'name', 'op': 'eq', 'val': 'test'})
+            del statements[:]
+            assert dl.get_object({'id': person_id}) is person
+            assert dl.get_object({'id': person_id}) is person
+            assert len(statements) == 1
+            filters[0] = {'name': 'name', 'op': 'eq', 'val': 'someone else'}
+            assert dl.get_object({'id': person_id}) is None
+    finally:
+        event.remove(engine, 'before_cursor_execute', record_statement)
+
+
+def test_sqlalchemy_data_layer_permission_filter(app, session, person, person_2, person_model, person_schema,
+                                                 person_list):
+    calls = []
+
+    def permission_filter(resource, method):
+        calls.append(method)
+        if request.headers.get('X-User') == 'admin':
+            return []
+        return [{'name': 'name', 'op': 'eq', 'val': 'test2'}, person_model.person_id > 0]
+
+    class RestrictedPersonList(person_list):
+        pass
+
+    api = Api()
+    api.permission_filter(permission_filter, identity=lambda: request.headers.get('X-User'))
+    api.bind_permission_filter(RestrictedPersonList)
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=RestrictedPersonList))
+    qs = QSManager({'page[size]': '1'}, person_schema)
+
+    with app.test_request_context('/persons', headers={'X-User': 'user'}):
+        object_count, collection = dl.get_collection(qs, dict())
+        assert (object_count, [obj.name for obj in collection]) == (1, ['test2'])
+        assert dl.get_object({'id': person.person_id}) is None
+        assert dl.get_object({'id': person_2.person_id}) is person_2
+
+    with app.test_request_context('/persons', headers={'X-User': 'admin'}):
+        assert dl.get_collection(qs, dict())[0] == session.query(person_model).count()
+        assert dl.get_object({'id': person.person_id}) is person
+
+    assert calls == ['GET', 'GET']
+
+
+def test_sqlalchemy_data_layer_related_permission_filter(app, tmpdir, person_model, computer_model, person_schema,
+                                                         computer_schema, person_list, person_computers):
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('related_permission_filter.db')))
+    person_model.metadata.create_all(engine)
+    session_ = sessionmaker(bind=engine)()
+    person_ = person_model(name='one', computers=[computer_model(serial=str(i)) for i in range(4)])
+    session_.add(person_)
+    session_.commit()
+
+    class RestrictedComputerList(ResourceList):
+        schema = computer_schema
+        data_layer = {'session': session_, 'model': computer_model}
+
+    class RestrictedPersonList(person_list):
+        pass
+
+    class RestrictedPersonComputers(person_computers):
+        pass
+
+    hidden_persons = []
+
+    def permission_filter(resource, method):
+        if resource is RestrictedComputerList:
+            return [{'name': 'serial', 'op': 'in_', 'val': ['1', '2']}]
+        if resource is RestrictedPersonList:
+            return [~person_model.name.in_(hidden_persons)]
+        return []
+
+    api = Api()
+    api.route(RestrictedComputerList, 'restricted_computer_list', '/restricted_computers')
+    api.route(RestrictedPersonList, 'restricted_person_list', '/restricted_persons')
+    api.route(RestrictedPersonComputers, 'restricted_person_computers', '/restricted_persons/<int:person_id>/computers')
+    api.permission_filter(permission_filter)
+
+    with app.test_request_context('/restricted_persons'):
+        dl = SqlalchemyDataLayer(dict(session=session_, model=person_model, resource=RestrictedPersonList))
+        assert dl.get_relationship_counts([person_], ['computers']) == {'computers': [2]}
+
+        qs = QSManager({'include': 'computers', 'page[computers][size]': '1'}, person_schema)
+        session_.expunge_all()
+        obj = dl.get_object({'id': person_.person_id}, qs=qs)
+        assert [computer.serial for computer in dl.get_include_pages([obj], qs)['computers'][0]] == ['1']
+
+        relationship_dl = SqlalchemyDataLayer(dict(session=session_,
+                                                   model=person_model,
+                                                   resource=RestrictedPersonComputers,
+                                                   url_field='person_id'))
+        obj, related = relationship_dl.get_relationship('computers', 'computer', 'id', {'person_id': obj.person_id})
+        assert [session_.query(computer_model).get(int(item['id'])).serial for item in related] == ['1', '2']
+
+    computer_id = session_.query(computer_model).filter_by(serial='1').one().id
+    owner_relationship = type('ComputerOwnerRelationship', (ResourceRelationship,), {'schema': computer_schema})
+    api.bind_permission_filter(owner_relationship)
+    owner_dl = SqlalchemyDataLayer(dict(session=session_, model=computer_model, resource=owner_relationship))
+    with app.test_request_context('/restricted_computers'):
+        assert owner_dl.get_relationship('person', 'person', 'person_id', {'id': computer_id})[1] == \
+            {'type': 'person', 'id': person_.person_id}
+        hidden_persons.append('one')
+        assert owner_dl.get_relationship('person', 'person', 'person_id', {'id': computer_id})[1] is None
+
+
+def test_sqlalchemy_data_layer_relationship_counts(app, engine, session, person, person_2, computer, person_model,
+                                                   person_list):
+    person.computers.append(computer)
+    session.commit()
+    assert (person.name, person_2.name) == ('test', 'test2')
+    statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    try:
+        dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list))
+        with app.test_request_context('/persons'):
+            counts = dl.get_relationship_counts([person_2, person, person_2], ['computers'])
+        assert counts == {'computers': [0, 1, 0]}
+        assert len(statements) == 1
+
+        with pytest.raises(Exception):
+            dl.get_relationship_counts([person], ['name'])
+    finally:
+        event.remove(engine, 'before_cursor_execute', record_statement)
+
+
 def test_sqlalchemy_data_layer_create_object_error(session, person_model, person_list):
     with pytest.raises(JsonApiException):
         dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list))
@@ -1896,6 +2579,219 @@ def test_api_resources(app, person_list):
     api.init_app(app)
 
 
+def test_bind_url_rules(register_routes, person_computers, computer_list):
+    assert person_computers._relationships_data['/persons/<int:person_id>/relationships/computers'] == \
+        ('computers', 'computers', 'computer', 'id')
+    assert person_computers._relationships_data['/persons/<int:person_id>/relationships/computer'] is None
+    assert computer_list._parent_filters['/persons/<int:person_id>/computers'] == ('person_id', 'person_id')
+    assert computer_list._parent_filters['/computers'] is None
+    assert computer_list._compute_parent_filter('/persons/<int:id>/computers') is None
+
+
+def test_parent_filter(app, client, register_routes, session, computer_model, computer_schema, person, person_2,
+                       computer):
+    class OwnedComputerList(ResourceList):
+        schema = computer_schema
+        data_layer = {'model': computer_model, 'session': session}
+        view_kwargs = True
+
+    api = Api(app)
+    api.route(OwnedComputerList, 'owned_computer_list', '/owners/<int:id>/computers', parent_filter={'owner': 'id'})
+    assert OwnedComputerList._parent_filters['/owners/<int:id>/computers'] == ('person_id', 'id')
+
+    computer.person = person
+    session.commit()
+    for person_, count in ((person, 1), (person_2, 0)):
+        response = client.get('/owners/{}/computers'.format(person_.person_id), content_type='application/vnd.api+json')
+        assert response.status_code == 200
+        assert [item['id'] for item in response.json['data']] == [str(computer.id)] * count
+
+    with pytest.raises(Exception):
+        api.route(OwnedComputerList, 'unknown_computer_list', '/unknown/<int:id>/computers',
+                  parent_filter={'unknown': 'id'})
+
+
+def test_api_oauth_manager(person_schema):
+    class OAuthPersonList(ResourceList):
+        schema = person_schema
+
+        def get(self):
+            oauth_requests.append(request.oauth)
+            response = make_response('{} {}'.format(request.oauth.user, ','.join(request.oauth.scopes)))
+            request.oauth.scopes.append('changed by the request')
+            return response
+
+    class OAuthToken(object):
+        def __init__(self, expires):
+            self.expires = expires
+
+    class OAuthRequest(object):
+        def __init__(self, user, expires):
+            self.user = user
+            self.scopes = ['list_person']
+            self.access_token = OAuthToken(expires)
+
+    class OAuthManager(object):
+        _after_request_funcs = []
+
+        @staticmethod
+        def _invalid_response(req):
+            return make_response('', 401)
+
+        def __init__(self):
+            self.verified = []
+
+        def verify_request(self, scopes):
+            token = request.headers.get('Authorization', '')
+            self.verified.append((token, scopes))
+            if token == 'Bearer expired':
+                return True, OAuthRequest('expired', datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+            return token == 'Bearer valid', OAuthRequest('user', None)
+
+    app = Flask(__name__)
+    app.config['OAUTH_TOKEN_CACHE_TTL'] = 60
+    api = Api(app)
+    oauth_manager = OAuthManager()
+    api.oauth_manager(oauth_manager)
+    api.route(OAuthPersonList, 'oauth_person_list', '/persons')
+    assert api.oauth_scopes[(OAuthPersonList, 'GET')] == ['list_person']
+    client = app.test_client()
+    oauth_requests = []
+
+    for token, status_code in (('valid', 200), ('valid', 200), ('invalid', 401), ('invalid', 401),
+                               ('expired', 200), ('expired', 200)):
+        response = client.get('/persons', headers={'Authorization': 'Bearer ' + token})
+        assert response.status_code == status_code
+        if token == 'valid':
+            assert response.get_data(as_text=True) == 'user list_person'
+    # a cached token gives a new oauth request to each request
+    assert oauth_requests[0] is not oauth_requests[1]
+    assert oauth_manager.verified == [('Bearer valid', ['list_person'])] + \
+        [('Bearer invalid', ['list_person'])] * 2 + [('Bearer expired', ['list_person'])] * 2
+
+    api.scope_setter(lambda resource, method: 'custom_scope')
+    client.get('/persons', headers={'Authorization': 'Bearer valid'})
+    assert oauth_manager.verified[-1] == ('Bearer valid', ['custom_scope'])
+
+
+def test_admission_control():
+    backend = LocalAdmissionBackend()
+    entered = threading.Event()
+    leave = threading.Event()
+
+    class SlowList(ResourceList):
+        concurrency_limit = 1
+        admission_backend = backend
+
+        def get(self):
+            entered.set()
+            leave.wait(5)
+            return make_response('')
+
+    class LimitedList(ResourceList):
+        rate_limit = {'rate': 0.5, 'burst': 2}
+        admission_backend = backend
+
+        def get(self):
+            return make_response('')
+
+    class SlowLimitedList(SlowList):
+        rate_limit = {'rate': 0.01, 'burst': 2}
+
+    app = Flask(__name__)
+    api = Api(app)
+    api.route(SlowList, 'slow_list', '/slow')
+    api.route(LimitedList, 'limited_list', '/limited')
+
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(app.test_client().get('/slow')))
+    thread.start()
+    try:
+        assert entered.wait(5)
+        response = app.test_client().get('/slow')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert response.json['errors'][0]['title'] == 'Service unavailable'
+    finally:
+        leave.set()
+        thread.join()
+    assert responses[0].status_code == 200
+    assert app.test_client().get('/slow').status_code == 200
+
+    client = app.test_client()
+    assert [client.get('/limited').status_code for i in range(3)] == [200, 200, 429]
+    assert client.get('/limited').headers['Retry-After'] == '2'
+
+    api.route(SlowLimitedList, 'slow_limited_list', '/slow_limited')
+    entered.clear()
+    leave.clear()
+    thread = threading.Thread(target=lambda: responses.append(app.test_client().get('/slow_limited')))
+    thread.start()
+    try:
+        assert entered.wait(5)
+        assert app.test_client().get('/slow_limited').status_code == 503
+    finally:
+        leave.set()
+        thread.join()
+    # the request shed with 503 didn't consume the second token
+    assert [client.get('/slow_limited').status_code for i in range(2)] == [200, 429]
+    assert not issubclass(ServiceUnavailable, TooManyRequests)
+
+
+def test_api_warmup(api, register_routes, person_list, person_schema, person_model, computer_schema, computer_model):
+    flask_rest_jsonapi.data_layers.filtering.alchemy.coercers_cache.clear()
+    person_list._data_layer.include_loaders.clear()
+
+    api.warmup()
+
+    coercers_cache = flask_rest_jsonapi.data_layers.filtering.alchemy.coercers_cache
+    assert coercers_cache[(person_schema, inspect(person_model))]['birth_date'] is not None
+    assert (computer_schema, inspect(computer_model)) in coercers_cache
+    assert (person_schema, (('computers', ()),)) in person_list._data_layer.include_loaders
+    assert '/persons' in person_list._parent_filters
+
+
+def test_api_warmup_unknown_related_schema(session, person_model):
+    class UnknownRelatedSchema(Schema):
+        class Meta:
+            type_ = 'unknown_related'
+
+        id = fields.Integer(as_string=True, attribute='person_id')
+        computers = Relationship(schema='DoesNotExistSchema', type_='computer', many=True)
+
+    class UnknownRelatedList(ResourceList):
+        schema = UnknownRelatedSchema
+        data_layer = {'session': session,
+                      'model': person_model}
+
+    app = Flask(__name__)
+    app.config['WARMUP_RESOURCES'] = True
+    api = Api(app)
+    with pytest.raises(Exception) as excinfo:
+        api.route(UnknownRelatedList, 'unknown_related_list', '/unknown_related')
+    assert 'DoesNotExistSchema' in str(excinfo.value)
+
+
+def test_api_warmup_unknown_model_relationship(session, person_model, computer_schema):
+    class UnknownModelRelationshipSchema(Schema):
+        class Meta:
+            type_ = 'unknown_model_relationship'
+
+        id = fields.Integer(as_string=True, attribute='person_id')
+        laptops = Relationship(schema='ComputerSchema', type_='computer', many=True)
+
+    class UnknownModelRelationshipList(ResourceList):
+        schema = UnknownModelRelationshipSchema
+        data_layer = {'session': session,
+                      'model': person_model}
+
+    api = Api()
+    api.route(UnknownModelRelationshipList, 'unknown_model_relationship_list', '/unknown_model_relationship')
+    with pytest.raises(Exception) as excinfo:
+        api.warmup()
+    assert 'laptops is not a relationship of Person' in str(excinfo.value)
+
+
 def test_relationship_containing_hyphens(api, app, client, person_schema, person_computers, register_routes,
                                          computer_schema, person):
     """
@@ -1927,3 +2823,35 @@ def test_relationship_containing_hyphens(api, app, client, person_schema, person
     response = client.get('/persons/{}/relationships/computers-owned'.format(person.person_id),
                           content_type='application/vnd.api+json')
     assert response.status_code == 200, response.json['errors']
+
+
+def test_caching_data_layer_detaches_objects(app, tmpdir):
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('cache.db')))
+    cache_base.metadata.create_all(engine)
+    session_ = sessionmaker(bind=engine)()
+    session_.add_all([CachedCountry(name='France'), CachedCountry(name='Italy')])
+    session_.commit()
+
+    class CachedCountrySchema(Schema):
+        class Meta:
+            type_ = 'cached_country'
+
+        id = fields.Integer(as_string=True)
+        name = fields.Str()
+
+    resource = type('CachedCountryList', (ResourceList,), {'schema': CachedCountrySchema})
+    dl = CachingDataLayer(dict(layer=SqlalchemyDataLayer(dict(session=session_, model=CachedCountry,
+                                                              resource=resource)),
+                               namespace='cached_country_{}'.format(tmpdir)))
+    qs = QSManager({'sort': 'name', 'page[size]': '10'}, CachedCountrySchema)
+    with app.test_request_context('/countries'):
+        count, first = dl.get_collection(qs, dict())
+    session_.close()
+
+    with app.test_request_context('/countries'):
+        queries = []
+        event.listen(engine, 'before_cursor_execute', lambda *args: queries.append(args[2]))
+        count, second = dl.get_collection(qs, dict())
+    assert count == 2 and queries == []
+    assert [country.name for country in second] == ['France', 'Italy']
+    assert all(country not in first and object_session(country) is session_ for country in second)